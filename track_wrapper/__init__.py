@@ -1,3 +1,14 @@
 """Python wrapper for TRACK for CMIP6 data"""
 
-from .track_wrapper import *
\ No newline at end of file
+from .track_wrapper import *
+from .backends import *
+from .environment import *
+from .tracks import *
+from .sampling import *
+from .planner import *
+from .incremental import *
+from .sweep import *
+from .service import *
+from .preview import *
+from .regions import *
+from .levels import *
@@ -0,0 +1,102 @@
+"""Command line interface of pyTRACK-CMIP6"""
+
+import argparse
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m track_wrapper")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    task = commands.add_parser("run-task",
+                               help="run one task of an array job")
+    task.add_argument("manifest", help="units.json file in the job directory")
+    task.add_argument("task", type=int, help="index of the task to run")
+    task.add_argument("--scratch", help="per-task scratch directory")
+
+    plan = commands.add_parser("plan",
+                               help="show stages, intermediate files, disk " +
+                                    "space and runtime of a tracking run")
+    plan.add_argument("infile", help="input .nc file")
+    plan.add_argument("outdirectory", nargs="?", default=".",
+                      help="directory the tracks would be output to")
+    plan.add_argument("--kind", default="mslp",
+                      choices=["mslp", "vor850", "era5_mslp", "era5_vor850"])
+    plan.add_argument("--infile2", help="second input file, for separate U " +
+                                        "and V files")
+    plan.add_argument("--sh", action="store_true",
+                      help="track the Southern Hemisphere")
+    plan.add_argument("--timestep", type=int,
+                      help="time step in hours to subsample to")
+    plan.add_argument("--years", type=int, nargs="+", help="years to track")
+    plan.add_argument("--workers", type=int, default=1,
+                      help="number of years run in parallel")
+
+    preview = commands.add_parser("preview",
+                                  help="quick count of cyclone centres and " +
+                                       "tracks, to check input files")
+    preview.add_argument("files", nargs="+", help="input .nc files")
+    preview.add_argument("--kind", default="mslp", choices=["mslp", "vor850"])
+    preview.add_argument("--sh", action="store_true",
+                         help="look at the Southern Hemisphere")
+    preview.add_argument("--years", type=int, nargs="+",
+                         help="years to look at")
+    preview.add_argument("--workers", type=int, default=1,
+                         help="number of files previewed in parallel")
+
+    serve = commands.add_parser("serve",
+                                help="run a local tracking service with " +
+                                     "warm TRACK workspaces")
+    serve.add_argument("--host", default="127.0.0.1",
+                       help="address to listen on")
+    serve.add_argument("--port", type=int, default=8642,
+                       help="port to listen on")
+    serve.add_argument("--directory",
+                       help="directory for the workspaces and job logs")
+    serve.add_argument("--workers", type=int, default=2,
+                       help="number of workspaces, i.e. concurrent jobs")
+    serve.add_argument("--token",
+                       help="token clients have to send, random by default")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run-task":
+        from .backends import run_task
+        result = run_task(args.manifest, args.task, scratch=args.scratch)
+        return int(result['status'] != 'done')
+
+    if args.command == "plan":
+        from .planner import plan
+        result = plan(args.infile, args.outdirectory, kind=args.kind,
+                      infile2=args.infile2, NH=not args.sh,
+                      timestep=args.timestep, years=args.years)
+        print(result.summary())
+        if args.workers > 1:
+            parallel = result.workers(args.workers)
+            print("With %d workers: %.0f s, %.1f MB scratch space" % (
+                    args.workers, parallel['seconds'],
+                    parallel['scratch_bytes'] / 1024.**2))
+        return 0
+
+    if args.command == "preview":
+        from .preview import triage
+        rows = triage(args.files, workers=args.workers, kind=args.kind,
+                      NH=not args.sh, years=args.years)
+        print("%-40s %6s %10s %8s %10s" % ("file", "year", "centres", "tracks",
+                                           "filtered"))
+        for row in rows:
+            if 'error' in row:
+                print("%-40s failed: %s" % (row['file'], row['error']))
+            else:
+                print("%-40s %6d %10.1f %8d %10d" % (row['file'], row['year'],
+                        row['centres_per_step'], row['ntracks'],
+                        row['nfiltered']))
+        return 0
+
+    if args.command == "serve":
+        from .service import serve
+        serve(host=args.host, port=args.port, directory=args.directory,
+              workers=args.workers, token=args.token)
+        return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
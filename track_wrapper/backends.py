@@ -0,0 +1,465 @@
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import tempfile
+import importlib
+import subprocess
+from multiprocessing import Pool
+
+from . import track_wrapper as tw
+from .planner import record_run
+
+__all__ = ['work_units', 'create_workspace', 'run_unit', 'LocalBackend',
+           'ArrayJobBackend']
+
+# tracking functions that can be run as work units, by kind
+TRACKING_FUNCTIONS = {'mslp': 'track_mslp',
+                      'vor850': 'track_uv_vor850',
+                      'era5_mslp': 'track_era5_mslp',
+                      'era5_vor850': 'track_era5_vor850'}
+
+# intermediate files the tracking functions write to indat and to the TRACK
+# directory, which are not linked into workspaces if an earlier run left them
+# in the installation
+_TEMPORARY_FILES = ["temp_file*", "tempyear*", "*_temp.dat", "T*filt_*.dat",
+                    "spec.test", "calcvor.test"]
+
+def _temporary(name):
+    # whether a file is one of the intermediate files of the tracking
+    return any([fnmatch.fnmatch(name, pattern)
+                for pattern in _TEMPORARY_FILES])
+
+def work_units(files, outdirectory, kind='mslp', hemispheres=['NH'],
+               years=None, **kwargs):
+    """
+    Split tracking of a set of input files into work units of one file, one
+    year and one hemisphere each, which is the unit of work of the loops in
+    the tracking functions.
+
+    Parameters
+    ----------
+
+    files : list
+        Paths to .nc input files. For vorticity tracking from separate U and V
+        files, an entry can be a pair of paths.
+
+    outdirectory : string
+        Path of directory to output tracks to
+
+    kind : string, optional
+        Type of tracking, one of 'mslp', 'vor850', 'era5_mslp' and
+        'era5_vor850', or 'module:function' for a custom tracking function
+        with the same arguments.
+
+    hemispheres : list of strings, optional
+        Hemispheres to track, 'NH' and/or 'SH'.
+
+    years : list of ints, optional
+        Years to track. By default, all years found in each file are tracked.
+
+    **kwargs
+        Further keyword arguments passed to the tracking function, e.g.
+        timestep or netcdf.
+
+    Returns
+    -------
+
+    units : list of dicts
+        Work units that can be run by any of the execution backends.
+
+    """
+    outdir = os.path.abspath(os.path.expanduser(outdirectory))
+    units = []
+    for file in files:
+        if isinstance(file, str):
+            file = [file]
+        file = [os.path.abspath(f) for f in file]
+
+        if years is None:
+            file_years = tw.cdo.showyear(input=file[0])[0].split()
+        else:
+            file_years = years
+
+        for year in file_years:
+            for hemisphere in hemispheres:
+                units.append({'kind': kind, 'files': file, 'year': int(year),
+                              'hemisphere': hemisphere, 'outdir': outdir,
+                              'kwargs': kwargs})
+    return units
+
+def create_workspace(path, trackdir=None):
+    """
+    Create an isolated TRACK workspace, so that several work units can run at
+    the same time without overwriting each other's intermediate files.
+
+    The workspace links to the TRACK installation, except for the indat and
+    outdat directories, which are private to the workspace, and intermediate
+    files left in the installation by earlier runs, which are not linked.
+
+    Parameters
+    ----------
+
+    path : string
+        Path of the workspace directory to create
+
+    trackdir : string, optional
+        TRACK installation to link to. Defaults to the current TRACK directory.
+
+    """
+    if trackdir is None:
+        trackdir = tw._track_dir()
+    trackdir = os.path.abspath(trackdir)
+    if os.path.isdir(trackdir) == False:
+        raise Exception("TRACK installation not found at " + trackdir + ".")
+
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(trackdir):
+        target = os.path.join(path, name)
+        if os.path.lexists(target) or _temporary(name):
+            continue
+        if name in ['indat', 'outdat']:
+            os.mkdir(target)
+            # input files like RUNDATIN are still read from the installation,
+            # but writing to a link to a stale intermediate file would
+            # overwrite the installation's copy
+            if name == 'indat':
+                for infile in os.listdir(os.path.join(trackdir, name)):
+                    if _temporary(infile):
+                        continue
+                    os.symlink(os.path.join(trackdir, name, infile),
+                               os.path.join(target, infile))
+        else:
+            os.symlink(os.path.join(trackdir, name), target)
+    return
+
+def _tracking_function(kind):
+    # returns the tracking function for a kind of work unit
+    if kind in TRACKING_FUNCTIONS:
+        return getattr(tw, TRACKING_FUNCTIONS[kind])
+    module, function = kind.split(':')
+    return getattr(importlib.import_module(module), function)
+
+def run_unit(unit, scratch=None, retries=0):
+    """
+    Run a single work unit.
+
+    Parameters
+    ----------
+
+    unit : dict
+        Work unit as returned by work_units
+
+    scratch : string, optional
+        Scratch directory for this unit. If given, TRACK is run in an isolated
+        workspace inside it, which is removed afterwards.
+
+    retries : int, optional
+        Number of times the unit is run again after a stage of the pipeline
+        failed, e.g. because of a transient file system error. Other errors
+        are not retried.
+
+    Returns
+    -------
+
+    result : dict
+        The work unit with its status ('done' or 'failed'), its runtime in
+        seconds, its number of attempts and the error message if it failed.
+        The runtimes of built-in kinds of tracking are also recorded for the
+        planner's calibration.
+
+    """
+    result = dict(unit)
+    kwargs = dict(unit['kwargs'])
+    kwargs['NH'] = unit['hemisphere'] == 'NH'
+    kwargs['years'] = [unit['year']]
+    if len(unit['files']) > 1:
+        kwargs['infile2'] = unit['files'][1]
+
+    trackdir = os.environ.get("TRACK_DIR")
+    cwd = os.getcwd()
+    start = time.time()
+    try:
+        if scratch is not None:
+            workspace = os.path.join(scratch, "TRACK")
+            create_workspace(workspace)
+            os.environ["TRACK_DIR"] = workspace
+        for attempt in range(retries + 1):
+            result['attempts'] = attempt + 1
+            try:
+                _tracking_function(unit['kind'])(unit['files'][0],
+                                                 unit['outdir'], **kwargs)
+                result['status'] = 'done'
+                result.pop('error', None)
+                break
+            except tw.StageError as err:
+                result['status'] = 'failed'
+                result['error'] = str(err)
+                print(str(err))
+                os.chdir(cwd)
+    except Exception as err:
+        result['status'] = 'failed'
+        result['error'] = str(err)
+    finally:
+        os.chdir(cwd)
+        if trackdir is None:
+            os.environ.pop("TRACK_DIR", None)
+        else:
+            os.environ["TRACK_DIR"] = trackdir
+        if scratch is not None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    result['seconds'] = time.time() - start
+    if unit['kind'] in TRACKING_FUNCTIONS:
+        record_run(unit['kind'], unit['files'], unit['year'],
+                   result['seconds'], status=result['status'],
+                   options=kwargs)
+    return result
+
+def _run_in_scratch(args):
+    # runs a work unit in its own scratch directory, for use in a Pool
+    unit, scratch, retries = args
+    return run_unit(unit, tempfile.mkdtemp(dir=scratch), retries=retries)
+
+class LocalBackend(object):
+    """Execution backend running work units on the local machine."""
+    def __init__(self, workers=1, scratch=None, retries=0):
+        """
+        Parameters
+        ----------
+
+        workers : int, optional
+            Number of work units to run at the same time. With more than one
+            worker, every unit runs in its own TRACK workspace.
+
+        scratch : string, optional
+            Directory for the per-unit workspaces. Defaults to the system
+            temporary directory.
+
+        retries : int, optional
+            Number of times a work unit is run again after a stage of the
+            pipeline failed, see run_unit.
+
+        """
+        self.workers = workers
+        self.scratch = scratch
+        self.retries = retries
+
+    def run(self, units):
+        """
+        Run work units and return their results.
+
+        Parameters
+        ----------
+
+        units : list of dicts
+            Work units as returned by work_units
+
+        """
+        if self.workers == 1:
+            return [run_unit(unit, retries=self.retries) for unit in units]
+
+        if self.scratch is not None:
+            os.makedirs(self.scratch, exist_ok=True)
+        with Pool(self.workers) as pool:
+            return pool.map(_run_in_scratch,
+                            [(unit, self.scratch, self.retries)
+                             for unit in units])
+
+class ArrayJobBackend(object):
+    """
+    Execution backend running work units as a SLURM or PBS array job, with
+    one array task per work unit.
+
+    The work units and results are kept in a job directory that needs to be
+    on a filesystem shared by all nodes. Every task runs in its own TRACK
+    workspace in a per-task scratch directory.
+    """
+    def __init__(self, jobdir, scheduler='slurm', scratch=None, options=[],
+                 emulate=False, workers=2):
+        """
+        Parameters
+        ----------
+
+        jobdir : string
+            Shared directory for the job script, work units, logs and results
+
+        scheduler : string, optional
+            Either 'slurm' or 'pbs'.
+
+        scratch : string, optional
+            Base directory for per-task scratch. Defaults to $TMPDIR on the
+            node, or the scratch folder in jobdir if $TMPDIR is not set.
+
+        options : list of strings, optional
+            Extra scheduler directives, e.g. ['--time=12:00:00'] for SLURM or
+            ['-l walltime=12:00:00'] for PBS.
+
+        emulate : boolean, optional
+            If true, the array job is not submitted but its tasks are run as
+            local subprocesses acting as nodes.
+
+        workers : int, optional
+            Number of emulated nodes running at the same time.
+
+        """
+        if scheduler not in ['slurm', 'pbs']:
+            raise Exception("Invalid scheduler. Please input 'slurm' or " +
+                                "'pbs'.")
+        self.jobdir = os.path.abspath(os.path.expanduser(jobdir))
+        self.scheduler = scheduler
+        self.scratch = scratch
+        self.options = options
+        self.emulate = emulate
+        self.workers = workers
+
+    def write_script(self, units):
+        """
+        Write the work units and the array job script into the job directory
+        and return the path of the script.
+
+        Parameters
+        ----------
+
+        units : list of dicts
+            Work units as returned by work_units
+
+        """
+        for folder in ['logs', 'results']:
+            os.makedirs(os.path.join(self.jobdir, folder), exist_ok=True)
+        manifest = os.path.join(self.jobdir, "units.json")
+        with open(manifest, "w") as file:
+            json.dump(units, file, indent=1)
+
+        if self.scratch is None:
+            scratch = "${TMPDIR:-" + os.path.join(self.jobdir, "scratch") + "}"
+        else:
+            scratch = self.scratch
+
+        if self.scheduler == 'slurm':
+            task = "$SLURM_ARRAY_TASK_ID"
+            header = ["#SBATCH --job-name=pyTRACK",
+                      "#SBATCH --array=0-" + str(len(units) - 1),
+                      "#SBATCH --output=" +
+                        os.path.join(self.jobdir, "logs", "task_%a.log")]
+            header += ["#SBATCH " + option for option in self.options]
+        else:
+            task = "$PBS_ARRAY_INDEX"
+            header = ["#PBS -N pyTRACK",
+                      "#PBS -J 0-" + str(len(units) - 1),
+                      "#PBS -j oe",
+                      "#PBS -o " + os.path.join(self.jobdir, "logs")]
+            header += ["#PBS " + option for option in self.options]
+
+        lines = ["#!/bin/bash"] + header + [
+                    "",
+                    "TASK=" + task,
+                    "SCRATCH=" + scratch + "/pyTRACK_task_$TASK",
+                    "mkdir -p $SCRATCH",
+                    "'" + sys.executable + "' -m track_wrapper run-task '" +
+                        manifest + "' $TASK --scratch $SCRATCH",
+                    ""]
+
+        script = os.path.join(self.jobdir, "track_array.sh")
+        with open(script, "w") as file:
+            file.write("\n".join(lines))
+        os.chmod(script, 0o755)
+        return script
+
+    def submit(self, units):
+        """
+        Submit work units as an array job, or run them as emulated nodes if
+        emulate is set. Returns the scheduler's job id, or 'local' if
+        emulated.
+
+        Parameters
+        ----------
+
+        units : list of dicts
+            Work units as returned by work_units
+
+        """
+        script = self.write_script(units)
+
+        if self.emulate == False:
+            if self.scheduler == 'slurm':
+                out = subprocess.check_output(["sbatch", "--parsable", script])
+            else:
+                out = subprocess.check_output(["qsub", script])
+            return out.decode().strip()
+
+        # emulation: run every task in a subprocess, a few at a time
+        env_name = {'slurm': "SLURM_ARRAY_TASK_ID",
+                    'pbs': "PBS_ARRAY_INDEX"}[self.scheduler]
+        running = []
+        for task in range(len(units)):
+            if len(running) >= self.workers:
+                running.pop(0).wait()
+            env = dict(os.environ)
+            env[env_name] = str(task)
+            log = open(os.path.join(self.jobdir, "logs",
+                                    "task_" + str(task) + ".log"), "w")
+            running.append(subprocess.Popen(["bash", script], env=env,
+                                            stdout=log, stderr=log))
+            log.close()
+        for process in running:
+            process.wait()
+        return 'local'
+
+    def collect(self):
+        """
+        Collect the results of all finished tasks from the job directory.
+        Tasks that have not finished are reported with status 'pending'.
+        """
+        with open(os.path.join(self.jobdir, "units.json"), "r") as file:
+            units = json.load(file)
+
+        results = []
+        for task, unit in enumerate(units):
+            resfile = os.path.join(self.jobdir, "results",
+                                   "task_" + str(task) + ".json")
+            if os.path.isfile(resfile):
+                with open(resfile, "r") as file:
+                    results.append(json.load(file))
+            else:
+                result = dict(unit)
+                result['status'] = 'pending'
+                results.append(result)
+        return results
+
+def run_task(manifest, task, scratch=None):
+    """
+    Run one task of an array job and write its result next to the work units,
+    as done on each node by the job script.
+
+    Parameters
+    ----------
+
+    manifest : string
+        Path of units.json file in the job directory
+
+    task : int
+        Index of the work unit to run
+
+    scratch : string, optional
+        Per-task scratch directory
+
+    """
+    with open(manifest, "r") as file:
+        unit = json.load(file)[int(task)]
+
+    result = run_unit(unit, scratch=scratch)
+
+    resdir = os.path.join(os.path.dirname(os.path.abspath(manifest)),
+                          "results")
+    os.makedirs(resdir, exist_ok=True)
+    # write to a temporary name first so that partial results are never read
+    resfile = os.path.join(resdir, "task_" + str(task) + ".json")
+    with open(resfile + ".tmp", "w") as file:
+        json.dump(result, file)
+    os.replace(resfile + ".tmp", resfile)
+
+    print("Task " + str(task) + ": " + result['status'])
+    return result
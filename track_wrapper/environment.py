@@ -0,0 +1,198 @@
+import os
+import json
+import glob
+import shutil
+import subprocess
+from pathlib import Path
+
+__all__ = ['probe_environment']
+
+# in-process copy of the probed environment, by requested TRACK directory
+_ENVIRONMENT = {}
+
+# paths of the tools built inside a TRACK installation
+_TRACK_TOOLS = {'master': "master",
+                'tr2nc': os.path.join("utils", "bin", "tr2nc")}
+
+def _cache_file():
+    # returns the path of the on-disk cache of the probed environment
+    cachedir = os.environ.get("XDG_CACHE_HOME", str(Path.home()) + "/.cache")
+    return os.path.join(cachedir, "pyTRACK-CMIP6", "environment.json")
+
+def _stamp(path):
+    # returns modification time and size of a file, used to invalidate the
+    # cache when a tool is rebuilt, upgraded or removed
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+def _version(command):
+    # returns the first line of a tool's version output that names a version
+    try:
+        proc = subprocess.run(command, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    for line in proc.stdout.decode(errors='replace').splitlines():
+        if 'version' in line.lower():
+            return line.strip()
+    return None
+
+def _find_track(trackdir=None):
+    # returns the first directory that looks like a TRACK installation
+    candidates = []
+    if trackdir is not None:
+        candidates.append(trackdir)
+    candidates.append(str(Path.home()) + "/TRACK-1.5.2")
+    candidates += sorted(glob.glob(str(Path.home()) + "/TRACK-*"))
+    for candidate in candidates:
+        if os.path.isfile(os.path.join(candidate, "bin", "track.linux")):
+            return os.path.abspath(candidate)
+    return None
+
+def _probe_track(trackdir=None):
+    # locates and validates TRACK and TR2NC, only needs file system checks
+    env = {'requested': trackdir, 'track': _find_track(trackdir),
+           'track.linux': None, 'master': None, 'tr2nc': None}
+    if env['track'] is not None:
+        env['track.linux'] = os.path.join(env['track'], "bin", "track.linux")
+        for tool, path in _TRACK_TOOLS.items():
+            if os.path.isfile(os.path.join(env['track'], path)):
+                env[tool] = os.path.join(env['track'], path)
+    env['stamps'] = {tool: _stamp(env[tool])
+                        for tool in ['track.linux', 'master', 'tr2nc']}
+    return env
+
+def _probe_tools():
+    # locates CDO and NCO and asks them for their versions
+    env = {'cdo': shutil.which(os.environ.get("CDO", "cdo")),
+           'ncks': shutil.which("ncks"),
+           'ncatted': shutil.which("ncatted")}
+    env['cdo_version'] = _version([env['cdo'], "-V"]) if env['cdo'] else None
+    env['nco_version'] = _version([env['ncks'], "--version"]) \
+                            if env['ncks'] else None
+    env['stamps'] = {tool: _stamp(env[tool])
+                        for tool in ['cdo', 'ncks', 'ncatted']}
+    return env
+
+def _valid(env):
+    # checks that a cached probe still matches the files on disk
+    for tool, stamp in env['stamps'].items():
+        if _stamp(env[tool]) != stamp:
+            return False
+    if 'cdo' in env:
+        if env['cdo'] != shutil.which(os.environ.get("CDO", "cdo")):
+            return False
+        if env['ncks'] != shutil.which("ncks"):
+            return False
+    # a TRACK installation may have appeared since the last probe
+    elif (env['track'] is None) and (_find_track(env['requested']) is not None):
+        return False
+    # or master and TR2NC may have been built since, e.g. by make utils
+    elif env['track'] is not None:
+        for tool, path in _TRACK_TOOLS.items():
+            if (env[tool] is None) and \
+                    os.path.isfile(os.path.join(env['track'], path)):
+                return False
+    return True
+
+def _load_cache():
+    # reads the on-disk cache, starting over if it is missing or unreadable
+    try:
+        with open(_cache_file(), "r") as file:
+            cache = json.load(file)
+        if isinstance(cache.get('track'), dict):
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {'tools': None, 'track': {}}
+
+def _save_cache(cache):
+    # writes the on-disk cache, dropping TRACK directories that no longer
+    # exist, such as removed workspaces
+    cache['track'] = {key: env for key, env in cache['track'].items()
+                        if (env['requested'] is None) or
+                            os.path.isdir(env['requested'])}
+    cachefile = _cache_file()
+    try:
+        os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+        tempfile = cachefile + "." + str(os.getpid())
+        with open(tempfile, "w") as file:
+            json.dump(cache, file, indent=1)
+        os.replace(tempfile, cachefile)
+    except OSError:
+        pass # the cache is only an optimisation
+
+def probe_environment(refresh=False):
+    """
+    Locate and validate the external tools used by pyTRACK-CMIP6: TRACK and
+    its master script, the TR2NC utility, CDO and NCO.
+
+    The result is cached on disk, and the cache is invalidated when any of the
+    tools changes, e.g. when TRACK is rebuilt or CDO is upgraded. TRACK is
+    searched for in the TRACK_DIR environment variable, ~/TRACK-1.5.2 and
+    other ~/TRACK-* directories.
+
+    Parameters
+    ----------
+
+    refresh : boolean, optional
+        If true, probe again even if the cache is valid.
+
+    Returns
+    -------
+
+    env : dict
+        Paths of the tools ('track', 'track.linux', 'master', 'tr2nc', 'cdo',
+        'ncks', 'ncatted'), None for any that were not found, and the CDO and
+        NCO versions ('cdo_version', 'nco_version').
+
+    """
+    trackdir = os.environ.get("TRACK_DIR")
+    key = str(trackdir)
+
+    if (refresh == False) and (key in _ENVIRONMENT):
+        return _ENVIRONMENT[key]
+
+    cache = _load_cache()
+    changed = False
+
+    tools = cache['tools']
+    if (refresh == True) or (tools is None) or (_valid(tools) == False):
+        tools = cache['tools'] = _probe_tools()
+        changed = True
+
+    track = cache['track'].get(key)
+    if (refresh == True) or (track is None) or (_valid(track) == False):
+        track = cache['track'][key] = _probe_track(trackdir)
+        changed = True
+
+    if changed == True:
+        _save_cache(cache)
+
+    env = {name: value for name, value in list(track.items()) +
+            list(tools.items()) if name not in ['stamps', 'requested']}
+    _ENVIRONMENT[key] = env
+    return env
+
+class LazyCdo(object):
+    """
+    Stand-in for a Cdo object that only creates it on first use, since
+    creating it runs CDO several times to discover its operators.
+    """
+    def __init__(self):
+        self._cdo = None
+
+    def __getattr__(self, name):
+        if name.startswith('__') or (name == '_cdo'):
+            raise AttributeError(name)
+        if self._cdo is None:
+            from cdo import Cdo
+            path = probe_environment()['cdo']
+            if path is None:
+                raise Exception("CDO was not found. Please install CDO or " +
+                                    "set the CDO environment variable.")
+            self._cdo = Cdo(cdo=path)
+        return getattr(self._cdo, name)
@@ -0,0 +1,291 @@
+import os
+import json
+import glob
+import shutil
+import tempfile
+import numpy as np
+from netCDF4 import Dataset, num2date, date2num
+
+from .tracks import TrackCollection, read_tracks, great_circle, EARTH_RADIUS
+from .track_wrapper import cdo, _reduction_operators
+from .backends import _tracking_function
+
+__all__ = ['append_series', 'stitch_tracks']
+
+KM_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+def _from_tracks(tracks, fields, time_units):
+    # builds a TrackCollection from a list of tracks given as dicts of arrays
+    if len(tracks) == 0:
+        return TrackCollection([], [], [], [], [], [], {name: []
+                                for name in fields}, time_units=time_units)
+    num_pts = np.array([len(track['time']) for track in tracks])
+    return TrackCollection([track['track_id'] for track in tracks],
+                           np.cumsum(num_pts) - num_pts, num_pts,
+                           np.concatenate([t['time'] for t in tracks]),
+                           np.concatenate([t['lon'] for t in tracks]),
+                           np.concatenate([t['lat'] for t in tracks]),
+                           {name: np.concatenate([t[name] for t in tracks])
+                                for name in fields},
+                           time_units=time_units)
+
+def stitch_tracks(old, new, boundary, overlap=72., tolerance=2.5,
+                  open_tracks=None):
+    """
+    Stitch tracks of a newly tracked period onto the tracks of the earlier
+    periods. The new period has to start with an overlap window before the
+    boundary, which was tracked in both runs.
+
+    A new track that reaches past the boundary is matched to an earlier
+    track if both have a point at the same time in the overlap window, less
+    than tolerance degrees apart. The earlier track is then continued with
+    the new points. New tracks that are not matched are added as they are,
+    and new tracks that end before the boundary are dropped, since they were
+    already tracked in the earlier run.
+
+    Parameters
+    ----------
+
+    old, new : TrackCollection
+        Earlier and new tracks, with times in hours since the same date
+
+    boundary : number
+        Time of the last frame of the earlier run
+
+    overlap : number, optional
+        Length of the overlap window in hours
+
+    tolerance : number, optional
+        Largest distance in degrees between matching points
+
+    open_tracks : list of ints, optional
+        IDs of the earlier tracks that may be continued. By default, all
+        tracks with points in the overlap window.
+
+    Returns
+    -------
+
+    tracks : TrackCollection
+        All tracks, with continued tracks keeping their earlier ID
+
+    """
+    fields = [name for name in old.fields if name in new.fields]
+    tracks = [track for track in old]
+
+    # points of the open earlier tracks in the overlap window
+    owner = np.repeat(np.arange(len(old)), old.num_pts[old.selection])
+    window = old.points('time') >= boundary - overlap
+    if open_tracks is not None:
+        window &= np.isin(old.track_id[old.selection][owner], open_tracks)
+    old_time = old.points('time')[window]
+    old_lon = old.points('lon')[window]
+    old_lat = old.points('lat')[window]
+    owner = owner[window]
+
+    continued = set()
+    next_id = int(np.max(old.track_id[old.selection])) + 1 if len(old) else 0
+    for track in new:
+        if track['time'][-1] <= boundary:
+            continue
+
+        # match the new points in the overlap window to earlier points
+        match = None
+        in_window = track['time'] <= boundary
+        if np.any(in_window) and (len(old_time) > 0):
+            same_time = np.abs(track['time'][in_window, None] -
+                                old_time[None, :]) < 0.5
+            distance = great_circle(track['lon'][in_window, None],
+                                    track['lat'][in_window, None],
+                                    old_lon[None, :], old_lat[None, :])
+            close = same_time & (distance / KM_PER_DEGREE <= tolerance)
+            candidates = [n for n in owner[np.any(close, axis=0)]
+                            if n not in continued]
+            if len(candidates) > 0:
+                values, counts = np.unique(candidates, return_counts=True)
+                match = int(values[np.argmax(counts)])
+
+        if match is None:
+            track = dict(track)
+            track['track_id'] = next_id
+            next_id += 1
+            tracks.append(track)
+        else:
+            earlier = tracks[match]
+            after = track['time'] > earlier['time'][-1]
+            tracks[match] = {key: np.concatenate([earlier[key],
+                                                  track[key][after]])
+                                for key in ['time', 'lon', 'lat'] + fields}
+            tracks[match]['track_id'] = earlier['track_id']
+            continued.add(match)
+
+    return _from_tracks(tracks, fields, old.time_units)
+
+def _series_times(files, timestep=None):
+    # returns the dates of all frames in the input files
+    dates = []
+    for file in files:
+        data = Dataset(file, 'r')
+        time = data.variables['time']
+        dates += list(num2date(time[:], time.units,
+                               getattr(time, 'calendar', 'standard')))
+        data.close()
+    if timestep is not None:
+        dates = [date for date in dates if date.hour % int(timestep) == 0]
+    return sorted(dates)
+
+def _absolute_times(filename, dates, units, calendar):
+    # reads TR2NC tracks and converts their times from TRACK frames to hours
+    # since the reference date of the series; TR2NC counts frames from its
+    # start time in steps of the step attribute
+    tracks = read_tracks(filename)
+    data = Dataset(filename, 'r')
+    step = float(getattr(data.variables['time'], 'step', 1))
+    data.close()
+    frames = np.round(tracks.time / step).astype(int)
+    if np.any(frames >= len(dates)):
+        raise Exception("Track times do not match the frames of the input.")
+    tracks.time = date2num([dates[frame] for frame in frames], units, calendar)
+    tracks.time = np.asarray(tracks.time, dtype=np.float64)
+    tracks.time_units = units
+    return tracks
+
+def append_series(files, outdirectory, series, kind='mslp', NH=True,
+                  overlap=72, timestep=None, tolerance=2.5, **kwargs):
+    """
+    Track a series of input data incrementally. Only data after the last
+    processed time, plus an overlap window, is tracked, and the new tracks are
+    stitched onto the existing output of the series, which is updated in
+    place. Tracking is continuous over year boundaries, so storms crossing
+    the end of a year are kept as one track.
+
+    The state of the series (last processed time and open tracks) is kept in
+    a small state file next to the output.
+
+    Parameters
+    ----------
+
+    files : list of strings
+        Paths to .nc input files of the series, e.g. one per year. Only the
+        files covering the overlap window and the new data are needed.
+
+    outdirectory : string
+        Path of directory to keep the output and state of the series in
+
+    series : string
+        Name of the series, used to name the output files
+
+    kind : string, optional
+        Type of tracking, one of 'mslp', 'vor850', 'era5_mslp' and
+        'era5_vor850'. Vorticity inputs need to be combined UV files.
+
+    NH : boolean, optional
+        If true, tracks the Northern Hemisphere. If false, tracks Southern
+        Hemisphere.
+
+    overlap : number, optional
+        Length of the overlap window in hours
+
+    timestep : int, optional
+        Time step in hours to subsample the input data to.
+
+    tolerance : number, optional
+        Largest distance in degrees between matching points of tracks in the
+        overlap window
+
+    **kwargs
+        Further keyword arguments passed to the tracking function
+
+    Returns
+    -------
+
+    state : dict
+        Updated state of the series
+
+    """
+    outdir = os.path.abspath(os.path.expanduser(outdirectory))
+    os.makedirs(outdir, exist_ok=True)
+    hemisphere = "NH" if NH == True else "SH"
+    prefix = os.path.join(outdir, series + "_" + hemisphere + "_")
+    statefile = prefix + "state.json"
+
+    state, open_tracks = None, {}
+    if os.path.isfile(statefile):
+        with open(statefile, "r") as file:
+            state = json.load(file)
+        open_tracks = state['open_tracks']
+
+    files = [os.path.abspath(file) for file in files]
+    dates = _series_times(files, timestep)
+    if state is None:
+        units = "hours since " + dates[0].strftime("%Y-%m-%d %H:%M:%S")
+        calendar = dates[0].calendar or 'standard'
+        boundary = None
+    else:
+        units, calendar = state['time_units'], state['calendar']
+        boundary = state['last_time']
+    hours = np.asarray(date2num(dates, units, calendar), dtype=np.float64)
+
+    if (boundary is not None) and (np.all(hours <= boundary)):
+        print("No new data to track.")
+        return state
+
+    # select the overlap window and the new data
+    if boundary is not None:
+        keep = hours >= boundary - overlap
+        dates = [date for date, k in zip(dates, keep) if k]
+        hours = hours[keep]
+        if hours[0] > boundary:
+            raise Exception("The input files do not cover the overlap " +
+                                "window. Please include the previous file.")
+    print("Tracking " + str(dates[0]) + " to " + str(dates[-1]) + "...")
+
+    workdir = tempfile.mkdtemp(prefix="pyTRACK_" + series + "_")
+    try:
+        subset = os.path.join(workdir, series + ".nc")
+        operators = _reduction_operators(timestep=timestep,
+                                         start=dates[0])
+        operators += " -seldate," + dates[0].strftime("%Y-%m-%dT%H:%M:%S") + \
+                        "," + dates[-1].strftime("%Y-%m-%dT%H:%M:%S")
+        cdo.copy(input=operators + " -mergetime " + " ".join(files),
+                 output=subset)
+
+        _tracking_function(kind)(subset, os.path.join(workdir, "tracks"),
+                                 NH=NH, netcdf=True, continuous=True, **kwargs)
+
+        state = {'series': series, 'time_units': units, 'calendar': calendar,
+                 'last_time': float(hours[-1]),
+                 'last_date': str(dates[-1]), 'open_tracks': {}}
+        for trackfile in glob.glob(os.path.join(workdir, "tracks", "*",
+                                                "tr_trs_*.nc")):
+            name = os.path.basename(trackfile)[:-3]
+            new = _absolute_times(trackfile, dates, units, calendar)
+
+            output = prefix + name + ".nc"
+            if (boundary is not None) and os.path.isfile(output):
+                old = read_tracks(output)
+                tracks = stitch_tracks(old, new, boundary, overlap, tolerance,
+                                       open_tracks=open_tracks.get(name))
+            else:
+                tracks = new
+
+            # update the outputs in place, the filtered tracks are kept by
+            # the same criteria as TRACK's ff_trs files
+            for path, selected in [(output, tracks),
+                                   (prefix + "ff" + name[2:] + ".nc",
+                                    tracks.filter_lifetime(48)
+                                          .filter_displacement(1000))]:
+                selected.to_netcdf(path + ".tmp")
+                os.replace(path + ".tmp", path)
+
+            last = tracks.points('time')[tracks.first_pt[tracks.selection] +
+                                         tracks.num_pts[tracks.selection] - 1]
+            state['open_tracks'][name] = [int(track_id) for track_id in
+                tracks.track_id[tracks.selection][last >= hours[-1] - overlap]]
+            print("Updated " + output + ".")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(statefile + ".tmp", "w") as file:
+        json.dump(state, file, indent=1)
+    os.replace(statefile + ".tmp", statefile)
+    return state
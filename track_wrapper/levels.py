@@ -0,0 +1,228 @@
+import os
+import shutil
+import tempfile
+from math import ceil
+from multiprocessing import Pool
+
+from . import track_wrapper as tw
+from .backends import create_workspace
+from .regions import subset_tracks
+
+__all__ = ['track_uv_vor_levels']
+
+def _level_name(level):
+    # name of a pressure level in Pa in file names, e.g. 'vor850'
+    return "vor" + "%g" % (float(level) / 100.)
+
+def _track_level(args):
+    # spectrally filters and tracks the vorticity of one level and year, in
+    # its own workspace if one is given, for use in a Pool
+    run, trackdir, workspace, outdir, netcdf, region = args
+    cwd = os.getcwd()
+    trackdir_env = os.environ.get("TRACK_DIR")
+    try:
+        if workspace is not None:
+            create_workspace(workspace, trackdir)
+            shutil.move(trackdir + "/indat/" + run['vorfile'],
+                        workspace + "/indat/" + run['vorfile'])
+            os.environ["TRACK_DIR"] = workspace
+        os.chdir(tw._track_dir())
+
+        year = run['year']
+        fname = "T" + run['trunc'] + "filt_" + year + "_" + run['level'] + \
+                    ".dat"
+        line_1 = "sed -e \"s/NX/" + run['nx'] + "/;s/NY/" + run['ny'] + \
+                    "/;s/TRUNC/" + run['trunc'] + \
+                    "/\" specfilt.in > spec.test"
+        line_2 = "bin/track.linux -i " + run['vorfile'] + " -f y" + year + \
+                    " < spec.test"
+        line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
+        line_4 = "rm -f outdat/specfil.y" + year + "_band000"
+        line_5 = "master -c=" + run['name'] + " -e=track.linux -d=now -i=" + \
+                    fname + " -f=y" + year + \
+                    " -j=RUN_AT.in -k=" + run['initial'] + \
+                    " -n=1,62," + str(run['nchunks']) + " -o='" + outdir + \
+                    "' -r=RUN_AT_ -s=RUNDATIN.VOR"
+        outputs = ["ff_trs_pos", "ff_trs_neg", "tr_trs_pos", "tr_trs_neg"]
+
+        # setting environment variables
+        tw._track_environment()
+
+        print("Spectral filtering " + run['name'] + "...")
+        tw._run_stage("Spectral filtering", line_1, ["spec.test"])
+        tw._run_stage("Spectral filtering", line_2,
+                      ["outdat/specfil.y" + year + "_band001"])
+        tw._run_stage("Spectral filtering", line_3, ["indat/" + fname])
+        tw._run_stage("Spectral filtering", line_4)
+        os.remove("indat/" + run['vorfile'])
+
+        print("Running TRACK on " + run['name'] + "...")
+        tw._run_stage("Running TRACK", line_5, [outdir + "/" + run['name'] +
+                      "/" + trs + ".gz" for trs in outputs])
+        os.remove("indat/" + fname)
+
+        if netcdf == True:
+            # tr2nc - turn tracks into netCDF files
+            for trs in outputs:
+                trs = outdir + "/" + run['name'] + "/" + trs
+                tw._run_stage("Unpacking tracks", "gunzip '" + trs + ".gz'",
+                              [trs])
+                tw.tr2nc_vor(trs)
+                if region is not None:
+                    subset_tracks(trs + ".nc", region)
+    finally:
+        os.chdir(cwd)
+        if trackdir_env is None:
+            os.environ.pop("TRACK_DIR", None)
+        else:
+            os.environ["TRACK_DIR"] = trackdir_env
+        if workspace is not None:
+            shutil.rmtree(os.path.dirname(workspace), ignore_errors=True)
+    return outdir + "/" + run['name']
+
+def track_uv_vor_levels(infile, outdirectory, levels=[85000, 70000, 50000],
+                        infile2='none', NH=True, netcdf=True, timestep=None,
+                        drop_vars=False, years=None, workers=1, scratch=None,
+                        region=None):
+    """
+    Calculate vorticity at several pressure levels from CMIP6 horizontal wind
+    velocity data and run TRACK on every level. The winds are copied,
+    regridded and split into years once for all levels, and the vorticity of
+    each level is then calculated by TRACK from the same file of each year.
+
+    The tracks of each level are written to directories named like those of
+    track_uv_vor850, with the level in hPa, e.g. 1979_NH__vor700_[input].
+
+    Parameters
+    ----------
+
+    infile : string
+        Path to .nc file containing combined CMIP6 UV data
+
+    outdirectory : string
+        Path of directory to output tracks to
+
+    levels : list of numbers, optional
+        Pressure levels in Pa to track
+
+    infile2 : string, optional
+        Path to second input file, if U and V are in separate files and
+        need to be combined.
+
+    NH : boolean, optional
+        If true, tracks the Northern Hemisphere. If false, tracks Southern
+        Hemisphere.
+
+    netcdf : boolean, optional
+        If true, converts TRACK output to netCDF format using TR2NC utility.
+
+    timestep : int, optional
+        Time step in hours to subsample the input data to before tracking.
+
+    drop_vars : boolean, optional
+        If true, drops all variables other than ua and va before
+        preprocessing.
+
+    years : list of ints, optional
+        Years to track. By default, all years in the input data are tracked.
+
+    workers : int, optional
+        Number of levels filtered and tracked at the same time. With more
+        than one worker, every level runs in its own TRACK workspace.
+
+    scratch : string, optional
+        Directory for the per-level workspaces. Defaults to the system
+        temporary directory.
+
+    region : tuple or string, optional
+        Region to track in, as for track_uv_vor850
+
+    Returns
+    -------
+
+    outputs : dict
+        Output directories of every level, by level
+
+    """
+    outdir = os.path.abspath(os.path.expanduser(outdirectory))
+    names = [_level_name(level) for level in levels]
+    if len(set(names)) != len(names):
+        raise Exception("Please input each level only once.")
+
+    # copy, regrid and fill the winds at all levels in the TRACK indat
+    # directory
+    cwd = os.getcwd()
+    trackdir = os.path.abspath(tw._track_dir())
+    try:
+        tempname, filled, input_basename = tw._prepare_uv(infile, infile2,
+                                                          levels, timestep,
+                                                          drop_vars, years)
+
+        # get data info
+        data = tw.cmip6_indat(filled)
+        nx, ny = data.get_nx_ny()
+        if int(ny) >= 96:
+            trunc = "63"
+        else:
+            trunc = "42"
+        # regions need a contiguous range of longitudes
+        if region is not None:
+            tw._shift_longitudes(filled, region)
+
+        years = tw.cdo.showyear(input=filled)[0].split()
+        frames = tw._frames_per_year(filled)
+
+        if NH == True:
+            hemisphere = "NH"
+        else:
+            hemisphere = "SH"
+        initial = tw._initial(trunc, hemisphere, region, filled)
+
+        if scratch is not None:
+            os.makedirs(scratch, exist_ok=True)
+
+        # do tracking for one year at a time
+        outputs = {level: [] for level in levels}
+        for year in years:
+            print(year + "...")
+
+            # select year from data
+            year_file = "indat/tempyear.nc"
+            tw.cdo.selyear(year, input=filled, output=year_file)
+            tw._check_outputs("Selecting " + year, [year_file], frames[year])
+            nchunks = ceil(frames[year]/62)
+
+            # calculate vorticity at every level from the same UV file
+            runs = []
+            for level, name in zip(levels, names):
+                print("Calculating vorticity at " + "%g" % (level / 100.) +
+                      " hPa...")
+                tw.calc_vorticity("./" + year_file, name + "_temp.dat",
+                                  copy_file=False, level=level)
+                runs.append({'year': year, 'level': name, 'nx': nx, 'ny': ny,
+                             'trunc': trunc, 'initial': initial,
+                             'nchunks': nchunks,
+                             'vorfile': name + "_temp.dat",
+                             'name': year + "_" + hemisphere + "_" + "_" +
+                                        name + "_" + input_basename[:-3]})
+            os.remove(year_file)
+
+            # filter and track every level
+            if workers == 1:
+                args = [(run, trackdir, None, outdir, netcdf, region)
+                        for run in runs]
+                done = [_track_level(arg) for arg in args]
+            else:
+                args = [(run, trackdir, os.path.join(
+                            tempfile.mkdtemp(dir=scratch), "TRACK"), outdir,
+                         netcdf, region) for run in runs]
+                with Pool(min(workers, len(runs))) as pool:
+                    done = pool.map(_track_level, args)
+            for level, path in zip(levels, done):
+                outputs[level].append(path)
+    finally:
+        # clean up, also when a stage failed
+        os.chdir(cwd)
+        tw._remove_temporary(["indat/temp_file*.nc", "indat/tempyear.nc"] +
+                             ["indat/" + name + "_temp.dat" for name in names])
+    return outputs
@@ -0,0 +1,405 @@
+import os
+import json
+import numpy as np
+from math import ceil
+from netCDF4 import Dataset, num2date
+
+from .environment import _cache_file
+
+__all__ = ['plan', 'calibrate', 'record_run']
+
+# default cost of each stage, in seconds per MB of the stage's input data,
+# plus a fixed overhead in seconds; scaled by the calibration factor
+STAGE_COSTS = {'reduce': (0.005, 1.), 'merge': (0.005, 1.),
+               'remove bounds': (0.005, 1.), 'regrid': (0.05, 2.),
+               'fill': (0.005, 1.), 'select year': (0.005, 1.),
+               'vorticity': (0.02, 2.), 'spectral filter': (0.1, 2.),
+               'tracking': (0.5, 10.), 'tr2nc': (0., 2.)}
+
+# approximate size of the ASCII and netCDF tracks of one year and hemisphere
+TRACK_OUTPUT_BYTES = 5 * 1024**2
+
+MB = 1024.**2
+
+def _runs_file():
+    # returns the path of the run reports used for calibration
+    return os.path.join(os.path.dirname(_cache_file()), "runs.jsonl")
+
+def _is_gaussian(lat):
+    # checks if latitudes are those of a Gaussian grid, without running CDO
+    nodes = np.polynomial.legendre.leggauss(len(lat))[0]
+    return np.allclose(np.sort(lat), np.degrees(np.arcsin(nodes)), atol=1e-3)
+
+def _gaussian_ny(ny):
+    # number of latitudes after regridding, as chosen by regrid_cmip6
+    for limit, grid in [(80, 32), (112, 48), (150, 64)]:
+        if ny <= limit:
+            return 2 * grid
+    return 160
+
+def _metadata(filename, levels=None, timestep=None, years=None):
+    # reads grid size, frames per year and levels from the file's metadata
+    data = Dataset(filename, 'r')
+    nx = len(data.dimensions['lon'])
+    ny = len(data.dimensions['lat'])
+    lat = np.asarray(data.variables['lat'][:])
+
+    time = data.variables['time']
+    dates = num2date(time[:], time.units, getattr(time, 'calendar', 'standard'))
+    keep = np.ones(len(dates), dtype=bool)
+    if timestep is not None:
+        keep &= np.array([date.hour % int(timestep) == 0 for date in dates])
+    file_years = np.array([date.year for date in dates])
+    if years is not None:
+        keep &= np.isin(file_years, [int(year) for year in years])
+    frames = {int(year): int(np.sum(keep & (file_years == year)))
+                for year in np.unique(file_years[keep])}
+
+    nlev = 1
+    for name in ['plev', 'lev', 'level']:
+        if name in data.variables:
+            nlev = len(data.variables[name][:])
+            if levels is not None:
+                nlev = min(nlev, len(levels))
+            break
+
+    # bytes per frame of the variables that are kept
+    names = [name for name in data.variables if name not in
+                ['time', 'lat', 'lon', 'plev', 'lev', 'level'] and
+                not name.endswith('_bnds')]
+    itemsize = sum([data.variables[name].dtype.itemsize for name in names])
+    bounds = any([name.endswith('_bnds') for name in data.variables])
+    data.close()
+
+    return {'nx': nx, 'ny': ny, 'gaussian': _is_gaussian(lat),
+            'frames': frames, 'nlev': nlev, 'itemsize': itemsize,
+            'nvars': len(names), 'bounds': bounds,
+            'ntime': int(np.sum(keep))}
+
+class Plan(object):
+    """
+    Stages, intermediate files, predicted sizes and runtimes of a tracking
+    run, as returned by plan.
+    """
+    def __init__(self, kind, stages, metadata, factor):
+        self.kind = kind
+        self.stages = stages
+        self.metadata = metadata
+        self.factor = factor
+
+    @property
+    def peak_bytes(self):
+        """
+        Largest amount of intermediate data in the TRACK directory that
+        exists at the same time. The tracks themselves are not included.
+        """
+        live = {}
+        peak = 0
+        for stage in self.stages:
+            for path, nbytes in stage['creates']:
+                if os.path.isabs(path) == False:
+                    live[path] = nbytes
+            peak = max(peak, sum(live.values()))
+            for path in stage['removes']:
+                live.pop(path, None)
+        return peak
+
+    @property
+    def total_seconds(self):
+        """Predicted runtime of all stages, one after the other."""
+        return sum([stage['seconds'] for stage in self.stages])
+
+    def workers(self, n):
+        """
+        Predicted runtime and scratch space if the years are run by n
+        workers in parallel, each in its own workspace.
+        """
+        years = max(1, len(self.metadata['frames']))
+        shared = [s for s in self.stages if s['year'] is None]
+        per_year = [s for s in self.stages if s['year'] is not None]
+        seconds = sum([s['seconds'] for s in shared]) + \
+                    sum([s['seconds'] for s in per_year]) / min(n, years)
+        return {'seconds': seconds, 'scratch_bytes': self.peak_bytes * n}
+
+    def summary(self):
+        """Return the plan as a printable table."""
+        lines = ["%-16s %-6s %10s %9s  %s" % ("stage", "year", "size (MB)",
+                                             "time (s)", "files")]
+        for stage in self.stages:
+            nbytes = sum([nbytes for path, nbytes in stage['creates']])
+            lines.append("%-16s %-6s %10.1f %9.1f  %s" % (
+                            stage['name'], stage['year'] or "", nbytes / MB,
+                            stage['seconds'],
+                            ", ".join([path for path, n in stage['creates']])))
+        lines.append("")
+        lines.append("Grid: %d x %d, %s, %d frames in %d years" % (
+                        self.metadata['nx'], self.metadata['ny'],
+                        'Gaussian' if self.metadata['gaussian']
+                            else 'regridded to Gaussian',
+                        self.metadata['ntime'], len(self.metadata['frames'])))
+        lines.append("Peak scratch space: %.1f MB" % (self.peak_bytes / MB))
+        lines.append("Estimated runtime: %.0f s (calibration factor %.2f)" %
+                        (self.total_seconds, self.factor))
+        return "\n".join(lines)
+
+def _stage(name, year, creates, removes, input_bytes, factor):
+    # describes one stage with its predicted runtime
+    rate, overhead = STAGE_COSTS[name]
+    return {'name': name, 'year': year, 'creates': creates,
+            'removes': removes, 'input_bytes': input_bytes,
+            'seconds': factor * (rate * input_bytes / MB + overhead)}
+
+def plan(infile, outdirectory, kind='mslp', infile2=None, NH=True,
+         timestep=None, years=None, netcdf=True, calibration=None):
+    """
+    Plan a tracking run without running it, using only the metadata of the
+    input data. Lists every stage of the tracking function with the
+    intermediate files it creates and removes, their predicted sizes and the
+    estimated runtime of each stage.
+
+    Parameters
+    ----------
+
+    infile : string
+        Path to .nc input file
+
+    outdirectory : string
+        Path of directory the tracks would be output to
+
+    kind : string, optional
+        Tracking function to plan for: 'mslp' (track_mslp), 'vor850'
+        (track_uv_vor850), 'era5_mslp' or 'era5_vor850'.
+
+    infile2 : string, optional
+        Second input file, for separate U and V files
+
+    NH : boolean, optional
+        Hemisphere to track, only used for the names of the outputs.
+
+    timestep, years : optional
+        As for the tracking functions
+
+    netcdf : boolean, optional
+        Whether the tracks would be converted to netCDF.
+
+    calibration : dict, optional
+        Calibration factors by kind, as returned by calibrate. By default,
+        the factors are fitted to the run reports of earlier runs.
+
+    Returns
+    -------
+
+    plan : Plan
+        Use plan.summary() for a table of all stages.
+
+    """
+    vorticity = kind in ['vor850', 'era5_vor850']
+    era5 = kind in ['era5_mslp', 'era5_vor850']
+    if vorticity:
+        levels = [85000]
+    else:
+        levels = None
+
+    meta = _metadata(infile, levels, timestep, years)
+    if infile2 is not None:
+        meta2 = _metadata(infile2, levels, timestep, years)
+        meta['itemsize'] += meta2['itemsize']
+        meta['nvars'] += meta2['nvars']
+
+    if calibration is None:
+        calibration = calibrate()
+    factor = calibration.get(kind, 1.)
+
+    nx, ny = meta['nx'], meta['ny']
+    frame = nx * ny * meta['nlev'] * meta['itemsize']
+    size = frame * meta['ntime']
+    stages = []
+
+    # preprocessing of the whole file
+    if infile2 is not None:
+        parts = [("indat/temp_file_0.nc", size // 2),
+                 ("indat/temp_file_1.nc", size - size // 2)]
+        stages.append(_stage('reduce', None, parts, [], size, factor))
+        stages.append(_stage('merge', None, [("indat/temp_file.nc", size)],
+                             [path for path, n in parts], size, factor))
+    else:
+        stages.append(_stage('reduce', None, [("indat/temp_file.nc", size)],
+                             [], size, factor))
+
+    gridcheck = "indat/temp_file.nc"
+    removes = []
+    if era5 == False:
+        extr = "indat/temp_file.nc"
+        if meta['bounds']:
+            extr = "indat/temp_file_extr.nc"
+            stages.append(_stage('remove bounds', None, [(extr, size)], [],
+                                 size, factor))
+            removes.append(extr)
+        gridcheck = extr
+        if meta['gaussian'] == False:
+            ny = _gaussian_ny(ny)
+            nx = 2 * ny
+            frame = nx * ny * meta['nlev'] * meta['itemsize']
+            gridfile = "indat/temp_file_gaussian.nc"
+            stages.append(_stage('regrid', None, [(gridfile, frame *
+                                 meta['ntime'])], [], size, factor))
+            size = frame * meta['ntime']
+            gridcheck = gridfile
+            removes.append(gridfile)
+        filled = gridcheck[:-3] + "_filled.nc"
+        stages.append(_stage('fill', None, [(filled, size)], removes, size,
+                             factor))
+        gridcheck = filled
+
+    # spectral truncation used by the tracking functions
+    if kind == 'era5_mslp':
+        trunc = 63
+    elif kind == 'era5_vor850':
+        trunc = 42
+    else:
+        trunc = 63 if ny >= 96 else 42
+
+    hemisphere = "NH" if NH == True else "SH"
+    outdir = os.path.abspath(os.path.expanduser(outdirectory))
+    basename = os.path.basename(infile)[:-3]
+    if infile2 is not None:
+        basename += "_merged"
+
+    for year, ntime in sorted(meta['frames'].items()):
+        year_bytes = frame * ntime
+        field_bytes = nx * ny * 4 * ntime # single float field in TRACK format
+        year_file = "indat/tempyear.nc"
+        stages.append(_stage('select year', year, [(year_file, year_bytes)],
+                             [], size, factor))
+
+        if vorticity:
+            c_input = str(year) + "_" + hemisphere + "__vor850_" + basename
+            vorfile = "indat/vor850_temp.dat"
+            stages.append(_stage('vorticity', year, [(vorfile, field_bytes)],
+                                 [year_file], year_bytes, factor))
+            filter_input = vorfile
+        else:
+            c_input = str(year) + "_" + hemisphere + "_" + basename
+            filter_input = year_file
+
+        band = "outdat/specfil.y" + str(year) + "_band00"
+        fname = "indat/T" + str(trunc) + "filt_" + str(year) + ".dat"
+        stages.append(_stage('spectral filter', year,
+                             [(band + "0", field_bytes),
+                              (fname, field_bytes)],
+                             [band + "0"], field_bytes, factor))
+
+        stage = _stage('tracking', year,
+                       [(os.path.join(outdir, c_input), TRACK_OUTPUT_BYTES)],
+                       [filter_input], field_bytes, factor)
+        stage['chunks'] = ceil(ntime / 62)
+        stages.append(stage)
+        if netcdf == True:
+            stages.append(_stage('tr2nc', year, [], [], 0, factor))
+
+    stages[-1]['removes'] = stages[-1]['removes'] + ["indat/temp_file.nc"]
+    meta['nx_track'], meta['ny_track'], meta['trunc'] = nx, ny, trunc
+    return Plan(kind, stages, meta, factor)
+
+def record_run(kind, files, year, seconds, status='done', reports=None,
+               options=None):
+    """
+    Append the runtime of one tracking work unit to the run reports used by
+    calibrate, together with the runtime predicted by plan for the same run.
+
+    Parameters
+    ----------
+
+    kind : string
+        Kind of tracking, as for plan
+
+    files : list of strings
+        Input file(s) of the run
+
+    year : int
+        Year that was tracked
+
+    seconds : number
+        Runtime in seconds
+
+    status : string, optional
+        Only successful runs ('done') are used for calibration.
+
+    reports : string, optional
+        Path of the run reports file. Defaults to runs.jsonl in the
+        pyTRACK-CMIP6 cache directory.
+
+    options : dict, optional
+        Keyword arguments the tracking function was run with, e.g. NH and
+        timestep.
+
+    """
+    if reports is None:
+        reports = _runs_file()
+    if options is None:
+        options = {}
+    options = {key: value for key, value in options.items()
+                if key not in ['infile2', 'years']}
+
+    # the prediction is made now, while the input is known to exist
+    predicted = None
+    if status == 'done':
+        try:
+            predicted = plan(files[0], ".", kind=kind,
+                             infile2=files[1] if len(files) > 1 else None,
+                             years=[year], calibration={},
+                             **{key: options[key] for key in
+                                ['NH', 'timestep', 'netcdf']
+                                if key in options}).total_seconds
+        except Exception:
+            pass # the run is still reported, but not used for calibration
+
+    os.makedirs(os.path.dirname(reports), exist_ok=True)
+    with open(reports, "a") as file:
+        file.write(json.dumps({'kind': kind, 'files': list(files),
+                               'year': int(year), 'seconds': seconds,
+                               'predicted': predicted, 'options': options,
+                               'status': status}, default=str) + "\n")
+    return
+
+def calibrate(reports=None):
+    """
+    Fit calibration factors for the runtime estimates of plan to the
+    reports of earlier runs. For every kind of tracking, the factor is the
+    median ratio of actual to predicted runtime, as recorded by record_run.
+
+    Parameters
+    ----------
+
+    reports : string, optional
+        Path of the run reports file. Defaults to runs.jsonl in the
+        pyTRACK-CMIP6 cache directory.
+
+    Returns
+    -------
+
+    factors : dict
+        Calibration factor by kind. Kinds without usable reports are left
+        out and use a factor of 1.
+
+    """
+    if reports is None:
+        reports = _runs_file()
+    if os.path.isfile(reports) == False:
+        return {}
+
+    ratios = {}
+    with open(reports, "r") as file:
+        for line in file:
+            try:
+                report = json.loads(line)
+            except ValueError:
+                continue
+            predicted = report.get('predicted')
+            if (report.get('status') != 'done') or (predicted is None) or \
+                (predicted <= 0):
+                continue
+            ratios.setdefault(report['kind'], []).append(
+                report['seconds'] / predicted)
+
+    return {kind: float(np.median(values)) for kind, values in ratios.items()}
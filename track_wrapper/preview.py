@@ -0,0 +1,339 @@
+import time
+import numpy as np
+from multiprocessing import Pool
+from netCDF4 import Dataset, num2date, date2num
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .tracks import TrackCollection, great_circle, EARTH_RADIUS
+from .sampling import _coordinate
+from .track_wrapper import _vertical_coordinate
+
+__all__ = ['detect_centres', 'link_centres', 'preview', 'triage']
+
+KM_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+# settings of RUNDATIN.MSLP and RUNDATIN.VOR: scaling of the field and
+# threshold of the scaled, filtered field
+PREVIEW_SETTINGS = {'mslp': {'scale': 0.01, 'threshold': 1.0,
+                             'variables': [['psl'], ['msl'], ['var151']]},
+                    'vor850': {'scale': 1.0e+5, 'threshold': 1.0,
+                               'variables': [['ua', 'va'], ['u', 'v'],
+                                             ['var131', 'var132']]}}
+
+def _band_filter(field, trunc, low=5):
+    # removes the large-scale background and the small scales along
+    # longitude, similar to the T5-T42/T63 band of TRACK's spectral
+    # filtering; the background is removed with a tapered (Fejer) window,
+    # which unlike a sharp cut does not create spurious lows next to deep
+    # lows
+    coeffs = np.fft.rfft(field, axis=-1)
+    coeffs *= np.clip(np.arange(coeffs.shape[-1]) / (low + 1.), 0, 1)
+    coeffs[..., trunc + 1:] = 0
+    return np.fft.irfft(coeffs, n=field.shape[-1], axis=-1)
+
+def _vorticity(u, v, lon, lat):
+    # relative vorticity on a regular or Gaussian grid, with longitude
+    # derivatives periodic and latitude derivatives from np.gradient
+    lam = np.radians(lon)
+    phi = np.radians(lat)[:, None]
+    coslat = np.cos(phi)
+    dlam = 2 * (lam[1] - lam[0])
+    dvdlam = (np.roll(v, -1, axis=-1) - np.roll(v, 1, axis=-1)) / dlam
+    ducosdphi = np.gradient(u * coslat, np.radians(lat), axis=-2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vor = (dvdlam - ducosdphi) / (EARTH_RADIUS * 1000. * coslat)
+    return np.where(np.abs(coslat) > 1e-6, vor, 0.)
+
+def detect_centres(field, lon, lat, threshold=1.0, radius=2):
+    """
+    Find local maxima of a field above a threshold, for all time steps at
+    once, using a moving window over the grid. Longitudes are periodic.
+
+    Parameters
+    ----------
+
+    field : array
+        Field with shape (time, lat, lon), oriented so that the features to
+        find are maxima, e.g. negated pressure anomalies
+
+    lon, lat : arrays
+        Longitudes and latitudes of the grid in degrees
+
+    threshold : number, optional
+        Smallest value of a centre
+
+    radius : int, optional
+        Half width of the window in grid points. A centre is the largest
+        value within the window.
+
+    Returns
+    -------
+
+    step, lon, lat, value : arrays
+        Time step index, position and value of every centre
+
+    """
+    r = int(radius)
+    padded = np.concatenate([field[..., -r:], field, field[..., :r]], axis=-1)
+    padded = np.pad(padded, ((0, 0), (r, r), (0, 0)),
+                    constant_values=-np.inf)
+    window = sliding_window_view(padded, (2 * r + 1, 2 * r + 1),
+                                 axis=(-2, -1))
+    centres = (field == window.max(axis=(-2, -1))) & (field >= threshold)
+    step, j, i = np.nonzero(centres)
+    return step, lon[i], lat[j], field[step, j, i]
+
+def link_centres(step, lon, lat, max_distance=6.5):
+    """
+    Link centres into tracks by nearest neighbours: every track is continued
+    by the closest unclaimed centre of the next time step within a maximum
+    distance.
+
+    Parameters
+    ----------
+
+    step, lon, lat : arrays
+        Time step index and position of every centre, sorted by time step
+
+    max_distance : number, optional
+        Largest distance in degrees between the points of a track in
+        consecutive time steps
+
+    Returns
+    -------
+
+    tracks : list of arrays
+        Indices of the centres of every track
+
+    """
+    tracks = []
+    active = []
+    bounds = np.searchsorted(step, np.arange(step.max() + 2)) \
+                if len(step) > 0 else [0]
+    for n in range(len(bounds) - 1):
+        points = np.arange(bounds[n], bounds[n + 1])
+        claimed = np.zeros(len(points), dtype=bool)
+        continued = []
+        if (len(active) > 0) and (len(points) > 0):
+            heads = np.array([tracks[t][-1] for t in active])
+            distance = great_circle(lon[heads][:, None], lat[heads][:, None],
+                                    lon[points][None, :],
+                                    lat[points][None, :]) / KM_PER_DEGREE
+            # closest pairs first
+            order = np.argsort(distance, axis=None)
+            order = order[distance.ravel()[order] <= max_distance]
+            used = np.zeros(len(heads), dtype=bool)
+            for head, point in zip(*np.unravel_index(order, distance.shape)):
+                if (used[head] == True) or (claimed[point] == True):
+                    continue
+                used[head], claimed[point] = True, True
+                tracks[active[head]].append(points[point])
+                continued.append(active[head])
+        new = list(range(len(tracks), len(tracks) + int((~claimed).sum())))
+        tracks += [[point] for point in points[~claimed]]
+        active = continued + new
+    return [np.array(track) for track in tracks]
+
+def _read_field(data, variables, steps, level):
+    # reads one chunk of time steps of the field, or of U and V
+    fields = []
+    for name in variables:
+        var = data.variables[name]
+        if var.ndim == 4:
+            values = var[steps, level, :, :]
+        else:
+            values = var[steps, :, :]
+        values = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+        # missing values are replaced by the mean of their latitude
+        fill = np.nanmean(values, axis=-1, keepdims=True)
+        fields.append(np.where(np.isnan(values), fill, values))
+    return fields
+
+def preview(input, kind='mslp', NH=True, years=None, threshold=None,
+            radius=2, max_distance=6.5, trunc=None, chunk=124):
+    """
+    Quick look at cyclone centres and tracks in CMIP6 or ERA5 data, to check
+    a dataset within seconds per year before running TRACK. Centres are
+    local extrema of the band-filtered field found with a moving window,
+    linked into tracks by nearest neighbours. The counts are approximate and
+    not a replacement for TRACK's tracks.
+
+    Parameters
+    ----------
+
+    input : string
+        Path to .nc file containing psl data for 'mslp', or combined UV data
+        for 'vor850'
+
+    kind : string, optional
+        Type of field, 'mslp' or 'vor850'
+
+    NH : boolean, optional
+        If true, looks at the Northern Hemisphere. If false, looks at the
+        Southern Hemisphere.
+
+    years : list of ints, optional
+        Years to look at. By default, all years in the input data.
+
+    threshold : number, optional
+        Smallest anomaly of a centre, in hPa for 'mslp' and 1e-5 s-1 for
+        'vor850'. Defaults to the threshold of the RUNDATIN files.
+
+    radius : int, optional
+        Half width in grid points of the window centres are found in
+
+    max_distance : number, optional
+        Largest distance in degrees a centre moves between time steps
+
+    trunc : int, optional
+        Largest zonal wavenumber kept. Defaults to 63 for grids with at least
+        96 latitudes and 42 otherwise, as in the tracking functions.
+
+    chunk : int, optional
+        Number of time steps read at once, which bounds memory use
+
+    Returns
+    -------
+
+    summary : dict
+        Per year: 'tracks' (TrackCollection of candidate tracks), 'steps',
+        'centres_per_step', 'ntracks', 'nfiltered' (tracks lasting at least
+        48 hours and travelling at least 1000 km), 'density' (mean number of
+        centres per step in 5 degree boxes, with 'density_lon' and
+        'density_lat' bin edges) and 'seconds'.
+
+    """
+    if kind not in PREVIEW_SETTINGS:
+        raise Exception("Invalid kind of preview. Please input one of " +
+                            ", ".join(PREVIEW_SETTINGS) + ".")
+    settings = PREVIEW_SETTINGS[kind]
+    if threshold is None:
+        threshold = settings['threshold']
+
+    data = Dataset(input, 'r')
+    variables = None
+    for names in settings['variables']:
+        if all([name in data.variables for name in names]):
+            variables = names
+            break
+    if variables is None:
+        raise Exception("Invalid input variable type. Please input a " +
+                            "psl or UV file.")
+
+    lon = _coordinate(data, ['lon', 'longitude'])
+    lat = _coordinate(data, ['lat', 'latitude'])
+    if trunc is None:
+        trunc = 63 if len(lat) >= 96 else 42
+
+    level = None
+    if data.variables[variables[0]].ndim == 4:
+        levels = np.asarray(_vertical_coordinate(data)[:], dtype=np.float64)
+        target = 85000. if levels.max() > 2000 else 850.
+        level = int(np.argmin(np.abs(levels - target)))
+
+    timevar = data.variables['time']
+    calendar = getattr(timevar, 'calendar', 'standard')
+    dates = num2date(timevar[:], timevar.units, calendar)
+    all_years = np.array([date.year for date in dates])
+    if years is None:
+        years = sorted(set(all_years))
+
+    hemisphere = lat > 0 if NH == True else lat < 0
+    # MSLP lows are minima, cyclonic vorticity has the sign of the latitude
+    sign = -1. if (kind == 'mslp') or (NH == False) else 1.
+
+    summary = {}
+    for year in years:
+        start = time.time()
+        steps = np.nonzero(all_years == int(year))[0]
+        if len(steps) == 0:
+            continue
+        print(str(year) + "...")
+        found = []
+        for first in range(0, len(steps), chunk):
+            chunk_steps = steps[first:first + chunk]
+            fields = _read_field(data, variables, chunk_steps, level)
+            if kind == 'vor850':
+                field = _vorticity(fields[0], fields[1], lon, lat)
+            else:
+                field = fields[0]
+            field = sign * settings['scale'] * _band_filter(field, trunc)
+            field[:, ~hemisphere, :] = -np.inf
+            step, clon, clat, value = detect_centres(field, lon, lat,
+                                                     threshold, radius)
+            found.append((step + first, clon, clat, value))
+
+        step, clon, clat, value = [np.concatenate(x) for x in zip(*found)]
+        units = "hours since " + dates[steps[0]].strftime("%Y-%m-%d %H:%M:%S")
+        hours = np.asarray(date2num(list(dates[steps]), units, calendar),
+                           dtype=np.float64)
+        links = link_centres(step, clon, clat, max_distance)
+        order = np.concatenate(links) if len(links) > 0 else \
+                    np.array([], dtype=int)
+        num_pts = np.array([len(track) for track in links], dtype=np.int64)
+        tracks = TrackCollection(np.arange(len(links)),
+                                 np.cumsum(num_pts) - num_pts, num_pts,
+                                 hours[step[order]], clon[order], clat[order],
+                                 {'intensity': sign * value[order]},
+                                 time_units=units)
+
+        density, lon_edges, lat_edges = np.histogram2d(
+            clon % 360, clat, bins=[np.arange(0, 365, 5),
+                                    np.arange(-90, 95, 5)])
+        summary[int(year)] = {
+            'tracks': tracks, 'steps': len(steps),
+            'centres_per_step': len(step) / len(steps),
+            'ntracks': len(tracks),
+            'nfiltered': len(tracks.filter_lifetime(48)
+                                   .filter_displacement(1000)),
+            'density': density.T / len(steps), 'density_lon': lon_edges,
+            'density_lat': lat_edges, 'seconds': time.time() - start}
+    data.close()
+    return summary
+
+def _preview_file(args):
+    # previews one file and keeps only the counts, for use in a Pool
+    input, kwargs = args
+    try:
+        summary = preview(input, **kwargs)
+    except Exception as err:
+        return [{'file': input, 'error': str(err)}]
+    return [{'file': input, 'year': year, 'steps': result['steps'],
+             'centres_per_step': result['centres_per_step'],
+             'ntracks': result['ntracks'], 'nfiltered': result['nfiltered'],
+             'seconds': result['seconds']}
+                for year, result in summary.items()]
+
+def triage(files, workers=1, **kwargs):
+    """
+    Preview many datasets in parallel and return the counts of centres and
+    tracks of every file and year, e.g. to find datasets with unusual
+    fields before running TRACK on them.
+
+    Parameters
+    ----------
+
+    files : list of strings
+        Paths to .nc input files
+
+    workers : int, optional
+        Number of files previewed at the same time
+
+    **kwargs
+        Further keyword arguments passed to preview, e.g. kind or NH.
+
+    Returns
+    -------
+
+    rows : list of dicts
+        Counts per file and year, or the error for files that could not be
+        previewed.
+
+    """
+    args = [(input, kwargs) for input in files]
+    if workers == 1:
+        results = [_preview_file(arg) for arg in args]
+    else:
+        with Pool(workers) as pool:
+            results = pool.map(_preview_file, args)
+    return [row for result in results for row in result]
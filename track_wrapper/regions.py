@@ -0,0 +1,231 @@
+import os
+import re
+import numpy as np
+from netCDF4 import Dataset
+
+from .tracks import read_tracks
+from .sampling import _coordinate, _nearest_index
+
+__all__ = ['region_bounds', 'in_region', 'write_initial', 'subset_tracks']
+
+# number of longitudes and Gaussian latitudes of the grid TRACK analyses the
+# spectrally filtered data on, by truncation
+ANALYSIS_GRIDS = {'42': (128, 64), '63': (192, 96)}
+
+def _read_mask(filename):
+    # reads the first 2-D or 3-D variable of a mask file, with its grid
+    data = Dataset(filename, 'r')
+    lon = _coordinate(data, ['lon', 'longitude'])
+    lat = _coordinate(data, ['lat', 'latitude'])
+    for var in data.variables.values():
+        if (var.ndim >= 2) and ('bnds' not in var.name) and \
+                ('bounds' not in var.name):
+            mask = var[:]
+            break
+    else:
+        raise Exception("No mask variable found in " + filename + ".")
+    data.close()
+    mask = np.ma.filled(np.ma.asarray(mask, dtype=np.float64), 0.)
+    while mask.ndim > 2:
+        mask = mask[0]
+    return lon, lat, mask != 0
+
+def region_bounds(region):
+    """
+    Return the bounding box of a tracking region.
+
+    Parameters
+    ----------
+
+    region : tuple or string
+        Bounding box (lon_min, lon_max, lat_min, lat_max) in degrees, or path
+        to a netCDF mask file that is non-zero inside the region. Boxes can
+        cross the 0 meridian, e.g. (-80, 20, 20, 80) for the North Atlantic.
+
+    Returns
+    -------
+
+    bounds : tuple
+        (lon_min, lon_max, lat_min, lat_max), with lon_min in [0, 360) and
+        lon_max > lon_min
+
+    """
+    if isinstance(region, str):
+        lon, lat, mask = _read_mask(region)
+        if np.any(mask) == False:
+            raise Exception("The mask in " + region + " is empty.")
+        lats = lat[np.any(mask, axis=1)]
+        lons = np.unique(lon[np.any(mask, axis=0)] % 360)
+        # the region spans all longitudes except the largest gap between them
+        gaps = np.diff(np.append(lons, lons[0] + 360))
+        spacing = np.min(np.abs(np.diff(np.sort(lon % 360))))
+        if gaps.max() <= spacing * 1.5:
+            return (0., 360., float(lats.min()), float(lats.max()))
+        start = (np.argmax(gaps) + 1) % len(lons)
+        lon_min = lons[start]
+        return (float(lon_min), float(lon_min + 360 - gaps.max()),
+                float(lats.min()), float(lats.max()))
+
+    lon_min, lon_max, lat_min, lat_max = [float(x) for x in region]
+    if (lat_min >= lat_max) or (lon_min == lon_max):
+        raise Exception("Invalid region. Please input (lon_min, lon_max, " +
+                            "lat_min, lat_max).")
+    if lon_max - lon_min >= 360:
+        return (0., 360., lat_min, lat_max)
+    width = (lon_max - lon_min) % 360
+    return (lon_min % 360, lon_min % 360 + width, lat_min, lat_max)
+
+def _crosses_meridian(region, lon0=0.):
+    # whether the region is split where the longitudes of a grid starting at
+    # lon0 wrap around, e.g. by the 0 meridian on a 0 to 360 grid or by the
+    # 180 meridian on a -180 to 180 grid
+    lon_min, lon_max = region_bounds(region)[:2]
+    if lon_max - lon_min >= 360:
+        return False
+    return (lon_min - lon0) % 360 + lon_max - lon_min >= 360
+
+def _first_longitude(gridfile):
+    # first longitude of the grid of a netCDF file
+    data = Dataset(gridfile, 'r')
+    lon0 = _coordinate(data, ['lon', 'longitude'])[0]
+    data.close()
+    return lon0
+
+def _in_longitudes(lon, bounds):
+    # whether longitudes are inside the longitude range of a bounding box
+    lon_min, lon_max = bounds[:2]
+    if lon_max - lon_min >= 360:
+        return np.ones(np.shape(lon), dtype=bool)
+    return (lon - lon_min) % 360 <= lon_max - lon_min
+
+def _in_bounds(lon, lat, bounds):
+    # whether points are inside a bounding box from region_bounds
+    return _in_longitudes(lon, bounds) & (lat >= bounds[2]) & \
+            (lat <= bounds[3])
+
+def in_region(lon, lat, region):
+    """
+    Return whether points are inside a tracking region.
+
+    Parameters
+    ----------
+
+    lon, lat : arrays
+        Longitudes and latitudes of the points in degrees
+
+    region : tuple or string
+        Bounding box or mask file, as for region_bounds
+
+    """
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    if isinstance(region, str) == False:
+        return _in_bounds(lon, lat, region_bounds(region))
+    mask_lon, mask_lat, mask = _read_mask(region)
+    j, i = _nearest_index(mask_lon, mask_lat, lon, lat)
+    return mask[j, i]
+
+def _grid_range(values, inside, periodic=False):
+    # 1-based range of grid indices covering the points inside the region,
+    # with one grid point of margin
+    index = np.nonzero(inside)[0]
+    if len(index) == 0:
+        raise Exception("The region contains no grid points.")
+    if (periodic == True) and (len(index) == len(values)):
+        # all longitudes, including the wrap-around point added by TRACK
+        return 1, len(values) + 1
+    return max(index.min(), 1), min(index.max() + 2, len(values))
+
+def _analysis_grid(trunc, lon0=0.):
+    # longitudes and Gaussian latitudes, from south to north, of the grid of
+    # the filtered data for a truncation; the longitudes start at the first
+    # longitude of the input, which is -180 if the input was reordered
+    nlon, nlat = ANALYSIS_GRIDS[trunc]
+    lon = lon0 + np.arange(nlon) * 360. / nlon
+    lat = np.degrees(np.arcsin(np.polynomial.legendre.leggauss(nlat)[0]))
+    return lon, lat
+
+def write_initial(template, gridfile, region, trackdir):
+    """
+    Write a TRACK initialisation file for a tracking region, so that TRACK
+    only detects and tracks features on the grid points of the region. The
+    grid points are those of the T42 or T63 grid of the spectrally filtered
+    data, whatever the grid of the input.
+
+    Parameters
+    ----------
+
+    template : string
+        Name of the hemispheric initialisation file in the TRACK data
+        directory, e.g. 'initial.T63_NH'
+
+    gridfile : string
+        Path to .nc file of the input TRACK is run on, only used for the
+        first longitude of its grid
+
+    region : tuple or string
+        Bounding box or mask file, as for region_bounds
+
+    trackdir : string
+        TRACK directory
+
+    Returns
+    -------
+
+    name : string
+        Name of the new initialisation file in the TRACK data directory
+
+    """
+    trunc = re.search(r'T(\d+)', template)
+    if (trunc is None) or (trunc.group(1) not in ANALYSIS_GRIDS):
+        raise Exception("Unknown truncation of " + template + ".")
+    lon0 = _first_longitude(gridfile)
+    lon, lat = _analysis_grid(trunc.group(1), lon0)
+
+    bounds = region_bounds(region)
+    if (template.endswith("_NH") and (bounds[3] <= 0)) or \
+            (template.endswith("_SH") and (bounds[2] >= 0)):
+        raise Exception("The region does not overlap the hemisphere of " +
+                            template + ".")
+    if _crosses_meridian(region, lon0) == True:
+        raise Exception("The region is split where the longitudes of " +
+                            gridfile + " wrap around. Please reorder " +
+                            "the longitudes of the input.")
+    x = _grid_range(lon, _in_longitudes(lon, bounds), periodic=True)
+    y = _grid_range(lat, (lat >= bounds[2]) & (lat <= bounds[3]))
+
+    with open(trackdir + "/data/" + template, 'r') as file:
+        lines = file.read().split('\n')
+    # lines 13 to 16 are the first and last grid points in x and y
+    lines[12:16] = [str(x[0]), str(x[1]), str(y[0]), str(y[1])]
+
+    name = template + "_%d_%d_%d_%d" % (x + y)
+    with open(trackdir + "/data/" + name, 'w') as file:
+        file.write('\n'.join(lines))
+    return name
+
+def subset_tracks(filename, region):
+    """
+    Keep only the tracks with at least one point inside a tracking region
+    in a TR2NC file. The file is rewritten in place.
+
+    Parameters
+    ----------
+
+    filename : string
+        Path to .nc file produced by TR2NC
+
+    region : tuple or string
+        Bounding box or mask file, as for region_bounds
+
+    """
+    tracks = read_tracks(filename)
+    inside = in_region(tracks.points('lon'), tracks.points('lat'), region)
+    owner = np.repeat(np.arange(len(tracks)), tracks.num_pts[tracks.selection])
+    keep = np.zeros(len(tracks), dtype=bool)
+    keep[owner[inside]] = True
+    tracks.where(keep).to_netcdf(filename + ".tmp")
+    os.replace(filename + ".tmp", filename)
+    print("Kept " + str(keep.sum()) + " of " + str(len(tracks)) +
+          " tracks in the region.")
+    return
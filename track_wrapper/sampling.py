@@ -0,0 +1,354 @@
+import numpy as np
+from multiprocessing import Pool
+from netCDF4 import Dataset, num2date
+
+from .tracks import great_circle, read_tracks, EARTH_RADIUS
+
+__all__ = ['sample_along_tracks', 'composite', 'sample_years']
+
+KM_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+_STATISTICS = {'max': np.nanmax, 'min': np.nanmin, 'mean': np.nanmean,
+               'sum': np.nansum}
+
+def _coordinate(data, names):
+    # returns the first coordinate variable found under one of the names
+    for name in names:
+        if name in data.variables:
+            return np.asarray(data.variables[name][:], dtype=np.float64)
+    raise Exception("No coordinate named " + " or ".join(names) + " found.")
+
+def _frame_index(tracks, data):
+    # index of the frame of the gridded data matching every track point, or
+    # -1 if the data has no frame at that time
+    time = data.variables['time']
+    units = tracks.time_units
+    if 'since' not in units:
+        raise Exception("Track times have no reference date.")
+    # track times are kept in hours whatever the units in the file were
+    point_dates = num2date(tracks.points('time'),
+                           "hours since " + units.split('since')[1],
+                           getattr(time, 'calendar', 'standard'))
+    frame_dates = num2date(time[:], time.units,
+                           getattr(time, 'calendar', 'standard'))
+    frames = {date: n for n, date in enumerate(frame_dates)}
+    return np.array([frames.get(date, -1) for date in point_dates])
+
+def _frames(tracks, filename, variable, level=None):
+    # yields each frame of the gridded data that has track points once,
+    # together with the indices of those points
+    data = Dataset(filename, 'r')
+    lat = _coordinate(data, ['lat', 'latitude'])
+    lon = _coordinate(data, ['lon', 'longitude'])
+    var = data.variables[variable]
+
+    if (var.ndim == 4) and (level is not None):
+        levels = _coordinate(data, ['plev', 'lev', 'level'])
+        level = int(np.argmin(np.abs(levels - level)))
+    elif var.ndim == 4:
+        raise Exception("Please give the level to sample for 3-D variables.")
+
+    index = _frame_index(tracks, data)
+    order = np.argsort(index, kind='stable')
+    frames, starts = np.unique(index[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+
+    for frame, start, end in zip(frames, starts, ends):
+        if frame < 0:
+            continue
+        if var.ndim == 4:
+            field = var[frame, level, :, :]
+        else:
+            field = var[frame, :, :]
+        field = np.ma.filled(np.ma.asarray(field, dtype=np.float64), np.nan)
+        yield lon, lat, field, order[start:end]
+    data.close()
+
+def sample_along_tracks(tracks, filename, samplers, level=None, batch=64):
+    """
+    Sample a gridded field along tracks. Each frame of the gridded data is
+    read once, and all track points at that time are sampled together.
+
+    Parameters
+    ----------
+
+    tracks : TrackCollection
+        Tracks to sample along, e.g. from read_tracks
+
+    filename : string
+        Path to .nc file containing the gridded field, with a time axis that
+        contains the times of the track points
+
+    samplers : dict
+        Quantities to sample, by name. Each is a tuple of (variable, radius,
+        statistic), where radius is the great circle radius in degrees around
+        the track point and statistic is one of 'max', 'min', 'mean' and
+        'sum'. A radius of None samples the grid point closest to the track
+        point, e.g. {'vor_centre': ('vor', None, None),
+        'max_wind': ('sfcWind', 6, 'max')}.
+
+    level : number, optional
+        Pressure level to sample for 3-D variables, in the units of the file.
+
+    batch : int, optional
+        Maximum number of storms sampled at once, which bounds memory use.
+
+    Returns
+    -------
+
+    samples : dict of arrays
+        Sampled values by name, one value per point of the selected tracks,
+        NaN where the gridded data has no matching time.
+
+    """
+    npts = int(tracks.num_pts[tracks.selection].sum())
+    lon_pts = tracks.points('lon')
+    lat_pts = tracks.points('lat')
+    samples = {name: np.full(npts, np.nan) for name in samplers}
+
+    for variable in set([sampler[0] for sampler in samplers.values()]):
+        names = [name for name in samplers if samplers[name][0] == variable]
+        for lon, lat, field, frame_points in _frames(tracks, filename,
+                                                     variable, level):
+            # storms are sampled in batches to bound the size of the masks
+            for start in range(0, len(frame_points), batch):
+                points = frame_points[start:start + batch]
+                _sample_frame(samples, samplers, names, lon, lat, field,
+                              lon_pts[points], lat_pts[points], points)
+    return samples
+
+def _window(lon, lat, lon_pt, lat_pt, radius):
+    # rows and columns of the grid that can lie within a great circle radius
+    # in degrees of a point, from the latitude range and the widest longitude
+    # range of the circle
+    rows = np.nonzero(np.abs(lat - lat_pt) <= radius)[0]
+    if np.abs(lat_pt) + radius >= 90:
+        cols = np.arange(len(lon))
+    else:
+        dlon = np.degrees(np.arcsin(min(1., np.sin(np.radians(radius)) /
+                                        np.cos(np.radians(lat_pt)))))
+        cols = np.nonzero(np.abs((lon - lon_pt + 180) % 360 - 180) <=
+                          dlon)[0]
+    return rows, cols
+
+def _sample_frame(samples, samplers, names, lon, lat, field, lon_pts,
+                  lat_pts, points):
+    # samples one frame for a batch of storms, using great circle distances
+    # from every storm to the grid points in a window around it, large
+    # enough for all samplers
+    radii = [samplers[name][1] for name in names]
+    if None in radii:
+        # the nearest grid point is closer than the grid spacing, unless the
+        # point is outside the grid
+        radii.append(np.abs(np.diff(lat)).max() + np.abs(np.diff(lon)).max())
+    radius = max([r for r in radii if r is not None]) + 1e-6
+    windows = [_window(lon, lat, lon_pt, lat_pt, radius)
+                for lon_pt, lat_pt in zip(lon_pts, lat_pts)]
+
+    # windows padded to the same size, with distances of infinity outside
+    # each window
+    nrows = max([len(rows) for rows, cols in windows])
+    ncols = max([len(cols) for rows, cols in windows])
+    rows = np.zeros((len(points), nrows), dtype=int)
+    cols = np.zeros((len(points), ncols), dtype=int)
+    inside = np.zeros((len(points), nrows, ncols), dtype=bool)
+    for n, (window_rows, window_cols) in enumerate(windows):
+        rows[n, :len(window_rows)] = window_rows
+        cols[n, :len(window_cols)] = window_cols
+        inside[n, :len(window_rows), :len(window_cols)] = True
+    distance = great_circle(lon_pts[:, None, None], lat_pts[:, None, None],
+                            lon[cols][:, None, :], lat[rows][:, :, None])
+    distance = np.where(inside, distance / KM_PER_DEGREE, np.inf)
+    distance = distance.reshape(len(points), -1)
+    values = field[rows[:, :, None], cols[:, None, :]].reshape(len(points),
+                                                               -1)
+
+    for name in names:
+        sample_radius, statistic = samplers[name][1:]
+        if sample_radius is None:
+            nearest = distance.argmin(axis=1)
+            samples[name][points] = values[np.arange(len(points)), nearest]
+            # points outside the grid need the whole grid
+            outside = distance.min(axis=1) > radius
+            if np.any(outside):
+                full = great_circle(lon_pts[outside, None, None],
+                                    lat_pts[outside, None, None],
+                                    lon[None, None, :], lat[None, :, None])
+                full = full.reshape(np.count_nonzero(outside), -1)
+                samples[name][points[outside]] = \
+                    field.ravel()[full.argmin(axis=1)]
+        else:
+            masked = np.where(distance <= sample_radius, values, np.nan)
+            samples[name][points] = _nanstatistic(statistic, masked)
+    return
+
+def _nanstatistic(statistic, values):
+    # applies a statistic along the last axis, ignoring NaN values
+    if statistic not in _STATISTICS:
+        raise Exception("Invalid statistic. Please input one of " +
+                            ", ".join(_STATISTICS) + ".")
+    result = np.full(values.shape[0], np.nan)
+    valid = np.any(~np.isnan(values), axis=1)
+    if np.any(valid):
+        result[valid] = _STATISTICS[statistic](values[valid], axis=1)
+    return result
+
+def _bearing(lon1, lat1, lon2, lat2):
+    # initial bearing in radians from point 1 to point 2, clockwise from north
+    lon1, lat1, lon2, lat2 = [np.radians(x) for x in [lon1, lat1, lon2, lat2]]
+    return np.arctan2(np.sin(lon2 - lon1) * np.cos(lat2),
+                      np.cos(lat1) * np.sin(lat2) -
+                        np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1))
+
+def _destination(lon, lat, distance, bearing):
+    # points at the given distances in degrees and bearings from lon, lat
+    lon, lat, distance = [np.radians(x) for x in [lon, lat, distance]]
+    lat2 = np.arcsin(np.sin(lat) * np.cos(distance) +
+                     np.cos(lat) * np.sin(distance) * np.cos(bearing))
+    lon2 = lon + np.arctan2(np.sin(bearing) * np.sin(distance) * np.cos(lat),
+                            np.cos(distance) - np.sin(lat) * np.sin(lat2))
+    return np.degrees(lon2) % 360, np.degrees(lat2)
+
+def _direction_of_motion(tracks):
+    # per-point bearing of the track, from the previous point, or to the next
+    # point for the first point of each track
+    lon = tracks.points('lon')
+    lat = tracks.points('lat')
+    counts = tracks.num_pts[tracks.selection]
+    first = (np.cumsum(counts) - counts)[counts > 0]
+
+    direction = np.zeros(len(lon))
+    direction[1:] = _bearing(lon[:-1], lat[:-1], lon[1:], lat[1:])
+    has_next = first[counts[counts > 0] > 1]
+    direction[first] = 0.
+    direction[has_next] = direction[has_next + 1]
+    return direction
+
+def _nearest_index(lon, lat, lon_pts, lat_pts):
+    # indices of the grid points nearest to the given points, for regular or
+    # Gaussian grids with ascending or descending latitudes
+    ascending = lat[0] < lat[-1]
+    lat_sorted = lat if ascending else lat[::-1]
+    j = np.clip(np.searchsorted(lat_sorted, lat_pts), 1, len(lat) - 1)
+    j = np.where(np.abs(lat_sorted[j - 1] - lat_pts) <
+                    np.abs(lat_sorted[j] - lat_pts), j - 1, j)
+    if not ascending:
+        j = len(lat) - 1 - j
+    dlon = (lon[1] - lon[0])
+    i = np.round((lon_pts - lon[0]) / dlon).astype(int) % len(lon)
+    return j, i
+
+def composite(tracks, filename, variable, radius=10., nrad=20, nazi=36,
+              rotate=False, level=None):
+    """
+    Compute a storm-centred composite of a gridded field on a radial grid
+    around the track points. Each frame of the gridded data is read once and
+    only the running sum is kept, so memory use does not grow with the number
+    of tracks.
+
+    Parameters
+    ----------
+
+    tracks : TrackCollection
+        Tracks to composite, e.g. after filtering
+
+    filename : string
+        Path to .nc file containing the gridded field
+
+    variable : string
+        Name of the variable to composite
+
+    radius : number, optional
+        Radius of the composite grid in degrees great circle distance
+
+    nrad, nazi : int, optional
+        Number of radial and azimuthal grid points
+
+    rotate : boolean, optional
+        If true, the composite grid is rotated with the direction of motion
+        of each storm, so that azimuth 0 points ahead of the storm. Otherwise
+        azimuth 0 points north.
+
+    level : number, optional
+        Pressure level to composite for 3-D variables, in the units of the
+        file.
+
+    Returns
+    -------
+
+    mean : array
+        Composite mean, with shape (nrad, nazi)
+
+    count : array
+        Number of samples at each composite grid point
+
+    distance, azimuth : arrays
+        Radial distances in degrees and azimuths in degrees of the grid
+
+    """
+    distance = np.linspace(0, radius, nrad)
+    azimuth = np.linspace(0, 360, nazi, endpoint=False)
+    total = np.zeros((nrad, nazi))
+    count = np.zeros((nrad, nazi))
+
+    lon_pts = tracks.points('lon')
+    lat_pts = tracks.points('lat')
+    if rotate == True:
+        direction = _direction_of_motion(tracks)
+    else:
+        direction = np.zeros(len(lon_pts))
+
+    for lon, lat, field, points in _frames(tracks, filename, variable, level):
+        bearing = direction[points, None, None] + \
+                    np.radians(azimuth)[None, None, :]
+        lon_grid, lat_grid = _destination(lon_pts[points, None, None],
+                                          lat_pts[points, None, None],
+                                          distance[None, :, None], bearing)
+        j, i = _nearest_index(lon, lat, lon_grid, lat_grid)
+        values = field[j, i]
+        valid = ~np.isnan(values)
+        total += np.where(valid, values, 0.).sum(axis=0)
+        count += valid.sum(axis=0)
+
+    with np.errstate(invalid='ignore'):
+        mean = total / count
+    return mean, count, distance, azimuth
+
+def _sample_file(args):
+    # samples one pair of track and gridded files, for use in a Pool
+    tracksfile, gridfile, samplers, level = args
+    return sample_along_tracks(read_tracks(tracksfile), gridfile, samplers,
+                               level=level)
+
+def sample_years(pairs, samplers, level=None, workers=1):
+    """
+    Sample gridded fields along tracks for several years in parallel.
+
+    Parameters
+    ----------
+
+    pairs : list of tuples
+        Pairs of paths (TR2NC track file, gridded .nc file), e.g. one per year
+
+    samplers : dict
+        Quantities to sample, as for sample_along_tracks
+
+    level : number, optional
+        Pressure level to sample for 3-D variables
+
+    workers : int, optional
+        Number of years to sample at the same time
+
+    Returns
+    -------
+
+    samples : list of dicts
+        Result of sample_along_tracks for every pair
+
+    """
+    args = [(tracksfile, gridfile, samplers, level)
+                for tracksfile, gridfile in pairs]
+    if workers == 1:
+        return [_sample_file(arg) for arg in args]
+    with Pool(workers) as pool:
+        return pool.map(_sample_file, args)
@@ -0,0 +1,453 @@
+import os
+import sys
+import json
+import hmac
+import time
+import shutil
+import secrets
+import tempfile
+import threading
+import multiprocessing
+from urllib import request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import track_wrapper as tw
+from .backends import TRACKING_FUNCTIONS, create_workspace, _tracking_function
+from .planner import record_run
+
+__all__ = ['TrackingService', 'serve', 'ServiceClient']
+
+def _reset_workspace(workspace):
+    # removes the files left behind by a job, keeping the links to the
+    # TRACK installation
+    for folder in ['indat', 'outdat']:
+        path = os.path.join(workspace, folder)
+        for name in os.listdir(path):
+            target = os.path.join(path, name)
+            if os.path.islink(target) == True:
+                continue
+            if os.path.isdir(target) == True:
+                shutil.rmtree(target, ignore_errors=True)
+            else:
+                os.remove(target)
+    return
+
+def _run_job(job, workspace, logfile, kinds):
+    # runs one job in a warm workspace, with the output of the job and of
+    # the TRACK commands it runs written to its log file; kinds are the
+    # extra kinds of tracking allowed by the service
+    result = {'id': job['id']}
+    kwargs = dict(job.get('kwargs', {}))
+    kwargs['NH'] = job.get('hemisphere', 'NH') == 'NH'
+    if job.get('year') is not None:
+        kwargs['years'] = [job['year']]
+    if len(job['files']) > 1:
+        kwargs['infile2'] = job['files'][1]
+
+    cwd = os.getcwd()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    streams = [sys.stdout, sys.stderr]
+    # the log is line buffered, so that progress can be streamed as it is
+    # printed
+    log = open(logfile, "a", buffering=1)
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout, sys.stderr = log, log
+    start = time.time()
+    try:
+        _tracking_function(kinds.get(job['kind'], job['kind']))(
+            job['files'][0], job['outdir'], **kwargs)
+        result['status'] = 'done'
+    except Exception as err:
+        result['status'] = 'failed'
+        result['error'] = str(err)
+    finally:
+        log.flush()
+        sys.stdout, sys.stderr = streams
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved:
+            os.close(fd)
+        log.close()
+        os.chdir(cwd)
+        _reset_workspace(workspace)
+
+    result['seconds'] = time.time() - start
+    if (job['kind'] in TRACKING_FUNCTIONS) and (job.get('year') is not None):
+        record_run(job['kind'], job['files'], job.get('year'),
+                   result['seconds'], status=result['status'],
+                   options=kwargs)
+    return result
+
+def _worker(workspace, jobs, results, kinds):
+    # long-running worker bound to one workspace; the environment and the
+    # CDO object are set up once and then reused by every job, while the
+    # per-input files are still templated by each job
+    os.environ["TRACK_DIR"] = workspace
+    tw._track_environment()
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        results.put({'id': job['id'], 'status': 'running',
+                     'workspace': workspace})
+        try:
+            result = _run_job(job, workspace, job['log'], kinds)
+        except Exception as err:
+            # the worker has to keep running, whatever happened to the job
+            result = {'id': job['id'], 'status': 'failed', 'error': str(err)}
+        results.put(result)
+    return
+
+class TrackingService(object):
+    """
+    Local tracking service holding a pool of warm, isolated TRACK
+    workspaces. Jobs are queued and run by long-running workers, one per
+    workspace, so that many small jobs can run at the same time without
+    setting up TRACK for every call.
+
+    What is kept warm between jobs is the workspace with its links to the
+    TRACK installation, the worker process with the TRACK environment
+    variables, the probed tools and the CDO object. Every job still prepares
+    its own input and templates its filter, vorticity and regional
+    initialisation files for the grid of that input, since these depend on
+    the input and take little time next to TRACK itself.
+    """
+    def __init__(self, directory=None, workers=2, trackdir=None, kinds=None):
+        """
+        Parameters
+        ----------
+
+        directory : string, optional
+            Directory for the workspaces and job logs. Defaults to a new
+            temporary directory, which is removed when the service stops.
+
+        workers : int, optional
+            Number of workspaces, i.e. number of jobs run at the same time
+
+        trackdir : string, optional
+            TRACK installation the workspaces link to. Defaults to the
+            current TRACK directory.
+
+        kinds : dict, optional
+            Extra kinds of tracking jobs can use, as names of tracking
+            functions 'module:function' by kind. Jobs can only use these and
+            the built-in kinds.
+
+        """
+        self.temporary = directory is None
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="pyTRACK_service_")
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.trackdir = tw._track_dir() if trackdir is None else trackdir
+        self.nworkers = workers
+        self.kinds = {} if kinds is None else dict(kinds)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.processes = []
+
+    def start(self):
+        """Create the workspaces and start the workers."""
+        os.makedirs(os.path.join(self.directory, "logs"), exist_ok=True)
+        self.queue = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        for n in range(self.nworkers):
+            workspace = os.path.join(self.directory, "workspace_" + str(n))
+            create_workspace(workspace, self.trackdir)
+            process = multiprocessing.Process(target=_worker,
+                                              args=(workspace, self.queue,
+                                                    self.results, self.kinds))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+        print("Started " + str(self.nworkers) + " TRACK workspaces in " +
+              self.directory + ".")
+        return
+
+    def _collect(self):
+        # updates the job states with the messages of the workers
+        while True:
+            message = self.results.get()
+            if message is None:
+                break
+            with self.lock:
+                self.jobs[message['id']].update(message)
+        return
+
+    def stop(self):
+        """Stop the workers and remove temporary workspaces."""
+        for process in self.processes:
+            self.queue.put(None)
+        for process in self.processes:
+            process.join()
+        self.results.put(None)
+        self.collector.join()
+        self.processes = []
+        if self.temporary == True:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        return
+
+    def submit(self, job):
+        """
+        Queue a tracking job.
+
+        Parameters
+        ----------
+
+        job : dict
+            Job with the keys 'kind', 'files' and 'outdir' and optionally
+            'hemisphere', 'year' and 'kwargs', as in the work units of
+            work_units.
+
+        Returns
+        -------
+
+        id : string
+            ID of the job
+
+        """
+        for key in ['kind', 'files', 'outdir']:
+            if key not in job:
+                raise Exception("Job has no " + key + ".")
+        if (job['kind'] not in TRACKING_FUNCTIONS) and \
+                (job['kind'] not in self.kinds):
+            raise Exception("Invalid kind of tracking " + job['kind'] + ".")
+
+        job = dict(job)
+        if isinstance(job['files'], str):
+            job['files'] = [job['files']]
+        job['files'] = [os.path.abspath(f) for f in job['files']]
+        job['outdir'] = os.path.abspath(os.path.expanduser(job['outdir']))
+        with self.lock:
+            job['id'] = str(len(self.jobs) + 1)
+            job['log'] = os.path.join(self.directory, "logs",
+                                      "job_" + job['id'] + ".log")
+            job['status'] = 'queued'
+            job['submitted'] = time.time()
+            self.jobs[job['id']] = job
+        open(job['log'], "w").close()
+        self.queue.put(job)
+        return job['id']
+
+    def status(self, id=None):
+        """Return the state of a job, or of all jobs if no ID is given."""
+        with self.lock:
+            if id is None:
+                return [dict(job) for job in self.jobs.values()]
+            if id not in self.jobs:
+                raise KeyError(id)
+            return dict(self.jobs[id])
+
+    def events(self, id, interval=0.2):
+        """
+        Yield the progress of a job as it runs: the lines of output of the
+        job, and finally the result of the job.
+        """
+        job = self.status(id)
+        with open(job['log'], "r") as log:
+            while True:
+                finished = self.status(id)['status'] in ['done', 'failed']
+                line = log.readline()
+                while line != "":
+                    yield {'event': 'log', 'line': line.rstrip('\n')}
+                    line = log.readline()
+                if finished == True:
+                    break
+                time.sleep(interval)
+        job = self.status(id)
+        yield {'event': job['status'], 'job': job}
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP API of the tracking service:
+    #   POST /jobs              submit a job, returns its ID
+    #   GET  /jobs              state of all jobs
+    #   GET  /jobs/ID           state of a job
+    #   GET  /jobs/ID/events    progress of a job, streamed as JSON lines
+    # every request needs the token of the service in its Authorization
+    # header
+    service = None
+    token = None
+
+    def _authorised(self):
+        header = self.headers.get("Authorization", "")
+        if hmac.compare_digest(header.encode(),
+                               ("Bearer " + self.token).encode()) == False:
+            self._send(401, {'error': 'invalid token'})
+            return False
+        return True
+
+    def _send(self, code, body):
+        data = (json.dumps(body) + "\n").encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return
+
+    def do_POST(self):
+        if self._authorised() == False:
+            return
+        if self.path.rstrip('/') != '/jobs':
+            return self._send(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length))
+            self._send(200, {'id': self.service.submit(job)})
+        except Exception as err:
+            self._send(400, {'error': str(err)})
+        return
+
+    def do_GET(self):
+        if self._authorised() == False:
+            return
+        parts = [part for part in self.path.split('/') if part != '']
+        try:
+            if parts == ['jobs']:
+                return self._send(200, self.service.status())
+            if (len(parts) == 2) and (parts[0] == 'jobs'):
+                return self._send(200, self.service.status(parts[1]))
+            if (len(parts) == 3) and (parts[0] == 'jobs') and \
+                    (parts[2] == 'events'):
+                self.service.status(parts[1])
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                for event in self.service.events(parts[1]):
+                    self.wfile.write((json.dumps(event) + "\n").encode())
+                    self.wfile.flush()
+                return
+        except KeyError:
+            return self._send(404, {'error': 'no such job'})
+        return self._send(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        return
+
+def serve(host='127.0.0.1', port=8642, directory=None, workers=2,
+          trackdir=None, token=None):
+    """
+    Run a local tracking service with an HTTP API until interrupted.
+
+    Requests have to carry the token of the service. It is written to the
+    file 'token' in the service directory, readable only by the user running
+    the service, where ServiceClient finds it.
+
+    Parameters
+    ----------
+
+    host : string, optional
+        Address to listen on. Defaults to localhost only.
+
+    port : int, optional
+        Port to listen on
+
+    directory : string, optional
+        Directory for the workspaces and job logs
+
+    workers : int, optional
+        Number of warm TRACK workspaces, i.e. jobs run at the same time
+
+    trackdir : string, optional
+        TRACK installation the workspaces link to
+
+    token : string, optional
+        Token of the service. Defaults to a new random token.
+
+    """
+    service = TrackingService(directory, workers, trackdir)
+    if token is None:
+        token = secrets.token_hex(32)
+    os.makedirs(service.directory, exist_ok=True)
+    tokenfile = os.path.join(service.directory, "token")
+    with os.fdopen(os.open(tokenfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                           0o600), "w") as file:
+        file.write(token)
+    os.chmod(tokenfile, 0o600)
+    service.start()
+    handler = type('Handler', (_Handler,), {'service': service,
+                                            'token': token})
+    server = ThreadingHTTPServer((host, port), handler)
+    print("Tracking service listening on http://" + host + ":" +
+          str(server.server_address[1]) + ", token in " + tokenfile + ".")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+    return
+
+class ServiceClient(object):
+    """Client for a running tracking service."""
+    def __init__(self, url='http://127.0.0.1:8642', token=None,
+                 directory=None):
+        """
+        Parameters
+        ----------
+
+        url : string, optional
+            Address of the service
+
+        token : string, optional
+            Token of the service. By default, it is read from the token file
+            in the service directory.
+
+        directory : string, optional
+            Service directory to read the token from, if it is not given
+
+        """
+        self.url = url.rstrip('/')
+        if token is None:
+            if directory is None:
+                raise Exception("Please input the token of the service or " +
+                                    "the service directory.")
+            with open(os.path.join(os.path.expanduser(directory),
+                                   "token"), "r") as file:
+                token = file.read().strip()
+        self.headers = {"Authorization": "Bearer " + token}
+
+    def _open(self, path, data=None):
+        # sends an authorised request to the service
+        headers = dict(self.headers)
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+        return request.urlopen(request.Request(self.url + path, data=data,
+                                               headers=headers))
+
+    def submit(self, kind, files, outdirectory, hemisphere='NH', year=None,
+               **kwargs):
+        """
+        Submit a tracking job and return its ID. The arguments are those of
+        the work units of work_units.
+        """
+        job = {'kind': kind, 'files': files, 'outdir': outdirectory,
+               'hemisphere': hemisphere, 'year': year, 'kwargs': kwargs}
+        with self._open("/jobs", json.dumps(job).encode()) as response:
+            return json.loads(response.read())['id']
+
+    def status(self, id=None):
+        """Return the state of a job, or of all jobs if no ID is given."""
+        path = "/jobs" if id is None else "/jobs/" + str(id)
+        with self._open(path) as response:
+            return json.loads(response.read())
+
+    def events(self, id):
+        """Yield the progress of a job as it runs, ending with its result."""
+        with self._open("/jobs/" + str(id) + "/events") as response:
+            for line in response:
+                yield json.loads(line)
+
+    def wait(self, id, verbose=True):
+        """Wait for a job to finish, printing its output, and return it."""
+        for event in self.events(id):
+            if event['event'] == 'log':
+                if verbose == True:
+                    print(event['line'])
+            else:
+                return event['job']
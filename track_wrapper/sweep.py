@@ -0,0 +1,250 @@
+import os
+import csv
+import time
+import shutil
+import tempfile
+from multiprocessing import Pool
+from netCDF4 import Dataset
+
+from . import track_wrapper as tw
+from .backends import TRACKING_FUNCTIONS, create_workspace
+from .regions import subset_tracks
+
+__all__ = ['rundatin', 'sweep']
+
+# RUNDATIN template used by each kind of tracking
+DEFAULT_TEMPLATES = {'mslp': 'MSLP', 'vor850': 'VOR', 'era5_mslp': 'MSLP',
+                     'era5_vor850': 'VOR'}
+
+def rundatin(template='MSLP', overrides=None):
+    """
+    Create the contents of a RUNDATIN file from a template, with some of its
+    lines replaced. RUNDATIN files hold the answers to TRACK's prompts one per
+    line, so a parameter such as a threshold or search radius is changed by
+    replacing its line.
+
+    Parameters
+    ----------
+
+    template : string, optional
+        Name of a RUNDATIN file installed by setup_files ('MSLP', 'MSLP_A',
+        'VOR' or 'VOR_A'), or path to a RUNDATIN file
+
+    overrides : dict, optional
+        New contents of lines by line number, counting from 1, e.g.
+        {43: '5.0'}
+
+    Returns
+    -------
+
+    contents : string
+        Contents of the RUNDATIN file
+
+    """
+    if os.path.isfile(template):
+        path = template
+    else:
+        path = tw._track_dir() + "/indat/RUNDATIN." + template + ".in"
+        if os.path.isfile(path) == False:
+            raise Exception("RUNDATIN file " + path + " not found. Please " +
+                                "run setup_files or give a path.")
+    with open(path, 'r') as file:
+        lines = file.read().split('\n')
+
+    if overrides is not None:
+        for line, value in overrides.items():
+            if (int(line) < 1) or (int(line) > len(lines)):
+                raise Exception("Line " + str(line) + " is not in " + path +
+                                    ".")
+            lines[int(line) - 1] = str(value)
+    return '\n'.join(lines)
+
+def _configurations(configs, kind):
+    # RUNDATIN contents for every configuration of a sweep; a configuration
+    # is a template name or path, or a dict of line overrides with an
+    # optional 'template' entry
+    contents = {}
+    for name, config in configs.items():
+        if isinstance(config, str):
+            contents[name] = rundatin(config)
+        else:
+            overrides = {line: value for line, value in config.items()
+                            if line != 'template'}
+            contents[name] = rundatin(config.get('template',
+                                                 DEFAULT_TEMPLATES[kind]),
+                                      overrides)
+    return contents
+
+def _count_tracks(filename):
+    # number of tracks in a TR2NC file, or None if it was not written
+    if os.path.isfile(filename) == False:
+        return None
+    data = Dataset(filename, 'r')
+    ntracks = len(data.dimensions['tracks'])
+    data.close()
+    return ntracks
+
+def _run_config(args):
+    # runs master on one filtered year with one configuration, in its own
+    # workspace, for use in a Pool
+    run, name, contents, kind, trackdir, outdir, scratch, netcdf, region = args
+    result = {'config': name, 'year': run['year'], 'name': run['name']}
+    outdir = os.path.join(outdir, name)
+    os.makedirs(outdir, exist_ok=True)
+
+    workdir = tempfile.mkdtemp(dir=scratch)
+    workspace = os.path.join(workdir, "TRACK")
+    cwd = os.getcwd()
+    start = time.time()
+    try:
+        create_workspace(workspace, trackdir)
+        rundatin_file = workspace + "/indat/RUNDATIN.SWEEP.in"
+        with open(rundatin_file, "w") as file:
+            file.write(contents)
+
+        os.environ["TRACK_DIR"] = workspace
+        tw._track_environment()
+        os.chdir(workspace)
+        if 'mslp' in kind:
+            signs, tr2nc = ['neg'], tw.tr2nc_mslp
+        else:
+            signs, tr2nc = ['pos', 'neg'], tw.tr2nc_vor
+        outputs = [outdir + "/" + run['name'] + "/" + prefix + "_trs_" + sign
+                   for sign in signs for prefix in ['ff', 'tr']]
+        tw._run_stage("Running TRACK", "master -c=" + run['name'] +
+                      " -e=track.linux -d=now -i=" + run['input'] + " -f=y" +
+                      run['year'] + " -j=RUN_AT.in -k=" + run['initial'] +
+                      " -n=1,62," + str(run['nchunks']) + " -o='" + outdir +
+                      "' -r=RUN_AT_ -s=RUNDATIN.SWEEP",
+                      [trs + ".gz" for trs in outputs])
+
+        if netcdf == True:
+            for trs in outputs:
+                tw._run_stage("Unpacking tracks", "gunzip '" + trs + ".gz'",
+                              [trs])
+                tr2nc(trs)
+                if region is not None:
+                    subset_tracks(trs + ".nc", region)
+                result[os.path.basename(trs)] = _count_tracks(trs + ".nc")
+        result['status'] = 'done'
+    except Exception as err:
+        result['status'] = 'failed'
+        result['error'] = str(err)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result['seconds'] = time.time() - start
+    return result
+
+def _write_summary(results, filename):
+    # writes the results of a sweep as a csv table, one row per
+    # configuration and year
+    columns = ['config', 'year', 'status', 'seconds']
+    for result in results:
+        columns += [key for key in result if key not in columns]
+    with open(filename, "w", newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=columns)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+    return
+
+def sweep(input, outdirectory, configs, kind='mslp', infile2=None, NH=True,
+          workers=1, scratch=None, netcdf=True, **kwargs):
+    """
+    Run TRACK with several RUNDATIN configurations, e.g. to test the
+    sensitivity of the tracks to thresholds or search radii. The input is
+    preprocessed and spectrally filtered once for every year, and TRACK is
+    then run on the filtered data with every configuration, in parallel.
+
+    The tracks of each configuration are written to a directory named after
+    it, and a summary table with the runtime and number of tracks of every
+    run is written to sweep_summary.csv in the output directory.
+
+    Parameters
+    ----------
+
+    input : string
+        Path to .nc file containing the input data
+
+    outdirectory : string
+        Path of directory to output tracks to
+
+    configs : dict
+        Configurations to run, by name. Each is the name of an installed
+        RUNDATIN file ('MSLP', 'MSLP_A', 'VOR' or 'VOR_A'), a path to a
+        RUNDATIN file, or a dict of line overrides applied to the default
+        RUNDATIN file of the kind of tracking, e.g.
+        {'default': 'MSLP', 'radius_5': {43: '5.0'}}. A dict of overrides
+        can name another template under the key 'template'.
+
+    kind : string, optional
+        Type of tracking, one of 'mslp', 'vor850', 'era5_mslp' and
+        'era5_vor850'.
+
+    infile2 : string, optional
+        Path to .nc file containing V data, for vorticity tracking from
+        separate U and V files
+
+    NH : boolean, optional
+        If true, tracks the Northern Hemisphere. If false, tracks Southern
+        Hemisphere.
+
+    workers : int, optional
+        Number of TRACK runs at the same time
+
+    scratch : string, optional
+        Directory for the temporary TRACK workspaces of the runs
+
+    netcdf : boolean, optional
+        If true, converts TRACK output to netCDF format using TR2NC utility.
+
+    **kwargs
+        Further keyword arguments passed to the tracking function, e.g.
+        timestep or years.
+
+    Returns
+    -------
+
+    results : list of dicts
+        Configuration, year, status, runtime in seconds and number of tracks
+        in each output file of every run.
+
+    """
+    if kind not in TRACKING_FUNCTIONS:
+        raise Exception("Invalid kind of tracking. Please input one of " +
+                            ", ".join(TRACKING_FUNCTIONS) + ".")
+    outdir = os.path.abspath(os.path.expanduser(outdirectory))
+    os.makedirs(outdir, exist_ok=True)
+    contents = _configurations(configs, kind)
+
+    if infile2 is not None:
+        kwargs['infile2'] = infile2
+    runs = getattr(tw, TRACKING_FUNCTIONS[kind])(input, outdir, NH=NH,
+                                                 netcdf=netcdf,
+                                                 filter_only=True, **kwargs)
+    print("Filtered " + str(len(runs)) + " years, running " +
+          str(len(runs) * len(contents)) + " configurations...")
+
+    trackdir = tw._track_dir()
+    args = [(run, name, contents[name], kind, trackdir, outdir, scratch,
+             netcdf, kwargs.get('region'))
+                for run in runs for name in contents]
+    trackdir_env = os.environ.get("TRACK_DIR")
+    try:
+        if workers == 1:
+            results = [_run_config(arg) for arg in args]
+        else:
+            with Pool(workers) as pool:
+                results = pool.map(_run_config, args)
+    finally:
+        if trackdir_env is None:
+            os.environ.pop("TRACK_DIR", None)
+        else:
+            os.environ["TRACK_DIR"] = trackdir_env
+        # the filtered data is only needed for the sweep
+        for run in runs:
+            os.system("rm " + trackdir + "/indat/" + run['input'])
+
+    _write_summary(results, os.path.join(outdir, "sweep_summary.csv"))
+    return results
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+from pytest import fixture
+
+FAKE_TRACKING = '''
+import os
+
+def fake_track(input, outdirectory, NH=True, years=None, netcdf=True):
+    """Stand-in for a tracking function, records where it was run."""
+    if NH == True:
+        hemisphere = "NH"
+    else:
+        hemisphere = "SH"
+    os.makedirs(outdirectory, exist_ok=True)
+    name = str(years[0]) + "_" + hemisphere + "_" + os.path.basename(input)
+    with open(os.path.join(outdirectory, name), "w") as file:
+        file.write(os.environ["TRACK_DIR"])
+
+def flaky_track(input, outdirectory, NH=True, years=None):
+    """Stand-in for a tracking function with a stage failing once."""
+    from track_wrapper import StageError
+    marker = os.path.join(outdirectory, "failed")
+    if os.path.isfile(marker) == False:
+        os.makedirs(outdirectory, exist_ok=True)
+        open(marker, "w").close()
+        raise StageError("Running TRACK failed with exit code 1: master")
+'''
+
+@fixture
+def fake_setup(tmp_path, monkeypatch):
+    """Fake TRACK installation and tracking function module"""
+    trackdir = tmp_path / "TRACK-1.5.2"
+    for folder in ["bin", "indat", "outdat", "data"]:
+        (trackdir / folder).mkdir(parents=True)
+    (trackdir / "indat" / "RUNDATIN.MSLP.in").write_text("test")
+    (tmp_path / "fake_tracking.py").write_text(FAKE_TRACKING)
+
+    monkeypatch.setenv("TRACK_DIR", str(trackdir))
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join([str(tmp_path),
+                        os.getcwd()] + sys.path))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    return tmp_path
+
+def test_work_units(fake_setup):
+    """Check that work units are split by file, year and hemisphere."""
+    from track_wrapper import work_units
+    units = work_units(['a.nc', ['u.nc', 'v.nc']], str(fake_setup),
+                       kind='vor850', hemispheres=['NH', 'SH'],
+                       years=[2010, 2011], netcdf=False)
+    assert len(units) == 8
+    assert units[0]['year'] == 2010 and units[0]['hemisphere'] == 'NH'
+    assert len(units[-1]['files']) == 2
+    assert units[-1]['kwargs'] == {'netcdf': False}
+
+def test_create_workspace(fake_setup):
+    """Check that workspaces have private indat and outdat directories."""
+    from track_wrapper import create_workspace
+    workspace = fake_setup / "workspace"
+    create_workspace(str(workspace))
+    assert os.path.islink(workspace / "bin")
+    assert not os.path.islink(workspace / "indat")
+    assert os.path.isfile(workspace / "indat" / "RUNDATIN.MSLP.in")
+
+def test_workspace_temporary_files(fake_setup):
+    """Check that files left by an interrupted run are not linked."""
+    from track_wrapper import create_workspace
+    for name in ["temp_file.nc", "tempyear.nc", "vor850_temp.dat",
+                 "T42filt_1979.dat"]:
+        (fake_setup / "TRACK-1.5.2" / "indat" / name).write_text("stale")
+    (fake_setup / "TRACK-1.5.2" / "spec.test").write_text("stale")
+    workspace = fake_setup / "workspace"
+    create_workspace(str(workspace))
+    assert os.listdir(workspace / "indat") == ["RUNDATIN.MSLP.in"]
+    assert not os.path.lexists(workspace / "spec.test")
+
+def test_array_job_script(fake_setup):
+    """Check generated SLURM and PBS array job scripts."""
+    from track_wrapper import work_units, ArrayJobBackend
+    units = work_units(['a.nc'], str(fake_setup), years=[2010, 2011])
+    slurm = ArrayJobBackend(str(fake_setup / "slurm"), scheduler='slurm',
+                            options=['--time=01:00:00'])
+    with open(slurm.write_script(units)) as file:
+        script = file.read()
+    assert "#SBATCH --array=0-1" in script
+    assert "#SBATCH --time=01:00:00" in script
+    assert "$SLURM_ARRAY_TASK_ID" in script
+
+    pbs = ArrayJobBackend(str(fake_setup / "pbs"), scheduler='pbs')
+    with open(pbs.write_script(units)) as file:
+        assert "#PBS -J 0-1" in file.read()
+
+def test_emulated_array_job(fake_setup):
+    """Run an array job on local subprocesses acting as nodes."""
+    from track_wrapper import work_units, ArrayJobBackend
+    outdir = fake_setup / "out"
+    units = work_units(['a.nc', 'b.nc'], str(outdir),
+                       kind='fake_tracking:fake_track',
+                       hemispheres=['NH', 'SH'], years=[2010])
+    backend = ArrayJobBackend(str(fake_setup / "job"), emulate=True,
+                              scratch=str(fake_setup / "scratch"))
+    assert backend.submit(units) == 'local'
+    results = backend.collect()
+    assert [result['status'] for result in results] == ['done'] * 4
+    assert sorted(os.listdir(outdir)) == ['2010_NH_a.nc', '2010_NH_b.nc',
+                                          '2010_SH_a.nc', '2010_SH_b.nc']
+    # every task ran in its own workspace, which was cleaned up afterwards
+    with open(outdir / "2010_SH_b.nc") as file:
+        assert "pyTRACK_task_3" in file.read()
+    assert os.listdir(fake_setup / "scratch") == []
+
+def test_local_backend(fake_setup):
+    """Run work units in a local worker pool."""
+    from track_wrapper import work_units, LocalBackend
+    outdir = fake_setup / "out"
+    units = work_units(['a.nc'], str(outdir), kind='fake_tracking:fake_track',
+                       years=[2010, 2011])
+    results = LocalBackend(workers=2).run(units)
+    assert [result['status'] for result in results] == ['done', 'done']
+    assert len(os.listdir(outdir)) == 2
+
+def test_run_unit_retries(fake_setup):
+    """Retry work units after a failed stage."""
+    from track_wrapper import work_units, run_unit
+    units = work_units(['a.nc'], str(fake_setup / "flaky"),
+                       kind='fake_tracking:flaky_track', years=[2010])
+    result = run_unit(units[0])
+    assert result['status'] == 'failed' and result['attempts'] == 1
+    assert "exit code 1" in result['error']
+
+    os.remove(fake_setup / "flaky" / "failed")
+    result = run_unit(units[0], retries=1)
+    assert result['status'] == 'done' and result['attempts'] == 2
+    assert 'error' not in result
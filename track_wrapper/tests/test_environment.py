@@ -0,0 +1,85 @@
+import os
+import json
+from pytest import fixture
+
+@fixture
+def environment(tmp_path, monkeypatch):
+    """Environment module with an empty cache and a fake TRACK installation"""
+    from track_wrapper import environment
+    monkeypatch.setattr(environment, '_ENVIRONMENT', {})
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    trackdir = tmp_path / "TRACK"
+    (trackdir / "bin").mkdir(parents=True)
+    (trackdir / "bin" / "track.linux").write_text("")
+    (trackdir / "master").write_text("")
+    monkeypatch.setenv("TRACK_DIR", str(trackdir))
+    return environment
+
+def test_lazy_cdo():
+    """Check that importing the package does not start CDO."""
+    import track_wrapper
+    assert track_wrapper.track_wrapper.cdo._cdo is None
+
+def test_probe_track(environment, tmp_path):
+    """Check that TRACK is found outside the home directory."""
+    env = environment.probe_environment()
+    assert env['track'] == str(tmp_path / "TRACK")
+    assert env['master'] == str(tmp_path / "TRACK" / "master")
+    assert env['tr2nc'] is None
+    assert os.path.isfile(tmp_path / "cache" / "pyTRACK-CMIP6" /
+                            "environment.json")
+
+def test_probe_cache_invalidation(environment, tmp_path, monkeypatch):
+    """Check that the cache is used until a tool changes."""
+    environment.probe_environment()
+    calls = []
+    probe_track = environment._probe_track
+    monkeypatch.setattr(environment, '_probe_track',
+                        lambda trackdir: calls.append(trackdir) or
+                                            probe_track(trackdir))
+
+    # new process, valid cache on disk
+    monkeypatch.setattr(environment, '_ENVIRONMENT', {})
+    environment.probe_environment()
+    assert calls == []
+
+    # TR2NC was built
+    tr2nc = tmp_path / "TRACK" / "utils" / "bin" / "tr2nc"
+    tr2nc.parent.mkdir(parents=True)
+    tr2nc.write_text("")
+    os.utime(tmp_path / "TRACK" / "bin" / "track.linux", (0, 0))
+    monkeypatch.setattr(environment, '_ENVIRONMENT', {})
+    env = environment.probe_environment()
+    assert len(calls) == 1
+    assert env['tr2nc'] == str(tr2nc)
+
+def test_probe_cache_new_tools(environment, tmp_path, monkeypatch):
+    """Check that master and TR2NC built after the probe are found."""
+    os.remove(tmp_path / "TRACK" / "master")
+    env = environment.probe_environment()
+    assert env['master'] is None and env['tr2nc'] is None
+
+    # built outside setup_tr2nc, without touching track.linux
+    tr2nc = tmp_path / "TRACK" / "utils" / "bin" / "tr2nc"
+    tr2nc.parent.mkdir(parents=True)
+    tr2nc.write_text("")
+    (tmp_path / "TRACK" / "master").write_text("")
+    monkeypatch.setattr(environment, '_ENVIRONMENT', {})
+    env = environment.probe_environment()
+    assert env['master'] == str(tmp_path / "TRACK" / "master")
+    assert env['tr2nc'] == str(tr2nc)
+
+def test_setup_tr2nc_refresh(environment, tmp_path):
+    """Check that TR2NC is found in the same process once it is built."""
+    import shutil
+    from track_wrapper import track_wrapper as tw
+    trackdir = tmp_path / "TRACK"
+    (trackdir / "utils").mkdir()
+    shutil.copy("track_wrapper/tr2nc_new.tar", str(trackdir / "utils"))
+    # stand-in for the TRACK Makefile
+    (trackdir / "Makefile").write_text(".PHONY: utils\nutils:\n\t" +
+                                       "mkdir -p utils/bin && " +
+                                       "echo tr2nc > utils/bin/tr2nc\n")
+    assert environment.probe_environment()['tr2nc'] is None
+    tw.setup_tr2nc()
+    assert tw._tr2nc() == str(trackdir / "utils" / "bin" / "tr2nc")
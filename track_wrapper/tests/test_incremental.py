@@ -0,0 +1,39 @@
+import numpy as np
+
+def collection(tracks):
+    """Build a TrackCollection from lists of (time, lon, lat) points"""
+    from track_wrapper.incremental import _from_tracks
+    return _from_tracks([{'track_id': n, 'time': np.array(t, dtype=float),
+                          'lon': np.array(x, dtype=float),
+                          'lat': np.array(y, dtype=float),
+                          'vor': np.ones(len(t))}
+                            for n, (t, x, y) in enumerate(tracks)],
+                        ['vor'], 'hours since 1979-01-01 00:00:00')
+
+def test_stitch_tracks():
+    """Check that a storm crossing the boundary is kept as one track."""
+    from track_wrapper import stitch_tracks
+    # earlier run ends at hour 24, new run starts at hour 12
+    old = collection([([0, 6, 12, 18, 24], [0, 1, 2, 3, 4], [50] * 5),
+                      ([0, 6], [100, 101], [40, 40])])
+    new = collection([([12, 18, 24, 30, 36], [2.2, 3, 4, 5, 6], [50] * 5),
+                      ([18, 24], [200, 201], [60, 60]),
+                      ([24, 30], [150, 151], [30, 30])])
+    tracks = stitch_tracks(old, new, boundary=24, overlap=12)
+
+    assert len(tracks) == 3
+    assert list(tracks.track_id) == [0, 1, 2]
+    assert list(tracks.track(0)['time']) == [0, 6, 12, 18, 24, 30, 36]
+    assert list(tracks.track(0)['lon']) == [0, 1, 2, 3, 4, 5, 6]
+    assert list(tracks.track(1)['time']) == [0, 6]
+    assert list(tracks.track(2)['lon']) == [150, 151]
+    assert len(tracks.points('vor')) == 11
+
+def test_stitch_closed_tracks():
+    """Check that only open tracks are continued."""
+    from track_wrapper import stitch_tracks
+    old = collection([([12, 18, 24], [0, 1, 2], [50] * 3)])
+    new = collection([([18, 24, 30], [1, 2, 3], [50] * 3)])
+    tracks = stitch_tracks(old, new, boundary=24, overlap=12, open_tracks=[])
+    assert len(tracks) == 2
+    assert list(tracks.num_pts) == [3, 3]
@@ -0,0 +1,53 @@
+import os
+import shutil
+from netCDF4 import Dataset
+
+FAKE_TRACK = '''#!/bin/sh
+# stand-in for TRACK, writes the vorticity file named in calcvor.test
+cat > /dev/null
+for file in $(grep '^indat/' calcvor.test); do
+    echo vorticity > $file
+done
+'''
+
+def test_level_name():
+    """Check the names of pressure levels in file names."""
+    from track_wrapper.levels import _level_name
+    assert _level_name(85000) == "vor850"
+    assert _level_name(50000.) == "vor500"
+
+def test_calc_vorticity_level(tmp_path, monkeypatch):
+    """Calculate vorticity with TRACK at a level other than 850 hPa."""
+    from track_wrapper import track_wrapper as tw
+    trackdir = tmp_path / "TRACK-1.5.2"
+    for folder in ["bin", "indat"]:
+        (trackdir / folder).mkdir(parents=True)
+    shutil.copy("track_wrapper/trackdir/calcvor.in", str(trackdir))
+    (trackdir / "bin" / "track.linux").write_text(FAKE_TRACK)
+    (trackdir / "bin" / "track.linux").chmod(0o755)
+    monkeypatch.setenv("TRACK_DIR", str(trackdir))
+    class FakeCdo(object):
+        def showyear(self, **kwargs):
+            return ["1979"]
+    monkeypatch.setattr(tw, "cdo", FakeCdo())
+
+    filename = str(trackdir / "indat" / "tempyear.nc")
+    data = Dataset(filename, 'w')
+    data.createDimension('lat', 2)
+    data.createDimension('lon', 3)
+    data.createVariable('lat', 'f8', ('lat',))[:] = [-45., 45.]
+    data.createVariable('lon', 'f8', ('lon',))[:] = [0., 120., 240.]
+    data.createVariable('u', 'f4', ('lat', 'lon'))[:] = 1.
+    data.createVariable('v', 'f4', ('lat', 'lon'))[:] = 1.
+    data.close()
+
+    cwd = os.getcwd()
+    tw.calc_vorticity(filename, "vor500_temp.dat", copy_file=False,
+                      cmip6=False, level=50000)
+    assert os.getcwd() == cwd
+    lines = (trackdir / "calcvor.test").read_text().split('\n')
+    assert lines.count("50000") == 3 and "85000" not in lines
+    assert "indat/vor500_temp.dat" in lines
+    assert os.path.isfile(trackdir / "indat" / "vor500_temp.dat")
+    # the shared input is kept for the other levels
+    assert os.path.isfile(filename)
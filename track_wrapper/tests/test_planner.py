@@ -0,0 +1,65 @@
+import os
+import json
+from pytest import fixture
+
+@fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    """Keep run reports out of the user's cache"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+def test_plan_mslp():
+    """Check planned stages for a Gaussian MSLP file."""
+    from track_wrapper import plan
+    result = plan('data/psl_test.nc', '~', calibration={})
+    names = [stage['name'] for stage in result.stages]
+    assert names == ['reduce', 'fill', 'select year', 'spectral filter',
+                     'tracking', 'tr2nc']
+    assert result.metadata['gaussian'] == True
+    assert result.metadata['trunc'] == 63
+    assert result.metadata['frames'] == {2010: 2}
+    filt = result.stages[3]['creates'][1]
+    assert filt == ("indat/T63filt_2010.dat", 192 * 96 * 4 * 2)
+    assert result.peak_bytes > 0
+
+def test_plan_vorticity():
+    """Check that only the 850 hPa level is planned for wind data."""
+    from track_wrapper import plan
+    result = plan('data/uv_test.nc', '~', kind='vor850', calibration={})
+    names = [stage['name'] for stage in result.stages]
+    assert 'vorticity' in names and 'remove bounds' in names
+    reduced = result.stages[0]['creates'][0][1]
+    assert reduced == 192 * 96 * 2 * 4 * 2 # one level, ua and va, 2 frames
+
+def test_calibration(tmp_path):
+    """Check that run reports scale the runtime estimates."""
+    from track_wrapper import plan, calibrate, record_run
+    predicted = plan('data/psl_test.nc', '~', calibration={}).total_seconds
+    reports = str(tmp_path / "runs.jsonl")
+    record_run('mslp', ['data/psl_test.nc'], 2010, 2 * predicted,
+               reports=reports)
+    record_run('mslp', ['data/psl_test.nc'], 2010, 1., status='failed',
+               reports=reports)
+    factors = calibrate(reports)
+    assert abs(factors['mslp'] - 2) < 1e-6
+    calibrated = plan('data/psl_test.nc', '~', calibration=factors)
+    assert abs(calibrated.total_seconds - 2 * predicted) < 1e-6
+
+def test_calibration_options(tmp_path):
+    """Check that reports keep the prediction for the options of the run."""
+    import shutil
+    from track_wrapper import plan, calibrate, record_run
+    infile = str(tmp_path / "psl.nc")
+    shutil.copy('data/psl_test.nc', infile)
+    predicted = plan(infile, '~', timestep=12, NH=False,
+                     calibration={}).total_seconds
+    reports = str(tmp_path / "runs.jsonl")
+    record_run('mslp', [infile], 2010, 3 * predicted, reports=reports,
+               options={'timestep': 12, 'NH': False, 'years': [2010]})
+    with open(reports, "r") as file:
+        report = json.loads(file.readline())
+    assert report['options'] == {'timestep': 12, 'NH': False}
+    assert abs(report['predicted'] - predicted) < 1e-6
+
+    # calibration only reads the reports
+    os.remove(infile)
+    assert abs(calibrate(reports)['mslp'] - 3) < 1e-6
@@ -0,0 +1,71 @@
+import numpy as np
+from netCDF4 import Dataset
+from pytest import fixture
+
+@fixture(scope='module')
+def psl_file(tmp_path_factory):
+    """Synthetic psl file with two lows at the end of 1979"""
+    filename = str(tmp_path_factory.mktemp("preview") / "psl.nc")
+    lon = np.arange(0, 360, 2.5)
+    lat = np.arange(-88.75, 90, 2.5)
+    hours = np.arange(0, 24 * 10, 6)
+    data = Dataset(filename, 'w')
+    data.createDimension('time', None)
+    data.createDimension('lat', len(lat))
+    data.createDimension('lon', len(lon))
+    data.createVariable('lon', 'f8', ('lon',))[:] = lon
+    data.createVariable('lat', 'f8', ('lat',))[:] = lat
+    time = data.createVariable('time', 'f8', ('time',))
+    time.units = "hours since 1979-12-29 00:00:00"
+    time.calendar = "standard"
+    time[:] = hours
+
+    psl = np.full((len(hours), len(lat), len(lon)), 101325.)
+    lon2, lat2 = np.meshgrid(lon, lat)
+    for n in range(len(hours)):
+        # 20 hPa lows moving 2.5 degrees east per step from day 1 to day 3
+        if 4 <= n < 12:
+            for lon0, lat0 in [(100 + 2.5 * n, 51.25), (200 + 2.5 * n, -46.25)]:
+                distance = (lon2 - lon0) ** 2 + (lat2 - lat0) ** 2
+                psl[n] -= 2000. * np.exp(-distance / 50.)
+    data.createVariable('psl', 'f4', ('time', 'lat', 'lon'))[:] = psl
+    data.close()
+    return filename
+
+def test_detect_centres():
+    """Check local maxima across the periodic longitude boundary."""
+    from track_wrapper import detect_centres
+    lon = np.arange(0, 360, 10.)
+    lat = np.arange(-85, 90, 10.)
+    field = np.zeros((2, len(lat), len(lon)))
+    field[0, 10, 0] = 3.
+    field[0, 10, 35] = 2.
+    field[1, 3, 5] = 0.5
+    step, clon, clat, value = detect_centres(field, lon, lat, threshold=1.)
+    assert list(step) == [0] and list(clon) == [0.] and list(value) == [3.]
+
+def test_link_centres():
+    """Check nearest-neighbour linking of centres."""
+    from track_wrapper import link_centres
+    step = np.array([0, 0, 1, 1, 2])
+    lon = np.array([10., 100., 101., 12., 14.])
+    lat = np.array([50., 50., 50., 50., 50.])
+    tracks = link_centres(step, lon, lat, max_distance=5.)
+    assert [list(track) for track in tracks] == [[0, 3, 4], [1, 2]]
+
+def test_preview(psl_file):
+    """Find the synthetic lows in the hemisphere and year looked at."""
+    from track_wrapper import preview
+    summary = preview(psl_file, kind='mslp', NH=True)
+    assert sorted(summary) == [1979, 1980]
+    tracks = summary[1979]['tracks']
+    assert summary[1979]['ntracks'] == 1
+    assert tracks.num_pts[0] == 8
+    assert np.allclose(tracks.lat, 51.25)
+    assert tracks.intensity_field() == 'intensity'
+    assert summary[1980]['ntracks'] == 0
+    assert summary[1979]['density'].sum() * summary[1979]['steps'] == 8
+
+    south = preview(psl_file, kind='mslp', NH=False, years=[1979])
+    assert south[1979]['ntracks'] == 1
+    assert np.allclose(south[1979]['tracks'].lat, -46.25)
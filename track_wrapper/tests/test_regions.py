@@ -0,0 +1,144 @@
+import numpy as np
+from netCDF4 import Dataset
+from pytest import fixture
+
+def write_grid(filename, lon, lat, mask=None):
+    """Write a grid, and optionally a mask on it, to a netCDF file"""
+    data = Dataset(filename, 'w')
+    data.createDimension('lat', len(lat))
+    data.createDimension('lon', len(lon))
+    data.createVariable('lon', 'f8', ('lon',))[:] = lon
+    data.createVariable('lat', 'f8', ('lat',))[:] = lat
+    if mask is not None:
+        data.createVariable('mask', 'i4', ('lat', 'lon'))[:] = mask
+    data.close()
+
+@fixture
+def grid():
+    """T42-like grid with latitudes from north to south"""
+    return np.arange(0, 360, 2.8125), np.linspace(87.86, -87.86, 64)
+
+def test_region_bounds(grid, tmp_path):
+    """Check bounding boxes of boxes and masks across the 0 meridian."""
+    from track_wrapper import region_bounds
+    from track_wrapper.regions import _crosses_meridian
+    assert region_bounds((-80, 20, 20, 80)) == (280., 380., 20., 80.)
+    assert region_bounds((0, 360, -90, -30)) == (0., 360., -90., -30.)
+    assert _crosses_meridian((-80, 20, 20, 80))
+    assert not _crosses_meridian((100, 200, 20, 80))
+    assert not _crosses_meridian((0, 360, 20, 80))
+    # boxes across the dateline, on grids from 0 and from -180
+    assert region_bounds((150, -150, 20, 80)) == (150., 210., 20., 80.)
+    assert not _crosses_meridian((150, -150, 20, 80))
+    assert _crosses_meridian((150, -150, 20, 80), -180.)
+    assert not _crosses_meridian((-80, 20, 20, 80), -180.)
+
+    lon, lat = grid
+    lon2, lat2 = np.meshgrid(lon, lat)
+    mask = ((lon2 >= 300) | (lon2 <= 10)) & (lat2 > 30) & (lat2 < 60)
+    write_grid(str(tmp_path / "mask.nc"), lon, lat, mask)
+    bounds = region_bounds(str(tmp_path / "mask.nc"))
+    assert np.allclose(bounds[:2], [lon[lon >= 300][0],
+                                    360 + lon[lon <= 10][-1]])
+    assert 30 < bounds[2] < bounds[3] < 60
+
+def test_in_region(grid, tmp_path):
+    """Check points inside boxes and masks."""
+    from track_wrapper import in_region
+    lon = np.array([-70, 10, 30, 300, 0])
+    lat = np.array([50, 50, 50, 10, 85])
+    assert list(in_region(lon, lat, (-80, 20, 20, 80))) == \
+            [True, True, False, False, False]
+
+    glon, glat = grid
+    mask = np.zeros((len(glat), len(glon)))
+    mask[(glat > 40) & (glat < 60), :] = 1
+    write_grid(str(tmp_path / "mask.nc"), glon, glat, mask)
+    assert list(in_region(lon, lat, str(tmp_path / "mask.nc"))) == \
+            [True, True, True, False, False]
+
+def test_write_initial(tmp_path):
+    """Check the grid point ranges of regional initialisation files, which
+    are on the grid of the filtered data whatever the grid of the input."""
+    from track_wrapper import write_initial
+    from track_wrapper.regions import _analysis_grid
+    (tmp_path / "data").mkdir()
+    for name in ["initial.T42_NH", "initial.T63_NH"]:
+        with open('track_wrapper/data/' + name, 'r') as file:
+            (tmp_path / "data" / name).write_text(file.read())
+    # N80 input grid, from north to south
+    write_grid(str(tmp_path / "grid.nc"), np.arange(0, 360, 1.125),
+               np.linspace(89.14, -89.14, 160))
+
+    name = write_initial("initial.T63_NH", str(tmp_path / "grid.nc"),
+                         (90, 180, 20, 80), str(tmp_path))
+    lines = (tmp_path / "data" / name).read_text().split('\n')
+    x0, x1, y0, y1 = [int(line) for line in lines[12:16]]
+    lon, lat = _analysis_grid('63')
+    assert x1 <= 193 and y1 <= 96
+    assert lon[x0 - 1] < 90 <= lon[x0] and lon[x1 - 2] <= 180 < lon[x1 - 1]
+    assert lat[y0 - 1] < 20 <= lat[y0] and lat[y1 - 2] <= 80 < lat[y1 - 1]
+    assert lines[10] == "90." and len(lines) >= 19
+
+    name = write_initial("initial.T42_NH", str(tmp_path / "grid.nc"),
+                         (0, 360, 0, 90), str(tmp_path))
+    lines = (tmp_path / "data" / name).read_text().split('\n')
+    assert lines[12:16] == ["1", "129", "32", "64"]
+
+def test_subset_tracks(tmp_path):
+    """Keep only tracks passing through the region."""
+    from track_wrapper import TrackCollection, read_tracks, subset_tracks
+    tracks = TrackCollection([1, 2, 3], [0, 2, 4], [2, 2, 2],
+                             np.arange(6.), [350, 5, 100, 110, 40, 15],
+                             [50, 55, 50, 55, 10, 30],
+                             {'vor': np.ones(6)}, time_units="hours")
+    tracks.to_netcdf(str(tmp_path / "tr_trs_pos.nc"))
+    subset_tracks(str(tmp_path / "tr_trs_pos.nc"), (-80, 20, 20, 80))
+    subset = read_tracks(str(tmp_path / "tr_trs_pos.nc"))
+    assert list(subset.track_id) == [1, 3]
+    assert list(subset.lon) == [350, 5, 40, 15]
+
+def test_write_initial_checks(tmp_path):
+    """Check regions across the dateline and outside the hemisphere."""
+    import pytest
+    from track_wrapper import write_initial
+    (tmp_path / "data").mkdir()
+    with open('track_wrapper/data/initial.T42_NH', 'r') as file:
+        (tmp_path / "data" / "initial.T42_NH").write_text(file.read())
+    lat = np.linspace(87.86, -87.86, 64)
+    write_grid(str(tmp_path / "grid.nc"), np.arange(0, 360, 2.8125), lat)
+    write_grid(str(tmp_path / "grid180.nc"), np.arange(-180, 180, 2.8125),
+               lat)
+
+    name = write_initial("initial.T42_NH", str(tmp_path / "grid.nc"),
+                         (150, -150, 20, 80), str(tmp_path))
+    lines = (tmp_path / "data" / name).read_text().split('\n')
+    x0, x1 = int(lines[12]), int(lines[13])
+    assert x1 - x0 < 30
+    # the input has to be reordered first, see _shift_longitudes
+    with pytest.raises(Exception, match="wrap around"):
+        write_initial("initial.T42_NH", str(tmp_path / "grid180.nc"),
+                      (150, -150, 20, 80), str(tmp_path))
+    with pytest.raises(Exception, match="does not overlap"):
+        write_initial("initial.T42_NH", str(tmp_path / "grid.nc"),
+                      (0, 90, -60, -20), str(tmp_path))
+
+def test_shift_longitudes(tmp_path, monkeypatch):
+    """Check that longitudes are only reordered for split regions."""
+    import shutil
+    from track_wrapper import track_wrapper as tw
+    calls = []
+    class FakeCdo(object):
+        def sellonlatbox(self, box, input, output):
+            calls.append(box)
+            shutil.copy(input, output)
+    monkeypatch.setattr(tw, "cdo", FakeCdo())
+    lat = np.linspace(87.86, -87.86, 64)
+    write_grid(str(tmp_path / "grid.nc"), np.arange(0, 360, 2.8125), lat)
+    write_grid(str(tmp_path / "grid180.nc"), np.arange(-180, 180, 2.8125),
+               lat)
+
+    tw._shift_longitudes(str(tmp_path / "grid.nc"), (150, -150, 20, 80))
+    tw._shift_longitudes(str(tmp_path / "grid.nc"), (-80, 20, 20, 80))
+    tw._shift_longitudes(str(tmp_path / "grid180.nc"), (150, -150, 20, 80))
+    assert calls == ["-180,180,-90,90", "0,360,-90,90"]
@@ -0,0 +1,89 @@
+import numpy as np
+from netCDF4 import Dataset
+from pytest import fixture
+
+@fixture
+def gridded(tmp_path):
+    """Gridded field with one storm-like peak per frame"""
+    filename = str(tmp_path / "field.nc")
+    data = Dataset(filename, 'w')
+    data.createDimension('time', None)
+    data.createDimension('lat', 91)
+    data.createDimension('lon', 180)
+    time = data.createVariable('time', 'f8', ('time',))
+    time.units = "hours since 2010-01-01 00:00"
+    time.calendar = "standard"
+    time[:] = [0, 6, 12]
+    data.createVariable('lat', 'f8', ('lat',))[:] = np.linspace(90, -90, 91)
+    data.createVariable('lon', 'f8', ('lon',))[:] = np.arange(0, 360, 2)
+    field = np.zeros((3, 91, 180))
+    for t, (lon, lat) in enumerate([(10, 50), (20, 50), (30, 50)]):
+        field[t, (90 - lat) // 2, lon // 2] = 10. + t
+    data.createVariable('vor', 'f4', ('time', 'lat', 'lon'))[:] = field
+    data.close()
+    return filename
+
+@fixture
+def tracks():
+    """One storm following the peak and one far away from it"""
+    from track_wrapper import TrackCollection
+    return TrackCollection([1, 2], [0, 3], [3, 2],
+                           [0, 6, 12, 6, 12], [10, 20, 30, 200, 210],
+                           [50, 50, 50, -40, -40], {'vor': np.zeros(5)},
+                           time_units="hours since 2010-01-01 00:00")
+
+def test_sample_along_tracks(tracks, gridded):
+    """Check centre and radius sampling for all storms in a frame."""
+    from track_wrapper import sample_along_tracks
+    samples = sample_along_tracks(tracks, gridded,
+                                  {'centre': ('vor', None, None),
+                                   'max_vor': ('vor', 5, 'max'),
+                                   'mean_vor': ('vor', 5, 'mean')}, batch=1)
+    assert np.allclose(samples['centre'], [10, 11, 12, 0, 0])
+    assert np.allclose(samples['max_vor'], [10, 11, 12, 0, 0])
+    assert np.all(samples['mean_vor'][:3] < samples['max_vor'][:3])
+
+def test_sample_filtered_tracks(tracks, gridded):
+    """Check that samples follow the track selection."""
+    from track_wrapper import sample_along_tracks
+    samples = sample_along_tracks(tracks.filter_lifetime(12), gridded,
+                                  {'centre': ('vor', None, None)})
+    assert np.allclose(samples['centre'], [10, 11, 12])
+
+def test_composite(tracks, gridded):
+    """Check that the composite is centred on the storms."""
+    from track_wrapper import composite
+    mean, count, distance, azimuth = composite(tracks.filter_lifetime(12),
+                                               gridded, 'vor', radius=5,
+                                               rotate=True)
+    assert mean.shape == (20, 36)
+    assert np.allclose(mean[0], 11)
+    assert np.allclose(mean[-1], 0)
+    assert np.all(count == 3)
+
+def test_sample_window():
+    """Check windowed sampling against distances to the whole grid."""
+    from track_wrapper.sampling import _sample_frame, KM_PER_DEGREE
+    from track_wrapper.tracks import great_circle
+    lat = np.linspace(-89, 89, 90)
+    lon = np.arange(0, 360, 3.)
+    field = np.random.default_rng(1).random((len(lat), len(lon)))
+    lon_pts = np.array([1., 359., 180., 45., 300.])
+    lat_pts = np.array([0., 60., 87., -85., -30.])
+    points = np.arange(len(lon_pts))
+    samplers = {'centre': ('f', None, None), 'max': ('f', 8, 'max'),
+                'mean': ('f', 20, 'mean')}
+    samples = {name: np.full(len(points), np.nan) for name in samplers}
+    _sample_frame(samples, samplers, list(samplers), lon, lat, field,
+                  lon_pts, lat_pts, points)
+
+    distance = great_circle(lon_pts[:, None, None], lat_pts[:, None, None],
+                            lon[None, None, :], lat[None, :, None])
+    distance = (distance / KM_PER_DEGREE).reshape(len(points), -1)
+    values = field.ravel()[None, :]
+    assert np.allclose(samples['centre'],
+                       field.ravel()[distance.argmin(axis=1)])
+    assert np.allclose(samples['max'], np.nanmax(
+        np.where(distance <= 8, values, np.nan), axis=1))
+    assert np.allclose(samples['mean'], np.nanmean(
+        np.where(distance <= 20, values, np.nan), axis=1))
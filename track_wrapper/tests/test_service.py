@@ -0,0 +1,104 @@
+import os
+import threading
+from http.server import ThreadingHTTPServer
+import pytest
+from urllib.error import HTTPError
+from pytest import fixture
+
+FAKE_TRACKING = '''
+import os
+
+def fake_track(input, outdirectory, NH=True, years=None, netcdf=True):
+    """Stand-in for a tracking function, records where it was run."""
+    print("Tracking " + str(years[0]) + "...")
+    os.makedirs(outdirectory, exist_ok=True)
+    os.system("echo TRACK output")
+    name = str(years[0]) + "_" + os.path.basename(input)
+    with open(os.path.join(outdirectory, name), "w") as file:
+        file.write(os.environ["TRACK_DIR"])
+    with open(os.path.join(os.environ["TRACK_DIR"], "indat", "temp"), "w"):
+        pass
+
+def failing_track(input, outdirectory, NH=True, years=None):
+    raise Exception("TRACK failed")
+'''
+
+@fixture
+def service(tmp_path, monkeypatch):
+    """Tracking service with two workspaces on a fake TRACK installation"""
+    from track_wrapper import TrackingService
+    trackdir = tmp_path / "TRACK-1.5.2"
+    for folder in ["bin", "indat", "outdat"]:
+        (trackdir / folder).mkdir(parents=True)
+    (trackdir / "indat" / "RUNDATIN.MSLP.in").write_text("test")
+    (tmp_path / "fake_service_tracking.py").write_text(FAKE_TRACKING)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    service = TrackingService(str(tmp_path / "service"), workers=2,
+                              trackdir=str(trackdir),
+                              kinds={'fake': 'fake_service_tracking:fake_track',
+                                     'failing':
+                                        'fake_service_tracking:failing_track'})
+    service.start()
+    yield service
+    service.stop()
+
+def test_service_jobs(service, tmp_path):
+    """Run jobs concurrently in warm workspaces and stream their output."""
+    outdir = tmp_path / "out"
+    ids = [service.submit({'kind': 'fake',
+                           'files': ['a.nc'], 'outdir': str(outdir),
+                           'year': year}) for year in [2010, 2011, 2012]]
+    events = [list(service.events(id)) for id in ids]
+
+    for id, job_events in zip(ids, events):
+        assert job_events[-1]['event'] == 'done'
+        lines = [event['line'] for event in job_events[:-1]]
+        assert "TRACK output" in lines
+    assert "Tracking 2011..." in [event.get('line') for event in events[1]]
+
+    # jobs run in one of the warm workspaces, which are reset after each job
+    workspaces = set(open(outdir / ("%d_a.nc" % year)).read()
+                        for year in [2010, 2011, 2012])
+    assert workspaces <= set([service.directory + "/workspace_0",
+                              service.directory + "/workspace_1"])
+    for workspace in workspaces:
+        assert os.listdir(os.path.join(workspace, "indat")) == \
+                ["RUNDATIN.MSLP.in"]
+
+def test_service_http(service, tmp_path):
+    """Submit jobs through the HTTP API."""
+    from track_wrapper import ServiceClient
+    from track_wrapper.service import _Handler
+    handler = type('Handler', (_Handler,), {'service': service,
+                                            'token': 'secret'})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = "http://127.0.0.1:%d" % server.server_address[1]
+        with pytest.raises(HTTPError, match="401"):
+            ServiceClient(url, token='wrong').status()
+        client = ServiceClient(url, token='secret')
+        with pytest.raises(HTTPError, match="400"):
+            client.submit('os:system', ['a.nc'], str(tmp_path / "out"))
+        id = client.submit('failing', ['a.nc'], str(tmp_path / "out"),
+                           year=2010)
+        job = client.wait(id, verbose=False)
+        assert job['status'] == 'failed'
+        assert job['error'] == "TRACK failed"
+        assert client.status(id)['status'] == 'failed'
+        assert len(client.status()) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_service_job_without_year(service, tmp_path):
+    """Jobs of built-in kinds without a year finish instead of hanging."""
+    id = service.submit({'kind': 'mslp', 'files': [str(tmp_path / "a.nc")],
+                         'outdir': str(tmp_path / "out")})
+    job = list(service.events(id))[-1]
+    assert job['event'] == 'failed'
+    with pytest.raises(Exception, match="Invalid kind"):
+        service.submit({'kind': 'os:system', 'files': ['a.nc'],
+                        'outdir': str(tmp_path)})
@@ -0,0 +1,65 @@
+import csv
+from pytest import fixture, raises
+
+@fixture
+def trackdir(tmp_path, monkeypatch):
+    """Fake TRACK directory with installed RUNDATIN files"""
+    (tmp_path / "indat").mkdir()
+    for var in ['MSLP', 'VOR']:
+        with open('track_wrapper/indat/template.' + var + '.in', 'r') as file:
+            contents = file.read()
+        (tmp_path / "indat" / ("RUNDATIN." + var + ".in")).write_text(contents)
+    monkeypatch.setenv("TRACK_DIR", str(tmp_path))
+    return tmp_path
+
+def test_rundatin(trackdir):
+    """Check that lines of a RUNDATIN file are replaced."""
+    from track_wrapper import rundatin
+    default = rundatin('MSLP').split('\n')
+    lines = rundatin('MSLP', {43: '5.0', 8: '0.02'}).split('\n')
+    assert len(lines) == len(default)
+    assert lines[42] == '5.0' and lines[7] == '0.02'
+    assert lines[:7] == default[:7]
+    with raises(Exception):
+        rundatin('MSLP', {1000: 'n'})
+
+def test_configurations(trackdir):
+    """Check the kinds of configurations of a sweep."""
+    from track_wrapper.sweep import _configurations
+    configs = _configurations({'default': 'MSLP',
+                               'radius': {43: '5.0'},
+                               'vor': {'template': 'VOR', 43: '5.0'}},
+                              'mslp')
+    assert configs['default'] == (trackdir / "indat" /
+                                  "RUNDATIN.MSLP.in").read_text()
+    assert configs['radius'].split('\n')[42] == '5.0'
+    assert configs['vor'].split('\n')[42] == '5.0'
+
+def test_write_summary(tmp_path):
+    """Check the summary table of a sweep."""
+    from track_wrapper.sweep import _write_summary
+    results = [{'config': 'a', 'year': '1980', 'status': 'done',
+                'seconds': 1., 'ff_trs_neg': 10, 'tr_trs_neg': 50},
+               {'config': 'b', 'year': '1980', 'status': 'failed',
+                'seconds': 2., 'error': 'TRACK failed'}]
+    _write_summary(results, tmp_path / "summary.csv")
+    with open(tmp_path / "summary.csv", newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert [row['config'] for row in rows] == ['a', 'b']
+    assert rows[0]['ff_trs_neg'] == '10' and rows[1]['ff_trs_neg'] == ''
+    assert rows[1]['error'] == 'TRACK failed'
+
+def test_failed_run(trackdir, tmp_path):
+    """A failed TRACK run is reported as failed, even without netCDF."""
+    from track_wrapper.sweep import _run_config
+    run = {'year': '1980', 'name': '1980_NH_test', 'input': 'T42filt_1980.dat',
+           'initial': 'initial.T42_NH', 'nchunks': 1}
+    # master succeeds without writing any tracks
+    (trackdir / "master").write_text("#!/bin/sh\nexit 0\n")
+    (trackdir / "master").chmod(0o755)
+    (tmp_path / "scratch").mkdir()
+    result = _run_config((run, 'default', 'test', 'mslp', str(trackdir),
+                          str(tmp_path / "out"), str(tmp_path / "scratch"),
+                          False, None))
+    assert result['status'] == 'failed'
+    assert "Running TRACK failed" in result['error']
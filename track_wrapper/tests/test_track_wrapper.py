@@ -38,3 +38,119 @@ def test_track_mslp(track_wrapper):
     assert os.path.isdir(str(Path.home()) + "/2010_psl_test")
     os.system("rm -R " + str(Path.home()) + "/2010_psl_test")
 
+
+def test_reduction_operators(track_wrapper):
+    """Test the CDO operator chain used for early data reduction."""
+    operators = track_wrapper.track_wrapper._reduction_operators(
+                    levels=[85000], timestep=6, variables=['ua', 'va'])
+    assert operators == "-selhour,0,6,12,18 -sellevel,85000 -selname,ua,va"
+    assert track_wrapper.track_wrapper._reduction_operators() == ""
+
+def test_reduction_offset_hours(track_wrapper, tmp_path, monkeypatch):
+    """Time steps are selected from the hour of the first frame."""
+    import pytest
+    import numpy as np
+    from datetime import datetime
+    from netCDF4 import Dataset
+    from track_wrapper import track_wrapper as tw
+    operators = tw._reduction_operators(timestep=6,
+                                        start=datetime(1979, 1, 1, 3))
+    assert operators == "-selhour,3,9,15,21"
+
+    def write(filename, times):
+        data = Dataset(filename, 'w')
+        data.createDimension('time', None)
+        time = data.createVariable('time', 'f8', ('time',))
+        time.units = "hours since 1979-01-01 00:00:00"
+        time[:] = times
+        data.close()
+    class EmptyCdo(object):
+        def copy(self, input, output):
+            calls.append(input)
+            write(output, [])
+    calls = []
+    monkeypatch.setattr(tw, "cdo", EmptyCdo())
+    filename = str(tmp_path / "in.nc")
+    write(filename, np.arange(3, 48, 3))
+    with pytest.raises(tw.StageError, match="no time steps"):
+        tw.reduce_data(filename, str(tmp_path / "out.nc"), timestep=6)
+    assert calls[0].startswith("-selhour,3,9,15,21 ")
+
+def test_run_stage(track_wrapper, tmp_path):
+    """Check exit codes and outputs of pipeline stages."""
+    import pytest
+    import numpy as np
+    from netCDF4 import Dataset
+    from track_wrapper.track_wrapper import _run_stage, _frames_per_year
+    output = str(tmp_path / "out.txt")
+    _run_stage("Writing", "echo test > " + output, [output])
+
+    # stale outputs are removed before the stage is run
+    with pytest.raises(track_wrapper.StageError, match="was not written"):
+        _run_stage("Writing", "true", [output])
+    with pytest.raises(track_wrapper.StageError, match="exit code 3"):
+        _run_stage("Writing", "exit 3", [output])
+    with pytest.raises(track_wrapper.StageError, match="is empty"):
+        _run_stage("Writing", "touch " + output, [output])
+
+    filename = str(tmp_path / "year.nc")
+    data = Dataset(filename, 'w')
+    data.createDimension('time', None)
+    time = data.createVariable('time', 'f8', ('time',))
+    time.units = "hours since 1979-12-31 00:00:00"
+    time[:] = np.arange(0, 48, 6)
+    data.close()
+    assert _frames_per_year(filename) == {'1979': 4, '1980': 4}
+    copy = str(tmp_path / "copy.nc")
+    _run_stage("Selecting", "cp " + filename + " " + copy, [copy], 8)
+    with pytest.raises(track_wrapper.StageError, match="instead of 4"):
+        _run_stage("Selecting", "cp " + filename + " " + copy, [copy], 4)
+
+def test_cleanup_after_failure(track_wrapper, tmp_path, monkeypatch):
+    """A failed run returns to the working directory and removes its files."""
+    import shutil
+    import pytest
+    import numpy as np
+    from netCDF4 import Dataset
+    from track_wrapper import track_wrapper as tw
+    trackdir = tmp_path / "TRACK-1.5.2"
+    (trackdir / "indat").mkdir(parents=True)
+    monkeypatch.setenv("TRACK_DIR", str(trackdir))
+    monkeypatch.setattr(tw, "reduce_data", lambda input, outfile, **kwargs:
+                        shutil.copy(input, outfile))
+    class FailingCdo(object):
+        def showyear(self, **kwargs):
+            raise tw.StageError("Selecting years failed.")
+    monkeypatch.setattr(tw, "cdo", FailingCdo())
+
+    filename = str(tmp_path / "msl.nc")
+    data = Dataset(filename, 'w')
+    data.createDimension('time', None)
+    data.createDimension('lat', 2)
+    data.createDimension('lon', 3)
+    data.createVariable('time', 'f8', ('time',))[:] = np.arange(4)
+    data.createVariable('lat', 'f8', ('lat',))[:] = [-45., 45.]
+    data.createVariable('lon', 'f8', ('lon',))[:] = [0., 120., 240.]
+    data.createVariable('msl', 'f4', ('time', 'lat', 'lon'))[:] = 1.
+    data.close()
+
+    cwd = os.getcwd()
+    with pytest.raises(tw.StageError):
+        track_wrapper.track_era5_mslp(filename, str(tmp_path / "out"))
+    assert os.getcwd() == cwd
+    assert os.listdir(trackdir / "indat") == []
+
+def test_tr2nc_failure(track_wrapper, tmp_path, monkeypatch):
+    """A failed conversion returns to the working directory."""
+    import pytest
+    from track_wrapper import track_wrapper as tw
+    trackdir = tmp_path / "TRACK-1.5.2"
+    (trackdir / "utils" / "bin").mkdir(parents=True)
+    monkeypatch.setenv("TRACK_DIR", str(trackdir))
+    monkeypatch.setattr(tw, "_tr2nc", lambda: "false")
+
+    cwd = os.getcwd()
+    for tr2nc in [tw.tr2nc_mslp, tw.tr2nc_vor]:
+        with pytest.raises(tw.StageError):
+            tr2nc(str(tmp_path / "tr_trs_pos"))
+        assert os.getcwd() == cwd
@@ -0,0 +1,81 @@
+import numpy as np
+from pytest import fixture
+
+@fixture(scope='module')
+def tracks():
+    """Read the example TR2NC file"""
+    from track_wrapper import read_tracks
+    return read_tracks('data/ff_trs_neg_psl_ACCESS_2010_NH.nc')
+
+def test_read_tracks(tracks):
+    """Check that tracks and intensity field are read."""
+    assert len(tracks) == 981
+    assert tracks.intensity_field() == 'pressure_sea_level'
+    assert tracks.num_pts.sum() == len(tracks.time)
+
+def test_reductions_match_loops(tracks):
+    """Compare segment reductions against per-track loops."""
+    from track_wrapper.tracks import great_circle
+    lifetime = [t['time'][-1] - t['time'][0] for t in tracks]
+    intensity = [t['pressure_sea_level'].max() for t in tracks]
+    path = [great_circle(t['lon'][:-1], t['lat'][:-1],
+                         t['lon'][1:], t['lat'][1:]).sum() for t in tracks]
+    assert np.allclose(tracks.lifetime(), lifetime)
+    assert np.allclose(tracks.max_intensity(), intensity)
+    assert np.allclose(tracks.path_length(), path)
+
+def test_filters_are_views(tracks):
+    """Check that chained filters share the point arrays."""
+    filtered = tracks.filter_lifetime(48).filter_displacement(1000) \
+                        .filter_genesis_lat(30, 90)
+    assert 0 < len(filtered) < len(tracks)
+    assert filtered.lat is tracks.lat
+    assert np.all(filtered.lifetime() >= 48)
+    assert np.all(filtered.displacement() >= 1000)
+    assert np.all(filtered.genesis_lat() >= 30)
+    assert len(filtered.points('lat')) == filtered.num_pts[
+                                            filtered.selection].sum()
+
+def test_empty_tracks():
+    """Check reductions with tracks without points."""
+    from track_wrapper import TrackCollection
+    collection = TrackCollection([1, 2, 3], [0, 2, 2], [2, 0, 3],
+                                 [0, 6, 0, 6, 12], [0, 1, 10, 10, 10],
+                                 [50, 50, 40, 41, 42],
+                                 {'vor': [1, 3, 2, 5, 4]})
+    assert np.allclose(collection.max_intensity(), [3, np.nan, 5],
+                       equal_nan=True)
+    assert np.allclose(collection.max_deepening_rate(), [8, np.nan, 12],
+                       equal_nan=True)
+    assert np.allclose(collection.lifetime()[[0, 2]], [6, 12])
+
+def test_chunks_and_output(tracks, tmp_path):
+    """Check chunked reading and writing of filtered tracks."""
+    from track_wrapper import iter_tracks, read_tracks
+    chunks = list(iter_tracks('data/ff_trs_neg_psl_ACCESS_2010_NH.nc',
+                              chunk_tracks=100))
+    assert len(chunks) == 10
+    assert np.allclose(np.concatenate([c.max_intensity() for c in chunks]),
+                       tracks.max_intensity())
+
+    filtered = tracks.filter_lifetime(48)
+    filtered.to_netcdf(str(tmp_path / "filtered.nc"))
+    reread = read_tracks(str(tmp_path / "filtered.nc"))
+    assert len(reread) == len(filtered)
+    assert np.allclose(reread.lifetime(), filtered.lifetime())
+
+def test_days_round_trip(tmp_path):
+    """Times in days are read in hours, and written back in hours."""
+    from track_wrapper import TrackCollection, read_tracks
+    tracks = TrackCollection([1], [0], [3], [0.25, 0.5, 0.75], [10, 11, 12],
+                             [50, 50, 50], {'vor': np.ones(3)},
+                             time_units="days since 1979-01-01 00:00:00")
+    tracks.to_netcdf(str(tmp_path / "days.nc"))
+    hours = read_tracks(str(tmp_path / "days.nc"))
+    assert list(hours.time) == [6., 12., 18.]
+    assert hours.time_units == "hours since 1979-01-01 00:00:00"
+
+    hours.to_netcdf(str(tmp_path / "hours.nc"))
+    again = read_tracks(str(tmp_path / "hours.nc"))
+    assert list(again.time) == [6., 12., 18.]
+    assert again.time_units == hours.time_units
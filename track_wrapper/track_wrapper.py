@@ -1,14 +1,128 @@
 import os
-from cdo import *
-from netCDF4 import Dataset
+import glob
+import subprocess
+from netCDF4 import Dataset, num2date
 from pathlib import Path
 from math import ceil
 
-cdo = Cdo()
+from .environment import LazyCdo, probe_environment
+from .regions import write_initial, subset_tracks, _crosses_meridian, \
+                     _first_longitude
+
+# the Cdo object is only created on first use, see LazyCdo
+cdo = LazyCdo()
 
 __all__ = ['cmip6_indat', 'regrid_cmip6', 'setup_files', 'calc_vorticity',
            'track_mslp', 'track_uv_vor850', 'setup_tr2nc', 'track_era5_mslp',
-           'track_era5_vor850', 'tr2nc_mslp', 'tr2nc_vor']
+           'track_era5_vor850', 'tr2nc_mslp', 'tr2nc_vor', 'reduce_data',
+           'StageError']
+
+def _track_dir():
+    # returns the TRACK installation directory: the TRACK_DIR environment
+    # variable if set, e.g. for an isolated workspace, or the probed location
+    if "TRACK_DIR" in os.environ:
+        return os.environ["TRACK_DIR"]
+    trackdir = probe_environment()['track']
+    if trackdir is None:
+        return str(Path.home()) + "/TRACK-1.5.2"
+    return trackdir
+
+def _tr2nc():
+    # returns the path of the TR2NC executable
+    tr2nc = probe_environment()['tr2nc']
+    if tr2nc is None:
+        raise Exception("TR2NC was not found. Please run the " +
+                            "track_wrapper.setup_tr2nc function first.")
+    return tr2nc
+
+def _track_environment():
+    # sets the environment variables needed to run TRACK; the current
+    # directory is only added to PATH once
+    os.environ["CC"] = "gcc"
+    os.environ["FC"] = "gfortran"
+    os.environ["ARFLAGS"] = ""
+    if "." not in os.environ["PATH"].split(":"):
+        os.environ["PATH"] += ":."
+    return
+
+class StageError(Exception):
+    """Error raised when a stage of the tracking pipeline fails."""
+    pass
+
+def _check_outputs(stage, outputs, frames=None):
+    # checks that the outputs of a stage exist and are not empty, and that
+    # netCDF outputs have the expected number of time steps
+    for output in outputs:
+        if os.path.isfile(output) == False:
+            raise StageError(stage + " failed: " + output + " was not written.")
+        if os.path.getsize(output) == 0:
+            raise StageError(stage + " failed: " + output + " is empty.")
+        if (frames is not None) and (output[-3:] == ".nc"):
+            data = Dataset(output, 'r')
+            ntime = len(data.dimensions['time'])
+            data.close()
+            if ntime != frames:
+                raise StageError(stage + " failed: " + output + " has " +
+                                    str(ntime) + " time steps instead of " +
+                                    str(frames) + ".")
+    return
+
+def _run_stage(stage, command, outputs=[], frames=None):
+    # runs the shell command of a stage, after removing its old outputs so
+    # that stale files are never used, and checks its exit code and outputs
+    for output in outputs:
+        if os.path.lexists(output):
+            os.remove(output)
+    status = subprocess.run(command, shell=True).returncode
+    if status != 0:
+        raise StageError(stage + " failed with exit code " + str(status) +
+                            ": " + command)
+    _check_outputs(stage, outputs, frames)
+    return
+
+def _remove_temporary(patterns):
+    # removes temporary files matching the patterns in the TRACK directory
+    for pattern in patterns:
+        for filename in glob.glob(os.path.join(_track_dir(), pattern)):
+            os.remove(filename)
+    return
+
+def _frames_per_year(filename):
+    # number of time steps of each year in a netCDF file
+    data = Dataset(filename, 'r')
+    time = data.variables['time']
+    dates = num2date(time[:], time.units, getattr(time, 'calendar',
+                                                  'standard'))
+    data.close()
+    frames = {}
+    for date in dates:
+        frames[str(date.year)] = frames.get(str(date.year), 0) + 1
+    return frames
+
+def _initial(trunc, hemisphere, region, gridfile):
+    # returns the TRACK initialisation file for a truncation and hemisphere,
+    # restricted to the grid points of the tracking region if there is one
+    initial = "initial.T" + trunc + "_" + hemisphere
+    if region is None:
+        return initial
+    return write_initial(initial, gridfile, region, _track_dir())
+
+def _shift_longitudes(filename, region):
+    # reorders the longitudes of a global file to start at -180, or at 0 if
+    # they already start near -180, when the region is split where they wrap
+    # around
+    lon0 = _first_longitude(filename)
+    if _crosses_meridian(region, lon0) == False:
+        return
+    start = "-180" if lon0 % 360 < 180 else "0"
+    shifted = filename[:-3] + "_shifted.nc"
+    cdo.sellonlatbox(start + "," + str(int(start) + 360) + ",-90,90",
+                     input=filename, output=shifted)
+    _check_outputs("Reordering longitudes", [shifted])
+    _run_stage("Reordering longitudes", "mv " + shifted + " " + filename,
+               [filename])
+    print("Reordered longitudes to start at " + start + ".")
+    return
 
 class cmip6_indat(object):
     """Class to obtain basic information about the CMIP6 input data."""
@@ -51,26 +165,30 @@ def setup_files():
     and copy into TRACK directory for use during preprocessing and tracking.
     """
     # check if TRACK is installed
-    if os.path.isdir(str(Path.home()) + "/TRACK-1.5.2") == False:
+    if os.path.isdir(_track_dir()) == False:
         raise Exception("TRACK-1.5.2 is not installed.")
 
     # edit RUNDATIN files
     for var in ['MSLP', 'MSLP_A', 'VOR', 'VOR_A']:
         with open('track_wrapper/indat/template.' + var + '.in', 'r') as file:
             contents = file.read()
-        contents = contents.replace('DIR', str(Path.home()))
+        contents = contents.replace('DIR/TRACK-1.5.2', _track_dir())
         with open('track_wrapper/indat/RUNDATIN.' + var + '.in', "w") as file:
             file.write(contents)
 
     # copy files into local TRACK directory
-    os.system("cp track_wrapper/trackdir/* " + str(Path.home()) +
-                "/TRACK-1.5.2/") # calcvor and specfilt files
-    os.system("cp track_wrapper/indat/RUNDATIN.* " + str(Path.home()) +
-                "/TRACK-1.5.2/indat") # RUNDATIN files
-    os.system("cp track_wrapper/data/* " + str(Path.home()) +
-                "/TRACK-1.5.2/data") # initial and adapt.dat0, zone.dat0
-    os.system("cp track_wrapper/tr2nc_new.tar " + str(Path.home()) +
-                "/TRACK-1.5.2/utils") # for TR2NC setup
+    ## each with a file that has to be there afterwards
+    for files, folder, output in [
+            ("trackdir/*", "", "specfilt.in"), # calcvor and specfilt files
+            ("indat/RUNDATIN.*", "/indat", "RUNDATIN.MSLP.in"), # RUNDATIN files
+            ("data/*", "/data", "initial.T42_NH"), # initial, adapt, zone
+            ("tr2nc_new.tar", "/utils", "tr2nc_new.tar")]: # for TR2NC setup
+        _run_stage("Copying files", "cp track_wrapper/" + files + " " +
+                   _track_dir() + folder + "/",
+                   [_track_dir() + folder + "/" + output])
+
+    # the cached environment does not know about the new files yet
+    probe_environment(refresh=True)
     return
 
 def setup_tr2nc():
@@ -78,25 +196,35 @@ def setup_tr2nc():
     Set up and compile TR2NC for converting TRACK output to NetCDF.
     """
     # check if tr2nc_new.tar file exists
-    if os.path.isfile(str(Path.home()) + "/TRACK-1.5.2/utils/tr2nc_new.tar") == False:
+    if os.path.isfile(_track_dir() + "/utils/tr2nc_new.tar") == False:
         raise Exception("Please run the track_wrapper.setup_files function first.")
 
-    os.system("cp track_wrapper/tr2nc_mslp.meta.elinor " + str(Path.home()) +
-                "/TRACK-1.5.2/utils")
+    _run_stage("Setting up TR2NC", "cp track_wrapper/tr2nc_mslp.meta.elinor " +
+               _track_dir() + "/utils",
+               [_track_dir() + "/utils/tr2nc_mslp.meta.elinor"])
 
     cwd = os.getcwd()
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2/utils")
-    os.system("mv TR2NC OLD_TR2NC")
-    os.system("tar xvf tr2nc_new.tar")
-    os.system("mv tr2nc_mslp.meta.elinor TR2NC/tr2nc_mslp.meta.elinor")
+    os.chdir(_track_dir() + "/utils")
+    try:
+        if os.path.isdir("TR2NC") == True:
+            _run_stage("Setting up TR2NC", "mv TR2NC OLD_TR2NC")
+        _run_stage("Setting up TR2NC", "tar xvf tr2nc_new.tar",
+                   ["TR2NC/Makefile"])
+        _run_stage("Setting up TR2NC", "mv tr2nc_mslp.meta.elinor " +
+                   "TR2NC/tr2nc_mslp.meta.elinor",
+                   ["TR2NC/tr2nc_mslp.meta.elinor"])
 
-    os.environ["CC"] = "gcc"
-    os.environ["FC"] = "gfortran"
+        os.environ["CC"] = "gcc"
+        os.environ["FC"] = "gfortran"
 
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2")
-    os.system("make utils")
+        os.chdir(_track_dir())
+        _run_stage("Compiling TR2NC", "make utils",
+                   [_track_dir() + "/utils/bin/tr2nc"])
+    finally:
+        os.chdir(cwd)
 
-    os.chdir(cwd)
+    # so that TR2NC is found in this process without probing again by hand
+    probe_environment(refresh=True)
     return
 
 #
@@ -138,9 +266,114 @@ def merge_uv(file1, file2, outfile):
                             ua or va file.")
 
     cdo.merge(input=" ".join((u_file, v_file)), output=outfile)
+    _check_outputs("Merging U and V", [outfile])
     print("Merged U and V files into UV file.")
     return
 
+def _vertical_coordinate(data):
+    # returns the pressure level coordinate of a netCDF dataset, if any
+    for name in ['plev', 'lev', 'level']:
+        if name in data.variables:
+            return data.variables[name]
+    return None
+
+def _reduction_operators(levels=None, timestep=None, variables=None,
+                         years=None, start=None):
+    # returns the chain of CDO operators used by reduce_data, applied from
+    # right to left: variables first, then levels, years and timesteps;
+    # timesteps are selected from the hour of the first frame, start, since
+    # not all data is stamped at 00 UTC
+    operators = []
+    if timestep is not None:
+        if (int(timestep) <= 0) or (24 % int(timestep) != 0):
+            raise Exception("Invalid time step. Please input a number of " +
+                                "hours that divides 24.")
+        first = 0 if start is None else start.hour
+        hours = [str(hour) for hour in
+                    sorted([(first + hour) % 24
+                            for hour in range(0, 24, int(timestep))])]
+        operators.append("-selhour," + ",".join(hours))
+    if years is not None:
+        operators.append("-selyear," + ",".join([str(year) for year in years]))
+    if levels is not None:
+        operators.append("-sellevel," +
+                            ",".join(["%g" % level for level in levels]))
+    if variables is not None:
+        operators.append("-selname," + ",".join(variables))
+    return " ".join(operators)
+
+def reduce_data(input, outfile, levels=None, timestep=None, variables=None,
+                years=None):
+    """
+    Reduce input data to the levels, timesteps and variables needed for
+    tracking, so that copying and regridding only handle the data that is
+    actually used. If nothing needs to be removed, the input is copied as is.
+
+    Parameters
+    ----------
+
+    input : string
+        Path to .nc file containing input data
+
+    outfile : string
+        Desired path of reduced file
+
+    levels : list of numbers, optional
+        Pressure levels in Pa to keep. Ignored if the input data has no
+        pressure levels.
+
+    timestep : int, optional
+        Time step in hours to subsample the data to, e.g. 6 to reduce hourly
+        ERA5 data to the 6-hourly frames assumed by the tracking setup. The
+        frames kept are those at the hour of the first frame of the input and
+        every time step after it.
+
+    variables : list of strings, optional
+        Names of the variables to keep. All other variables are dropped.
+
+    years : list of ints, optional
+        Years to keep. All other years are dropped.
+
+    """
+    data = Dataset(input, 'r')
+
+    # only select levels if there are levels that can be removed
+    plev = _vertical_coordinate(data)
+    if (levels is not None) and (plev is not None):
+        if getattr(plev, 'units', 'Pa') in ['hPa', 'mbar', 'millibars']:
+            levels = [level / 100. for level in levels]
+        if set(plev[:].tolist()) <= set(levels):
+            levels = None
+    else:
+        levels = None
+
+    start = None
+    if ('time' in data.variables) and (len(data.variables['time']) > 0):
+        time = data.variables['time']
+        start = num2date(time[0], time.units,
+                         getattr(time, 'calendar', 'standard'))
+    data.close()
+
+    operators = _reduction_operators(levels, timestep, variables, years,
+                                     start)
+    if operators == "":
+        _run_stage("Copying input", "cp '" + input + "' '" + outfile + "'",
+                   [outfile])
+        print("No data reduction needed.")
+    else:
+        cdo.copy(input=operators + " " + input, output=outfile)
+        _check_outputs("Reducing input", [outfile])
+        data = Dataset(outfile, 'r')
+        ntime = len(data.dimensions['time']) \
+                    if 'time' in data.dimensions else None
+        data.close()
+        if ntime == 0:
+            raise StageError("Reducing input failed: no time steps of " +
+                                input + " were selected.")
+        print("Reduced input data to required levels, timesteps and variables.")
+
+    return
+
 def regrid_cmip6(input, outfile):
     """
     Detect grid of input CMIP6 data and regrid to gaussian grid if necessary.
@@ -178,13 +411,15 @@ def regrid_cmip6(input, outfile):
         else:
             cdo.remapcon("n80", input=input, output=outfile)
             grid = 'n80'
+        _check_outputs("Regridding", [outfile])
         print("Regridded to " + grid + " Gaussian grid.")
 
     return
 
-def calc_vorticity(uv_file, outfile, copy_file=True, cmip6=True):
+def calc_vorticity(uv_file, outfile, copy_file=True, cmip6=True, level=85000):
     """
-    Use TRACK to calculate vorticity at 850 hPa from horizontal wind velocities.
+    Use TRACK to calculate vorticity at 850 hPa, or another pressure level,
+    from horizontal wind velocities.
 
     Parameters
     ----------
@@ -203,6 +438,10 @@ def calc_vorticity(uv_file, outfile, copy_file=True, cmip6=True):
     cmip6 : boolean, optional
         Whether or not input file is from CMIP6.
 
+    level : number, optional
+        Pressure level in Pa to calculate vorticity at. It has to be one of
+        the levels of the input file.
+
     """
     cwd = os.getcwd()
 
@@ -230,21 +469,26 @@ def calc_vorticity(uv_file, outfile, copy_file=True, cmip6=True):
 
     if copy_file == True: # copy input data to TRACK/indat directory
         tempname = "temp_file.nc"
-        os.system("cp " + uv_file + " " + str(Path.home()) + 
-                    "/TRACK-1.5.2/indat/" + tempname)
+        _run_stage("Copying input", "cp " + uv_file + " " + _track_dir() +
+                   "/indat/" + tempname, [_track_dir() + "/indat/" + tempname])
     else: # if uv_file is already in the TRACK-1.5.2/indat directory
         tempname = os.path.basename(uv_file)
 
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2") # change to TRACK-1.5.2 directory
-
-    # generate input file and calculate vorticity using TRACK
-    os.system("sed -e \"s/VAR1/"+ u_name + "/;s/VAR2/" + v_name + "/;s/NX/" +
-                nx + "/;s/NY/" + ny + "/;s/LEV/85000/;s/VOR/" + outfile +
-                "/\" calcvor.in > calcvor.test")
-    os.system("bin/track.linux -i " + tempname + " -f y" + year + " < calcvor.test")
-
-    os.system("rm indat/" + tempname) # cleanup
-    os.chdir(cwd) # change back to working directory
+    os.chdir(_track_dir()) # change to TRACK-1.5.2 directory
+
+    try:
+        # generate input file and calculate vorticity using TRACK
+        _run_stage("Calculating vorticity",
+                   "sed -e \"s/VAR1/"+ u_name + "/;s/VAR2/" + v_name +
+                   "/;s/NX/" + nx + "/;s/NY/" + ny + "/;s/LEV/" +
+                   "%g" % level + "/;s/VOR/" + outfile +
+                   "/\" calcvor.in > calcvor.test", ["calcvor.test"])
+        _run_stage("Calculating vorticity", "bin/track.linux -i " + tempname +
+                   " -f y" + year + " < calcvor.test", ["indat/" + outfile])
+    finally:
+        os.chdir(cwd) # change back to working directory
+        if copy_file == True:
+            _remove_temporary(["indat/" + tempname]) # cleanup
 
     return
 
@@ -254,7 +498,9 @@ def calc_vorticity(uv_file, outfile, copy_file=True, cmip6=True):
 # =============
 #
 
-def track_mslp(input, outdirectory, NH=True, netcdf=True):
+def track_mslp(input, outdirectory, NH=True, netcdf=True, timestep=None,
+               drop_vars=False, years=None, continuous=False,
+               filter_only=False, region=None):
     """
     Run TRACK on CMIP6 sea level pressure data.
 
@@ -274,42 +520,290 @@ def track_mslp(input, outdirectory, NH=True, netcdf=True):
     netcdf : boolean, optional
         If true, converts TRACK output to netCDF format using TR2NC utility.
 
+    timestep : int, optional
+        Time step in hours to subsample the input data to before tracking.
+
+    drop_vars : boolean, optional
+        If true, drops all variables other than psl before preprocessing.
+
+    years : list of ints, optional
+        Years to track. By default, all years in the input data are tracked.
+
+    continuous : boolean, optional
+        If true, the input is tracked in one pass instead of one year at a
+        time, so that storms are not cut at the end of each year. The output
+        is labelled with the first year.
+
+    filter_only : boolean, optional
+        If true, stops after spectral filtering and keeps the filtered data
+        in the TRACK indat directory, so that TRACK can be run on it several
+        times, e.g. by sweep. Returns the filtered runs.
+
+    region : tuple or string, optional
+        Region to track in, as a bounding box (lon_min, lon_max, lat_min,
+        lat_max) in degrees or as the path to a netCDF mask file that is
+        non-zero inside the region. TRACK only runs on the grid points of
+        the region, and only tracks with points inside it are kept.
+
     """
     outdir = os.path.abspath(os.path.expanduser(outdirectory))
     input_basename = os.path.basename(input)
 
     # files need to be moved to TRACK directory for TRACK to find them
-    # copy data into TRACK indat directory
+    # reduce data and copy into TRACK indat directory
     tempname = "indat/temp_file.nc"
-    os.system("cp " + input + " " + str(Path.home()) + "/TRACK-1.5.2/" +
-              tempname)
-    # os.system("rm " + filled)
+    if drop_vars == True:
+        variables = ["psl"]
+    else:
+        variables = None
+    reduce_data(input, _track_dir() + "/" + tempname,
+                timestep=timestep, variables=variables, years=years)
     print("Data copied into TRACK/indat directory.")
 
     # change working directory
     cwd = os.getcwd()
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2")
+    os.chdir(_track_dir())
+    try:
+
+        data = cmip6_indat(tempname)
+
+        if "psl" not in data.vars:
+            raise Exception("Invalid input variable type. Please input CMIP6 psl file.")
+
+        extr = tempname[:-3] + "_extr.nc"
+
+        # remove unnecessary variables
+        if "time_bnds" in data.vars:
+            ncks = "time_bnds"
+            if "lat_bnds" in data.vars:
+                ncks += ",lat_bnds,lon_bnds"
+            _run_stage("Removing variables", "ncks -C -O -x -v " + ncks + " " +
+                       tempname + " " + extr, [extr])
+        elif "lat_bnds" in data.vars:
+            _run_stage("Removing variables",
+                       "ncks -C -O -x -v lat_bnds,lon_bnds " + tempname + " " +
+                       extr, [extr])
+        else:
+            extr = tempname
+
+        print("Starting preprocessing.")
+
+        gridtype = data.get_grid_type()
+        # check if regridding is needed, do nothing if already gaussian
+        if gridtype == 'gridtype  = gaussian':
+            print("No regridding needed.")
+            gridcheck = extr
+
+        else:
+        # regrid
+            gridcheck = tempname[:-3] + "_gaussian.nc"
+            regrid_cmip6(extr, gridcheck)
+
+        # fill missing values
+        filled = gridcheck[:-3] + "_filled.nc"
+        _run_stage("Filling missing values",
+                   "ncatted -a _FillValue,,d,, -a missing_value,,d,, " +
+                   gridcheck + " " + filled, [filled])
+        print("Filled missing values, if any.")
+
+        # clean up if it was regridded and if variables were removed
+        if gridtype != 'gridtype  = gaussian':
+            os.system("rm " + tempname[:-3] + "_gaussian.nc")
+        if extr != tempname:
+            os.system("rm " + extr)
+
+        # get data info
+        data = cmip6_indat(filled)
+        nx, ny = data.get_nx_ny()
+        # regions need a contiguous range of longitudes
+        if region is not None:
+            _shift_longitudes(filled, region)
+
+        years = cdo.showyear(input=filled)[0].split()
+        frames = _frames_per_year(filled)
+        if continuous == True:
+            years = years[:1]
+
+        if NH == True:
+            hemisphere = "NH"
+        else:
+            hemisphere = "SH"
+
+        # track files written by TRACK
+        outputs = ["ff_trs_neg", "tr_trs_neg"]
+
+        # do tracking for one year at a time
+        filtered = []
+        for year in years:
+            print(year + "...")
+
+            # select year from data
+            year_file = 'tempyear.nc'
+            if continuous == True:
+                _run_stage("Selecting " + year, "cp " + filled + " indat/" +
+                           year_file, ["indat/" + year_file])
+            else:
+                cdo.selyear(year, input=filled, output="indat/"+year_file)
+
+            # check that the whole year was selected
+            if continuous == True:
+                expected = sum(frames.values())
+            else:
+                expected = frames[year]
+            _check_outputs("Selecting " + year, ["indat/" + year_file],
+                           expected)
+
+            # get number of timesteps and number of chunks for tracking
+            data = cmip6_indat("indat/"+year_file)
+            ntime = data.get_timesteps()
+            nchunks = ceil(ntime/62)
+            c_input = year + "_" + hemisphere + "_" + input_basename[:-3]
+
+            # spectral filtering
+            if int(ny) >= 96: # T63
+                fname = "T63filt_" + year + ".dat"
+                initial = _initial("63", hemisphere, region, filled)
+                line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
+                            "/;s/TRUNC/63/\" specfilt_nc.in > spec.test"
+                line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + \
+                            fname
+                # NH
+                line_5 = "master -c=" + c_input + \
+                            " -e=track.linux -d=now -i=" + fname + \
+                            " -f=y" + year + \
+                            " -j=RUN_AT.in -k=" + initial + \
+                            " -n=1,62," + str(nchunks) + " -o='" + outdir + \
+                            "' -r=RUN_AT_ -s=RUNDATIN.MSLP"
+
+            else: # T42
+                fname = "T42filt_" + year + ".dat"
+                initial = _initial("42", hemisphere, region, filled)
+                line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
+                            "/;s/TRUNC/42/\" specfilt_nc.in > spec.test"
+                line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + \
+                            fname
+                # NH
+                line_5 = "master -c=" + c_input + \
+                            " -e=track.linux -d=now -i=" + fname + \
+                            " -f=y" + year + \
+                            " -j=RUN_AT.in -k=" + initial + \
+                            " -n=1,62," + str(nchunks) + " -o='" + outdir + \
+                            "' -r=RUN_AT_ -s=RUNDATIN.MSLP"
+
+            line_2 = "bin/track.linux -i " + year_file + " -f y" + year + \
+                        " < spec.test"
+            line_4 = "rm -f outdat/specfil.y" + year + "_band000"
+
+            # setting environment variables
+            _track_environment()
+
+            # executing the lines to run TRACK
+            print("Spectral filtering...")
+
+            _run_stage("Spectral filtering", line_1, ["spec.test"])
+            _run_stage("Spectral filtering", line_2,
+                       ["outdat/specfil.y" + year + "_band001"])
+            _run_stage("Spectral filtering", line_3, ["indat/" + fname])
+            _run_stage("Spectral filtering", line_4)
+
+            if filter_only == True:
+                filtered.append({'year': year, 'name': c_input, 'input': fname,
+                                 'initial': initial, 'nchunks': nchunks})
+                os.system("rm indat/"+year_file)
+                continue
+
+            print("Running TRACK...")
+
+            _run_stage("Running TRACK", line_5, [outdir + "/" + c_input + "/" +
+                       trs + ".gz" for trs in outputs])
+
+            # cleanup
+            os.system("rm indat/"+year_file)
+
+            print("Turning track output to netCDF...")
+            if netcdf == True:
+                # tr2nc - turn tracks into netCDF files
+                for trs in outputs:
+                    _run_stage("Unpacking tracks", "gunzip '" + outdir + "/" +
+                               c_input + "/" + trs + ".gz'",
+                               [outdir + "/" + c_input + "/" + trs])
+                tr2nc_mslp(outdir + "/" + c_input + "/ff_trs_neg")
+                tr2nc_mslp(outdir + "/" + c_input + "/tr_trs_neg")
+                if region is not None:
+                    subset_tracks(outdir + "/" + c_input + "/ff_trs_neg.nc",
+                                  region)
+                    subset_tracks(outdir + "/" + c_input + "/tr_trs_neg.nc",
+                                  region)
+    finally:
+        # clean up, also when a stage failed, so that the next run starts
+        # from a clean TRACK directory
+        os.chdir(cwd)
+        _remove_temporary([tempname[:-3] + "*.nc", "indat/tempyear.nc"])
+    if filter_only == True:
+        return filtered
+
+    return
+
+def _prepare_uv(infile, infile2, levels, timestep, drop_vars, years):
+    # copies UV data at the given levels into the TRACK indat directory,
+    # merging separate U and V files, and regrids it to a Gaussian grid and
+    # removes its fill values; leaves the working directory in the TRACK
+    # directory and returns the names of the copied and the filled files
+    trackdir = _track_dir() + "/"
+
+    # copy data into TRACK indat directory
+    ## files need to be moved to TRACK directory for TRACK to find them
+    ## only the levels needed are selected before copying
+    tempname = "indat/temp_file.nc"
+    if infile2 == 'none':
+        input_basename = os.path.basename(infile)
+        if drop_vars == True:
+            variables = ["ua", "va"]
+        else:
+            variables = None
+        reduce_data(infile, trackdir + tempname, levels=levels,
+                    timestep=timestep, variables=variables, years=years)
+
+    else: # if U and V separate, merge into UV file
+        input_basename = os.path.basename(infile)[:-3] + "_merged.nc"
+        reduced = []
+        for n, file in enumerate([infile, infile2]):
+            if drop_vars == True:
+                variables = [cmip6_indat(file).get_variable_type()]
+            else:
+                variables = None
+            reduced.append(trackdir + "indat/temp_file_" + str(n) + ".nc")
+            reduce_data(file, reduced[-1], levels=levels, timestep=timestep,
+                        variables=variables, years=years)
+        merge_uv(reduced[0], reduced[1], trackdir + tempname)
+        os.system("rm " + " ".join(reduced))
+    print("Data copied into TRACK/indat directory.")
+
+    # change working directory
+    os.chdir(_track_dir())
 
     data = cmip6_indat(tempname)
 
-    if "psl" not in data.vars:
-        raise Exception("Invalid input variable type. Please input CMIP6 psl file.")
+    if ("va" not in data.vars) or ("ua" not in data.vars):
+        raise Exception("Invalid input variable type. Please input either " +
+                            "a combined uv file or both ua and va from CMIP6.")
 
-    extr = tempname[:-3] + "_extr.nc"
+    print("Starting preprocessing.")
 
     # remove unnecessary variables
+    extr = tempname[:-3] + "_extr.nc"
     if "time_bnds" in data.vars:
         ncks = "time_bnds"
         if "lat_bnds" in data.vars:
             ncks += ",lat_bnds,lon_bnds"
-        os.system("ncks -C -O -x -v " + ncks + " " + tempname + " " + extr)
+        _run_stage("Removing variables", "ncks -C -O -x -v " + ncks + " " +
+                   tempname + " " + extr, [extr])
     elif "lat_bnds" in data.vars:
-        os.system("ncks -C -O -x -v lat_bnds,lon_bnds " + tempname + " " + extr)
+        _run_stage("Removing variables", "ncks -C -O -x -v lat_bnds,lon_bnds " +
+                   tempname + " " + extr, [extr])
     else:
         extr = tempname
 
-    print("Starting preprocessing.")
-
     gridtype = data.get_grid_type()
     # check if regridding is needed, do nothing if already gaussian
     if gridtype == 'gridtype  = gaussian':
@@ -323,104 +817,21 @@ def track_mslp(input, outdirectory, NH=True, netcdf=True):
 
     # fill missing values
     filled = gridcheck[:-3] + "_filled.nc"
-    os.system("ncatted -a _FillValue,,d,, -a missing_value,,d,, " + gridcheck +
-              " " + filled)
+    _run_stage("Filling missing values",
+               "ncatted -a _FillValue,,d,, -a missing_value,,d,, " + gridcheck +
+               " " + filled, [filled])
     print("Filled missing values, if any.")
 
-    # clean up if it was regridded and if variables were removed
     if gridtype != 'gridtype  = gaussian':
         os.system("rm " + tempname[:-3] + "_gaussian.nc")
     if extr != tempname:
         os.system("rm " + extr)
 
-    # get data info
-    data = cmip6_indat(filled)
-    nx, ny = data.get_nx_ny()
-    years = cdo.showyear(input=filled)[0].split()
-
-    if NH == True:
-        hemisphere = "NH"
-    else:
-        hemisphere = "SH"
-
-    # do tracking for one year at a time
-    for year in years:
-        print(year + "...")
-
-        # select year from data
-        year_file = 'tempyear.nc'
-        cdo.selyear(year, input=filled, output="indat/"+year_file)
+    return tempname, filled, input_basename
 
-        # get number of timesteps and number of chunks for tracking
-        data = cmip6_indat("indat/"+year_file)
-        ntime = data.get_timesteps()
-        nchunks = ceil(ntime/62)
-        c_input = year + "_" + hemisphere + "_" + input_basename[:-3]
-
-        # spectral filtering
-        if int(ny) >= 96: # T63
-            fname = "T63filt_" + year + ".dat"
-            line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
-                        "/;s/TRUNC/63/\" specfilt_nc.in > spec.test"
-            line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
-            # NH
-            line_5 = "master -c=" + c_input + " -e=track.linux -d=now -i=" + \
-                        fname + " -f=y" + year + \
-                        " -j=RUN_AT.in -k=initial.T63_" + hemisphere + \
-                        " -n=1,62," + str(nchunks) + " -o='" + outdir + \
-                        "' -r=RUN_AT_ -s=RUNDATIN.MSLP"
-
-        else: # T42
-            fname = "T42filt_" + year + ".dat"
-            line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
-                        "/;s/TRUNC/42/\" specfilt_nc.in > spec.test"
-            line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
-            # NH
-            line_5 = "master -c=" + c_input + " -e=track.linux -d=now -i=" + \
-                        fname + " -f=y" + year + \
-                        " -j=RUN_AT.in -k=initial.T42_" + hemisphere + \
-                        " -n=1,62," + str(nchunks) + " -o='" + outdir + \
-                        "' -r=RUN_AT_ -s=RUNDATIN.MSLP"
-
-        line_2 = "bin/track.linux -i " + year_file + " -f y" + year + \
-                    " < spec.test"
-        line_4 = "rm outdat/specfil.y" + year + "_band000"
-
-        # setting environment variables
-        os.environ["CC"] = "gcc"
-        os.environ["FC"] = "gfortran"
-        os.environ["ARFLAGS"] = ""
-        os.environ["PATH"] += ":." 
-
-        # executing the lines to run TRACK
-        print("Spectral filtering...")
-
-        os.system(line_1)
-        os.system(line_2)
-        os.system(line_3)
-        os.system(line_4)
-
-        print("Running TRACK...")
-
-        os.system(line_5)
-
-        # cleanup
-        os.system("rm indat/"+year_file)
-
-        print("Turning track output to netCDF...")
-        if netcdf == True:
-            # tr2nc - turn tracks into netCDF files
-            os.system("gunzip '" + outdir + "/" + c_input + "/ff_trs_neg.gz'")
-            os.system("gunzip '" + outdir + "/" + c_input + "/tr_trs_neg.gz'")
-            tr2nc_mslp(outdir + "/" + c_input + "/ff_trs_neg")
-            tr2nc_mslp(outdir + "/" + c_input + "/tr_trs_neg")
-
-    os.system("rm " + tempname)
-    os.chdir(cwd)
-
-    return
-
-def track_uv_vor850(infile, outdirectory, infile2='none', NH=True, netcdf=True):
+def track_uv_vor850(infile, outdirectory, infile2='none', NH=True, netcdf=True,
+                    timestep=None, drop_vars=False, years=None,
+                    continuous=False, filter_only=False, region=None):
     """
     Calculate 850 hPa vorticity from CMIP6 horizontal wind velocity data
     and run TRACK.
@@ -445,167 +856,186 @@ def track_uv_vor850(infile, outdirectory, infile2='none', NH=True, netcdf=True):
     netcdf : boolean, optional
         If true, converts TRACK output to netCDF format using TR2NC utility.
 
-    """
-    outdir = os.path.abspath(os.path.expanduser(outdirectory))
-    if infile2 == 'none':
-        input = infile
-
-    else: # if U and V separate, merge into UV file
-        merge_uv(infile, infile2, infile[:-3] + "_merged.nc")
-        input = infile[:-3] + "_merged.nc"
-
-    input_basename = os.path.basename(input)
-
-    # copy data into TRACK indat directory
-    ## files need to be moved to TRACK directory for TRACK to find them
-    tempname = "indat/temp_file.nc"
-    os.system("cp '" + filled + "' " + str(Path.home()) + "/TRACK-1.5.2/" +
-              tempname)
-    os.system("rm '" + filled + "'")
-    print("Data copied into TRACK/indat directory.")
-
-    # change working directory
-    cwd = os.getcwd()
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2")
-
-    data = cmip6_indat(tempname)
-
-    if ("va" not in data.vars) or ("ua" not in data.vars):
-        raise Exception("Invalid input variable type. Please input either " +
-                            "a combined uv file or both ua and va from CMIP6.")
-
-    print("Starting preprocessing.")
-
-    # remove unnecessary variables
-    extr = tempname[:-3] + "_extr.nc"
-    if "time_bnds" in data.vars:
-        ncks = "time_bnds"
-        if "lat_bnds" in data.vars:
-            ncks += ",lat_bnds,lon_bnds"
-        os.system("ncks -C -O -x -v " + ncks + " " + tempname + " " + extr)
-    elif "lat_bnds" in data.vars:
-        os.system("ncks -C -O -x -v lat_bnds,lon_bnds " + tempname + " " + extr)
-    else:
-        extr = tempname
-
-    gridtype = data.get_grid_type()
-    # check if regridding is needed, do nothing if already gaussian
-    if gridtype == 'gridtype  = gaussian':
-        print("No regridding needed.")
-        gridcheck = tempname
+    timestep : int, optional
+        Time step in hours to subsample the input data to before tracking.
 
-    else:
-    # regrid
-        gridcheck = tempname[:-3] + "_gaussian.nc"
-        regrid_cmip6(tempname, gridcheck)
+    drop_vars : boolean, optional
+        If true, drops all variables other than ua and va before
+        preprocessing.
 
-    # fill missing values
-    filled = gridcheck[:-3] + "_filled.nc"
-    os.system("ncatted -a _FillValue,,d,, -a missing_value,,d,, " + gridcheck +
-              " " + filled)
-    print("Filled missing values, if any.")
+    years : list of ints, optional
+        Years to track. By default, all years in the input data are tracked.
 
-    if gridtype != 'gridtype  = gaussian':
-        os.system("rm " + tempname[:-3] + "_gaussian.nc")
-    if extr != tempname:
-        os.system("rm " + extr)
+    continuous : boolean, optional
+        If true, the input is tracked in one pass instead of one year at a
+        time, so that storms are not cut at the end of each year. The output
+        is labelled with the first year.
 
-    # get data info
-    data = cmip6_indat(filled)
-    nx, ny = data.get_nx_ny()
-    years = cdo.showyear(input=filled)[0].split()
+    filter_only : boolean, optional
+        If true, stops after spectral filtering and keeps the filtered data
+        in the TRACK indat directory, so that TRACK can be run on it several
+        times, e.g. by sweep. Returns the filtered runs.
 
-    if NH == True:
-        hemisphere = "NH"
-    else:
-        hemisphere = "SH"
-
-    # do tracking for one year at a time
-    for year in years:
-        print(year + "...")
-
-        # select year from data
-        year_file = 'tempyear.nc'
-        cdo.selyear(year, input=filled, output="indat/"+year_file)
-
-        # get number of timesteps and number of chunks for tracking
-        data = cmip6_indat("indat/"+year_file)
-        ntime = data.get_timesteps()
-        nchunks = ceil(ntime/62)
-
-        # calculate vorticity from UV
-        vor850name = "vor850_temp.dat"
-        calc_vorticity("./indat/"+year_file, vor850name, copy_file=False)
-        year_file = vor850name
-        c_input = year + "_" + hemisphere + "_" + "_vor850_" + \
-                    input_basename[:-3]
-
-        # spectral filtering
-        if int(ny) >= 96: # T63
-            fname = "T63filt_" + year + ".dat"
-            line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
-                        "/;s/TRUNC/63/\" specfilt.in > spec.test"
-            line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
-            # NH
-            line_5 = "master -c=" + c_input + " -e=track.linux -d=now -i=" + \
-                        fname + " -f=y" + year + \
-                        " -j=RUN_AT.in -k=initial.T63_" + hemisphere + \
-                        " -n=1,62," + str(nchunks) + " -o='" + outdir + \
-                        "' -r=RUN_AT_ -s=RUNDATIN.VOR"
-
-        else: # T42
-            fname = "T42filt_" + year + ".dat"
-            line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
-                        "/;s/TRUNC/42/\" specfilt.in > spec.test"
-            line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
-            # NH
-            line_5 = "master -c=" + c_input + " -e=track.linux -d=now -i=" + \
-                        fname + " -f=y" + year + \
-                        " -j=RUN_AT.in -k=initial.T42_" + hemisphere + \
-                        " -n=1,62," + \
-                        str(nchunks) + " -o='" + outdir + \
-                        "' -r=RUN_AT_ -s=RUNDATIN.VOR"
+    region : tuple or string, optional
+        Region to track in, as a bounding box (lon_min, lon_max, lat_min,
+        lat_max) in degrees or as the path to a netCDF mask file that is
+        non-zero inside the region. TRACK only runs on the grid points of
+        the region, and only tracks with points inside it are kept.
 
-        line_2 = "bin/track.linux -i " + year_file + " -f y" + year + \
-                    " < spec.test"
-        line_4 = "rm outdat/specfil.y" + year + "_band000"
-
-        # setting environment variables
-        os.environ["CC"] = "gcc"
-        os.environ["FC"] = "gfortran"
-        os.environ["ARFLAGS"] = ""
-        os.environ["PATH"] += ":." 
-
-        # executing the lines to run TRACK
-        print("Spectral filtering...")
-
-        os.system(line_1)
-        os.system(line_2)
-        os.system(line_3)
-        os.system(line_4)
-
-        print("Running TRACK...")
+    """
+    outdir = os.path.abspath(os.path.expanduser(outdirectory))
 
-        os.system(line_5)
+    # copy, regrid and fill the 850 hPa winds in the TRACK indat directory
+    cwd = os.getcwd()
+    try:
+        tempname, filled, input_basename = _prepare_uv(infile, infile2,
+                                                       [85000], timestep,
+                                                       drop_vars, years)
 
-        # cleanup
-        os.system("rm indat/"+year_file)
+        # get data info
+        data = cmip6_indat(filled)
+        nx, ny = data.get_nx_ny()
+        # regions need a contiguous range of longitudes
+        if region is not None:
+            _shift_longitudes(filled, region)
 
-        print("Turning track output to netCDF...")
-        if netcdf == True:
-            # tr2nc - turn tracks into netCDF files
-            os.system("gunzip '" + outdir + "'/" + c_input + "/ff_trs_*")
-            os.system("gunzip '" + outdir + "'/" + c_input + "/tr_trs_*")
-            tr2nc_vor(outdir + "/" + c_input + "/ff_trs_pos")
-            tr2nc_vor(outdir + "/" + c_input + "/ff_trs_neg")
-            tr2nc_vor(outdir + "/" + c_input + "/tr_trs_pos")
-            tr2nc_vor(outdir + "/" + c_input + "/tr_trs_neg")
+        years = cdo.showyear(input=filled)[0].split()
+        frames = _frames_per_year(filled)
+        if continuous == True:
+            years = years[:1]
 
-    os.system("rm " + tempname)
-    os.chdir(cwd)
+        if NH == True:
+            hemisphere = "NH"
+        else:
+            hemisphere = "SH"
+
+        # track files written by TRACK
+        outputs = ["ff_trs_pos", "ff_trs_neg", "tr_trs_pos", "tr_trs_neg"]
+
+        # do tracking for one year at a time
+        filtered = []
+        for year in years:
+            print(year + "...")
+
+            # select year from data
+            year_file = 'tempyear.nc'
+            if continuous == True:
+                _run_stage("Selecting " + year, "cp " + filled + " indat/" +
+                           year_file, ["indat/" + year_file])
+            else:
+                cdo.selyear(year, input=filled, output="indat/"+year_file)
+
+            # check that the whole year was selected
+            if continuous == True:
+                expected = sum(frames.values())
+            else:
+                expected = frames[year]
+            _check_outputs("Selecting " + year, ["indat/" + year_file],
+                           expected)
+
+            # get number of timesteps and number of chunks for tracking
+            data = cmip6_indat("indat/"+year_file)
+            ntime = data.get_timesteps()
+            nchunks = ceil(ntime/62)
+
+            # calculate vorticity from UV
+            vor850name = "vor850_temp.dat"
+            calc_vorticity("./indat/"+year_file, vor850name, copy_file=False)
+            year_file = vor850name
+            c_input = year + "_" + hemisphere + "_" + "_vor850_" + \
+                        input_basename[:-3]
+
+            # spectral filtering
+            if int(ny) >= 96: # T63
+                fname = "T63filt_" + year + ".dat"
+                initial = _initial("63", hemisphere, region, filled)
+                line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
+                            "/;s/TRUNC/63/\" specfilt.in > spec.test"
+                line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + \
+                            fname
+                # NH
+                line_5 = "master -c=" + c_input + \
+                            " -e=track.linux -d=now -i=" + fname + \
+                            " -f=y" + year + \
+                            " -j=RUN_AT.in -k=" + initial + \
+                            " -n=1,62," + str(nchunks) + " -o='" + outdir + \
+                            "' -r=RUN_AT_ -s=RUNDATIN.VOR"
+
+            else: # T42
+                fname = "T42filt_" + year + ".dat"
+                initial = _initial("42", hemisphere, region, filled)
+                line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
+                            "/;s/TRUNC/42/\" specfilt.in > spec.test"
+                line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + \
+                            fname
+                # NH
+                line_5 = "master -c=" + c_input + \
+                            " -e=track.linux -d=now -i=" + fname + \
+                            " -f=y" + year + \
+                            " -j=RUN_AT.in -k=" + initial + \
+                            " -n=1,62," + \
+                            str(nchunks) + " -o='" + outdir + \
+                            "' -r=RUN_AT_ -s=RUNDATIN.VOR"
+
+            line_2 = "bin/track.linux -i " + year_file + " -f y" + year + \
+                        " < spec.test"
+            line_4 = "rm -f outdat/specfil.y" + year + "_band000"
+
+            # setting environment variables
+            _track_environment()
+
+            # executing the lines to run TRACK
+            print("Spectral filtering...")
+
+            _run_stage("Spectral filtering", line_1, ["spec.test"])
+            _run_stage("Spectral filtering", line_2,
+                       ["outdat/specfil.y" + year + "_band001"])
+            _run_stage("Spectral filtering", line_3, ["indat/" + fname])
+            _run_stage("Spectral filtering", line_4)
+
+            if filter_only == True:
+                filtered.append({'year': year, 'name': c_input, 'input': fname,
+                                 'initial': initial, 'nchunks': nchunks})
+                os.system("rm indat/"+year_file)
+                continue
+
+            print("Running TRACK...")
+
+            _run_stage("Running TRACK", line_5, [outdir + "/" + c_input + "/" +
+                       trs + ".gz" for trs in outputs])
+
+            # cleanup
+            os.system("rm indat/"+year_file)
+
+            print("Turning track output to netCDF...")
+            if netcdf == True:
+                # tr2nc - turn tracks into netCDF files
+                for trs in outputs:
+                    _run_stage("Unpacking tracks", "gunzip '" + outdir + "/" +
+                               c_input + "/" + trs + ".gz'",
+                               [outdir + "/" + c_input + "/" + trs])
+                tr2nc_vor(outdir + "/" + c_input + "/ff_trs_pos")
+                tr2nc_vor(outdir + "/" + c_input + "/ff_trs_neg")
+                tr2nc_vor(outdir + "/" + c_input + "/tr_trs_pos")
+                tr2nc_vor(outdir + "/" + c_input + "/tr_trs_neg")
+                if region is not None:
+                    for trs in ["ff_trs_pos", "ff_trs_neg", "tr_trs_pos",
+                                "tr_trs_neg"]:
+                        subset_tracks(outdir + "/" + c_input + "/" + trs +
+                                      ".nc", region)
+    finally:
+        # clean up, also when a stage failed, so that the next run starts
+        # from a clean TRACK directory
+        os.chdir(cwd)
+        _remove_temporary(["indat/temp_file*.nc", "indat/tempyear.nc",
+                           "indat/vor850_temp.dat"])
+    if filter_only == True:
+        return filtered
     return
 
-def track_era5_mslp(input, outdirectory, NH=True, netcdf=True):
+def track_era5_mslp(input, outdirectory, NH=True, netcdf=True, timestep=None,
+                    drop_vars=False, years=None, continuous=False,
+                    filter_only=False, region=None):
     """
     Run TRACK on ERA5 mean sea level pressure data.
 
@@ -625,6 +1055,32 @@ def track_era5_mslp(input, outdirectory, NH=True, netcdf=True):
     netcdf : boolean, optional
         If true, converts TRACK output to netCDF format using TR2NC utility.
 
+    timestep : int, optional
+        Time step in hours to subsample the input data to before tracking,
+        e.g. 6 for hourly ERA5 data.
+
+    drop_vars : boolean, optional
+        If true, drops all variables other than msl before tracking.
+
+    years : list of ints, optional
+        Years to track. By default, all years in the input data are tracked.
+
+    continuous : boolean, optional
+        If true, the input is tracked in one pass instead of one year at a
+        time, so that storms are not cut at the end of each year. The output
+        is labelled with the first year.
+
+    filter_only : boolean, optional
+        If true, stops after spectral filtering and keeps the filtered data
+        in the TRACK indat directory, so that TRACK can be run on it several
+        times, e.g. by sweep. Returns the filtered runs.
+
+    region : tuple or string, optional
+        Region to track in, as a bounding box (lon_min, lon_max, lat_min,
+        lat_max) in degrees or as the path to a netCDF mask file that is
+        non-zero inside the region. TRACK only runs on the grid points of
+        the region, and only tracks with points inside it are kept.
+
     """
     outdir = os.path.abspath(os.path.expanduser(outdirectory))
     input_basename = os.path.basename(input)
@@ -636,87 +1092,138 @@ def track_era5_mslp(input, outdirectory, NH=True, netcdf=True):
     if vars[-1] != "msl":
         raise Exception("Invalid input variable type. Please input ERA5 mslp file.")
 
-    years = cdo.showyear(input=input)[0].split()
-
     # files need to be moved to TRACK directory for TRACK to find them
-    # copy data into TRACK indat directory
+    # reduce data and copy into TRACK indat directory
     tempname = "temp_file.nc"
-    os.system("cp '" + input + "' " + str(Path.home()) + "/TRACK-1.5.2/indat/" +
-              tempname)
+    if drop_vars == True:
+        variables = ["msl"]
+    else:
+        variables = None
+    reduce_data(input, _track_dir() + "/indat/" + tempname,
+                timestep=timestep, variables=variables, years=years)
     print("Data copied into TRACK/indat directory.")
 
     # change working directory
     cwd = os.getcwd()
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2")
-
-    if NH == True:
-        hemisphere = "NH"
-    else:
-        hemisphere = "SH"
-
-    # do tracking for one year at a time
-    for year in years:
-        print(year + "...")
-
-        # select year from data
-        year_file = 'tempyear.nc'
-        cdo.selyear(year, input="indat/"+tempname, output="indat/"+year_file)
-
-        # get number of timesteps and number of chunks for tracking
-        ntime = int(len(data.variables['time'][:]))
-        nchunks = ceil(ntime/62)
-        c_input = year + "_" + hemisphere + "_" + input_basename[:-3]
-
-        # spectral filtering
-        # NOTE: NORTHERN HEMISPHERE; add SH option???
-        fname = "T63filt_" + year + ".dat"
-        line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
-                    "/;s/TRUNC/63/\" specfilt_nc.in > spec.test"
-        line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
-        # NH
-        line_5 = "master -c=" + c_input + " -e=track.linux -d=now -i=" + \
-                    fname + " -f=y" + year + \
-                    " -j=RUN_AT.in -k=initial.T63_" + hemisphere + \
-                    " -n=1,62," + str(nchunks) + " -o='" + outdir + \
-                    "' -r=RUN_AT_ -s=RUNDATIN.MSLP"
-
-        line_2 = "bin/track.linux -i " + year_file + " -f y" + year + \
-                    " < spec.test"
-        line_4 = "rm outdat/specfil.y" + year + "_band000"
-
-        # setting environment variables
-        os.environ["CC"] = "gcc"
-        os.environ["FC"] = "gfortran"
-        os.environ["ARFLAGS"] = ""
-        os.environ["PATH"] += ":." 
+    os.chdir(_track_dir())
+    try:
 
-        # executing the lines to run TRACK
-        print("Spectral filtering...")
-        os.system(line_1)
-        os.system(line_2)
-        os.system(line_3)
-        os.system(line_4)
+        # regions need a contiguous range of longitudes
+        if region is not None:
+            _shift_longitudes("indat/" + tempname, region)
 
-        print("Running TRACK...")
-        os.system(line_5)
+        years = cdo.showyear(input="indat/" + tempname)[0].split()
+        frames = _frames_per_year("indat/" + tempname)
+        if continuous == True:
+            years = years[:1]
 
-        # cleanup
-        os.system("rm indat/"+year_file)
-
-        print("Turning track output to netCDF...")
-        if netcdf == True:
-            # tr2nc - turn tracks into netCDF files
-            os.system("gunzip '" + outdir + "/" + c_input + "/ff_trs_neg.gz'")
-            os.system("gunzip '" + outdir + "/" + c_input + "/tr_trs_neg.gz'")
-            tr2nc_mslp(outdir + "/" + c_input + "/ff_trs_neg")
-            tr2nc_mslp(outdir + "/" + c_input + "/tr_trs_neg")
+        if NH == True:
+            hemisphere = "NH"
+        else:
+            hemisphere = "SH"
+
+        # track files written by TRACK
+        outputs = ["ff_trs_neg", "tr_trs_neg"]
+
+        # do tracking for one year at a time
+        filtered = []
+        for year in years:
+            print(year + "...")
+
+            # select year from data
+            year_file = 'tempyear.nc'
+            if continuous == True:
+                _run_stage("Selecting " + year, "cp indat/" + tempname +
+                           " indat/" + year_file, ["indat/" + year_file])
+            else:
+                cdo.selyear(year, input="indat/"+tempname,
+                            output="indat/"+year_file)
+
+            # check that the whole year was selected
+            if continuous == True:
+                expected = sum(frames.values())
+            else:
+                expected = frames[year]
+            _check_outputs("Selecting " + year, ["indat/" + year_file],
+                           expected)
+
+            # get number of timesteps and number of chunks for tracking
+            year_data = Dataset("indat/"+year_file, 'r')
+            ntime = int(len(year_data.variables['time'][:]))
+            year_data.close()
+            nchunks = ceil(ntime/62)
+            c_input = year + "_" + hemisphere + "_" + input_basename[:-3]
+
+            # spectral filtering
+            # NOTE: NORTHERN HEMISPHERE; add SH option???
+            fname = "T63filt_" + year + ".dat"
+            initial = _initial("63", hemisphere, region, "indat/" + tempname)
+            line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
+                        "/;s/TRUNC/63/\" specfilt_nc.in > spec.test"
+            line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
+            # NH
+            line_5 = "master -c=" + c_input + " -e=track.linux -d=now -i=" + \
+                        fname + " -f=y" + year + \
+                        " -j=RUN_AT.in -k=" + initial + \
+                        " -n=1,62," + str(nchunks) + " -o='" + outdir + \
+                        "' -r=RUN_AT_ -s=RUNDATIN.MSLP"
 
-    os.system("rm indat/" + tempname)
-    os.chdir(cwd)
+            line_2 = "bin/track.linux -i " + year_file + " -f y" + year + \
+                        " < spec.test"
+            line_4 = "rm -f outdat/specfil.y" + year + "_band000"
+
+            # setting environment variables
+            _track_environment()
+
+            # executing the lines to run TRACK
+            print("Spectral filtering...")
+            _run_stage("Spectral filtering", line_1, ["spec.test"])
+            _run_stage("Spectral filtering", line_2,
+                       ["outdat/specfil.y" + year + "_band001"])
+            _run_stage("Spectral filtering", line_3, ["indat/" + fname])
+            _run_stage("Spectral filtering", line_4)
+
+            if filter_only == True:
+                filtered.append({'year': year, 'name': c_input, 'input': fname,
+                                 'initial': initial, 'nchunks': nchunks})
+                os.system("rm indat/"+year_file)
+                continue
+
+            print("Running TRACK...")
+            _run_stage("Running TRACK", line_5, [outdir + "/" + c_input + "/" +
+                       trs + ".gz" for trs in outputs])
+
+            # cleanup
+            os.system("rm indat/"+year_file)
+
+            print("Turning track output to netCDF...")
+            if netcdf == True:
+                # tr2nc - turn tracks into netCDF files
+                for trs in outputs:
+                    _run_stage("Unpacking tracks", "gunzip '" + outdir + "/" +
+                               c_input + "/" + trs + ".gz'",
+                               [outdir + "/" + c_input + "/" + trs])
+                tr2nc_mslp(outdir + "/" + c_input + "/ff_trs_neg")
+                tr2nc_mslp(outdir + "/" + c_input + "/tr_trs_neg")
+                if region is not None:
+                    subset_tracks(outdir + "/" + c_input + "/ff_trs_neg.nc",
+                                  region)
+                    subset_tracks(outdir + "/" + c_input + "/tr_trs_neg.nc",
+                                  region)
+    finally:
+        # clean up, also when a stage failed, so that the next run starts
+        # from a clean TRACK directory
+        os.chdir(cwd)
+        _remove_temporary(["indat/" + tempname[:-3] + "*.nc",
+                           "indat/tempyear.nc"])
+    if filter_only == True:
+        return filtered
 
     return
 
-def track_era5_vor850(input, outdirectory, NH=True, netcdf=True):
+def track_era5_vor850(input, outdirectory, NH=True, netcdf=True, timestep=None,
+                      drop_vars=False, years=None, continuous=False,
+                      filter_only=False, region=None):
 
     """
     Calculate 850 hPa vorticity from ERA5 horizontal wind velocity data
@@ -738,6 +1245,32 @@ def track_era5_vor850(input, outdirectory, NH=True, netcdf=True):
     netcdf : boolean, optional
         If true, converts TRACK output to netCDF format using TR2NC utility.
 
+    timestep : int, optional
+        Time step in hours to subsample the input data to before tracking,
+        e.g. 6 for hourly ERA5 data.
+
+    drop_vars : boolean, optional
+        If true, drops all variables other than U and V before tracking.
+
+    years : list of ints, optional
+        Years to track. By default, all years in the input data are tracked.
+
+    continuous : boolean, optional
+        If true, the input is tracked in one pass instead of one year at a
+        time, so that storms are not cut at the end of each year. The output
+        is labelled with the first year.
+
+    filter_only : boolean, optional
+        If true, stops after spectral filtering and keeps the filtered data
+        in the TRACK indat directory, so that TRACK can be run on it several
+        times, e.g. by sweep. Returns the filtered runs.
+
+    region : tuple or string, optional
+        Region to track in, as a bounding box (lon_min, lon_max, lat_min,
+        lat_max) in degrees or as the path to a netCDF mask file that is
+        non-zero inside the region. TRACK only runs on the grid points of
+        the region, and only tracks with points inside it are kept.
+
     """
     outdir = os.path.abspath(os.path.expanduser(outdirectory))
     input_basename = os.path.basename(input)
@@ -750,93 +1283,145 @@ def track_era5_vor850(input, outdirectory, NH=True, netcdf=True):
         raise Exception("Invalid input variable type. Please input " +
                             "a UV file from ERA5.")
 
-    years = cdo.showyear(input=input)[0].split()
-
     # copy data into TRACK indat directory
     ## files need to be moved to TRACK directory for TRACK to find them
+    ## only the 850 hPa level is needed, so it is selected before copying
     tempname = "temp_file.nc"
-    os.system("cp '" + input + "' " + str(Path.home()) + "/TRACK-1.5.2/indat/" +
-              tempname)
+    if drop_vars == True:
+        variables = ["var131", "var132"]
+    else:
+        variables = None
+    reduce_data(input, _track_dir() + "/indat/" + tempname,
+                levels=[85000], timestep=timestep, variables=variables,
+                years=years)
     print("Data copied into TRACK/indat directory.")
 
     # change working directory
     cwd = os.getcwd()
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2")
-
-    if NH == True:
-        hemisphere = "NH"
-    else:
-        hemisphere = "SH"
-
-    # do tracking for one year at a time
-    for year in years:
-        print(year + "...")
-
-        # select year from data
-        year_file = 'tempyear.nc'
-        cdo.selyear(year, input="indat/"+tempname, output="indat/"+year_file)
-
-        # get number of timesteps and number of chunks for tracking
-        ntime = int(len(data.variables['time'][:]))
-        nchunks = ceil(ntime/62)
-
-        # calculate vorticity from UV
-        tempname = "vor850_temp.dat"
-        calc_vorticity("./indat/"+year_file, tempname, copy_file=False,
-                        cmip6=False)
-        year_file = tempname
-        c_input = year + "_" + hemisphere + "_" + "_vor850_" + \
-                    input_basename[:-3]
-
-        # spectral filtering, T42
-        fname = "T42filt_" + year + ".dat"
-        line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
-                    "/;s/TRUNC/42/\" specfilt.in > spec.test"
-        line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
-        # NH
-        line_5 = "master -c=" + c_input + " -e=track.linux -d=now -i=" + \
-                    fname + " -f=y" + year + \
-                    " -j=RUN_AT.in -k=initial.T42_" + hemisphere + \
-                    " -n=1,62," + \
-                    str(nchunks) + " -o='" + outdir + \
-                    "' -r=RUN_AT_ -s=RUNDATIN.VOR"
-
-        line_2 = "bin/track.linux -i " + year_file + " -f y" + year + \
-                    " < spec.test"
-        line_4 = "rm outdat/specfil.y" + year + "_band000"
-
-        # setting environment variables
-        os.environ["CC"] = "gcc"
-        os.environ["FC"] = "gfortran"
-        os.environ["ARFLAGS"] = ""
-        os.environ["PATH"] += ":." 
-
-        # executing the lines to run TRACK
-        print("Spectral filtering...")
-
-        os.system(line_1)
-        os.system(line_2)
-        os.system(line_3)
-        os.system(line_4)
-
-        print("Running TRACK...")
+    os.chdir(_track_dir())
+    try:
 
-        os.system(line_5)
+        # regions need a contiguous range of longitudes
+        if region is not None:
+            _shift_longitudes("indat/" + tempname, region)
 
-        # cleanup
-        os.system("rm indat/"+year_file)
+        years = cdo.showyear(input="indat/" + tempname)[0].split()
+        frames = _frames_per_year("indat/" + tempname)
+        if continuous == True:
+            years = years[:1]
 
-        print("Turning track output to netCDF...")
-        if netcdf == True:
-            # tr2nc - turn tracks into netCDF files
-            os.system("gunzip '" + outdir + "'/" + c_input + "/ff_trs_*")
-            os.system("gunzip '" + outdir + "'/" + c_input + "/tr_trs_*")
-            tr2nc_vor(outdir + "/" + c_input + "/ff_trs_pos")
-            tr2nc_vor(outdir + "/" + c_input + "/ff_trs_neg")
-            tr2nc_vor(outdir + "/" + c_input + "/tr_trs_pos")
-            tr2nc_vor(outdir + "/" + c_input + "/tr_trs_neg")
+        if NH == True:
+            hemisphere = "NH"
+        else:
+            hemisphere = "SH"
+
+        # track files written by TRACK
+        outputs = ["ff_trs_pos", "ff_trs_neg", "tr_trs_pos", "tr_trs_neg"]
+
+        # do tracking for one year at a time
+        filtered = []
+        for year in years:
+            print(year + "...")
+
+            # select year from data
+            year_file = 'tempyear.nc'
+            if continuous == True:
+                _run_stage("Selecting " + year, "cp indat/" + tempname +
+                           " indat/" + year_file, ["indat/" + year_file])
+            else:
+                cdo.selyear(year, input="indat/"+tempname,
+                            output="indat/"+year_file)
+
+            # check that the whole year was selected
+            if continuous == True:
+                expected = sum(frames.values())
+            else:
+                expected = frames[year]
+            _check_outputs("Selecting " + year, ["indat/" + year_file],
+                           expected)
+
+            # get number of timesteps and number of chunks for tracking
+            year_data = Dataset("indat/"+year_file, 'r')
+            ntime = int(len(year_data.variables['time'][:]))
+            year_data.close()
+            nchunks = ceil(ntime/62)
+
+            # calculate vorticity from UV
+            vor850name = "vor850_temp.dat"
+            calc_vorticity("./indat/"+year_file, vor850name, copy_file=False,
+                            cmip6=False)
+            year_file = vor850name
+            c_input = year + "_" + hemisphere + "_" + "_vor850_" + \
+                        input_basename[:-3]
+
+            # spectral filtering, T42
+            fname = "T42filt_" + year + ".dat"
+            initial = _initial("42", hemisphere, region, "indat/" + tempname)
+            line_1 = "sed -e \"s/NX/" + nx + "/;s/NY/" + ny + \
+                        "/;s/TRUNC/42/\" specfilt.in > spec.test"
+            line_3 = "mv outdat/specfil.y" + year + "_band001 indat/" + fname
+            # NH
+            line_5 = "master -c=" + c_input + " -e=track.linux -d=now -i=" + \
+                        fname + " -f=y" + year + \
+                        " -j=RUN_AT.in -k=" + initial + \
+                        " -n=1,62," + \
+                        str(nchunks) + " -o='" + outdir + \
+                        "' -r=RUN_AT_ -s=RUNDATIN.VOR"
 
-    os.chdir(cwd)
+            line_2 = "bin/track.linux -i " + year_file + " -f y" + year + \
+                        " < spec.test"
+            line_4 = "rm -f outdat/specfil.y" + year + "_band000"
+
+            # setting environment variables
+            _track_environment()
+
+            # executing the lines to run TRACK
+            print("Spectral filtering...")
+
+            _run_stage("Spectral filtering", line_1, ["spec.test"])
+            _run_stage("Spectral filtering", line_2,
+                       ["outdat/specfil.y" + year + "_band001"])
+            _run_stage("Spectral filtering", line_3, ["indat/" + fname])
+            _run_stage("Spectral filtering", line_4)
+
+            if filter_only == True:
+                filtered.append({'year': year, 'name': c_input, 'input': fname,
+                                 'initial': initial, 'nchunks': nchunks})
+                os.system("rm indat/"+year_file)
+                continue
+
+            print("Running TRACK...")
+
+            _run_stage("Running TRACK", line_5, [outdir + "/" + c_input + "/" +
+                       trs + ".gz" for trs in outputs])
+
+            # cleanup
+            os.system("rm indat/"+year_file)
+
+            print("Turning track output to netCDF...")
+            if netcdf == True:
+                # tr2nc - turn tracks into netCDF files
+                for trs in outputs:
+                    _run_stage("Unpacking tracks", "gunzip '" + outdir + "/" +
+                               c_input + "/" + trs + ".gz'",
+                               [outdir + "/" + c_input + "/" + trs])
+                tr2nc_vor(outdir + "/" + c_input + "/ff_trs_pos")
+                tr2nc_vor(outdir + "/" + c_input + "/ff_trs_neg")
+                tr2nc_vor(outdir + "/" + c_input + "/tr_trs_pos")
+                tr2nc_vor(outdir + "/" + c_input + "/tr_trs_neg")
+                if region is not None:
+                    for trs in ["ff_trs_pos", "ff_trs_neg", "tr_trs_pos",
+                                "tr_trs_neg"]:
+                        subset_tracks(outdir + "/" + c_input + "/" + trs +
+                                      ".nc", region)
+    finally:
+        # clean up, also when a stage failed, so that the next run starts
+        # from a clean TRACK directory
+        os.chdir(cwd)
+        _remove_temporary(["indat/" + tempname[:-3] + "*.nc",
+                           "indat/tempyear.nc", "indat/vor850_temp.dat"])
+    if filter_only == True:
+        return filtered
 
     return
 
@@ -860,9 +1445,13 @@ def tr2nc_mslp(input):
     """
     fullpath = os.path.abspath(input)
     cwd = os.getcwd()
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2/utils/bin")
-    os.system("tr2nc '" + fullpath + "' s ../TR2NC/tr2nc_mslp.meta.elinor")
-    os.chdir(cwd)
+    os.chdir(_track_dir() + "/utils/bin")
+    try:
+        _run_stage("Converting tracks to netCDF", _tr2nc() + " '" +
+                   fullpath + "' s ../TR2NC/tr2nc_mslp.meta.elinor",
+                   [fullpath + ".nc"])
+    finally:
+        os.chdir(cwd)
     return
 
 def tr2nc_vor(input):
@@ -878,8 +1467,12 @@ def tr2nc_vor(input):
     """
     fullpath = os.path.abspath(input)
     cwd = os.getcwd()
-    os.chdir(str(Path.home()) + "/TRACK-1.5.2/utils/bin")
-    os.system("tr2nc '" + fullpath + "' s ../TR2NC/tr2nc.meta.elinor")
-    os.chdir(cwd)
+    os.chdir(_track_dir() + "/utils/bin")
+    try:
+        _run_stage("Converting tracks to netCDF", _tr2nc() + " '" +
+                   fullpath + "' s ../TR2NC/tr2nc.meta.elinor",
+                   [fullpath + ".nc"])
+    finally:
+        os.chdir(cwd)
     return
 
@@ -0,0 +1,418 @@
+import numpy as np
+from netCDF4 import Dataset
+
+__all__ = ['TrackCollection', 'read_tracks', 'iter_tracks']
+
+EARTH_RADIUS = 6371.0 # km
+
+# variables in TR2NC files that are not additional fields
+_TR2NC_VARS = ['TRACK_ID', 'FIRST_PT', 'NUM_PTS', 'index', 'time',
+               'longitude', 'latitude']
+
+def great_circle(lon1, lat1, lon2, lat2):
+    """
+    Great circle distance in km between points given in degrees, using the
+    haversine formula. Works elementwise on arrays.
+    """
+    lon1, lat1, lon2, lat2 = [np.radians(x) for x in [lon1, lat1, lon2, lat2]]
+    a = np.sin((lat2 - lat1) / 2)**2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+class TrackCollection(object):
+    """
+    Collection of tracks stored as contiguous ragged arrays, in the same
+    layout as the TR2NC output: the points of all tracks are stored one
+    after the other, and every track is described by the index of its first
+    point and its number of points.
+
+    Per-track quantities are computed for all tracks at once with segment
+    reductions over the point arrays. Filters return a new collection that
+    shares the point arrays and only selects a subset of the tracks, so
+    filters can be chained without copying any point data.
+    """
+    def __init__(self, track_id, first_pt, num_pts, time, lon, lat,
+                 fields={}, time_units='hours', selection=None, _cache=None):
+        """
+        Parameters
+        ----------
+
+        track_id, first_pt, num_pts : arrays
+            Per-track ID, index of the first point and number of points. The
+            tracks need to be stored contiguously in the point arrays.
+
+        time, lon, lat : arrays
+            Per-point time in hours, longitude and latitude in degrees
+
+        fields : dict of arrays, optional
+            Additional per-point fields, e.g. the tracked intensity
+
+        time_units : string, optional
+            Units of time, used when writing the collection to a file.
+
+        selection : array of ints, optional
+            Indices of the selected tracks. Defaults to all tracks.
+
+        """
+        self.track_id = np.asarray(track_id)
+        self.first_pt = np.asarray(first_pt, dtype=np.int64)
+        self.num_pts = np.asarray(num_pts, dtype=np.int64)
+        self.time = np.asarray(time, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.fields = {name: np.asarray(value, dtype=np.float64)
+                        for name, value in fields.items()}
+        self.time_units = time_units
+
+        if np.any(self.first_pt[1:] != self.first_pt[:-1] + self.num_pts[:-1]):
+            raise Exception("Tracks are not stored contiguously.")
+
+        if selection is None:
+            selection = np.arange(len(self.first_pt))
+        self.selection = selection
+        # per-track quantities for all tracks, shared by filtered collections
+        self._cache = {} if _cache is None else _cache
+
+    def __len__(self):
+        return len(self.selection)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self.track(n)
+
+    def _view(self, selection):
+        # new collection sharing the point arrays and per-track cache
+        return TrackCollection(self.track_id, self.first_pt, self.num_pts,
+                               self.time, self.lon, self.lat, self.fields,
+                               self.time_units, selection, self._cache)
+
+    def track(self, n):
+        """
+        Return the points of the nth selected track as a dict of array views.
+        """
+        i = self.selection[n]
+        points = slice(self.first_pt[i], self.first_pt[i] + self.num_pts[i])
+        track = {'track_id': self.track_id[i], 'time': self.time[points],
+                 'lon': self.lon[points], 'lat': self.lat[points]}
+        for name, value in self.fields.items():
+            track[name] = value[points]
+        return track
+
+    def intensity_field(self):
+        """Return the name of the tracked intensity field."""
+        if len(self.fields) == 0:
+            raise Exception("No intensity field in track collection.")
+        return list(self.fields)[0]
+
+    #
+    # per-point quantities
+    #
+
+    def _segments(self, name):
+        # per-point quantity between each point and the previous point of the
+        # same track, NaN for the first point of each track
+        if name in self._cache:
+            return self._cache[name]
+        first = np.zeros(len(self.time), dtype=bool)
+        first[self.first_pt[self.num_pts > 0]] = True
+
+        if name == 'distance':
+            value = np.empty(len(self.time))
+            value[1:] = great_circle(self.lon[:-1], self.lat[:-1],
+                                     self.lon[1:], self.lat[1:])
+        elif name == 'dt':
+            value = np.empty(len(self.time))
+            value[1:] = np.diff(self.time)
+        else:
+            value = np.empty(len(self.time))
+            value[1:] = np.diff(self.fields[name])
+        value[first] = np.nan
+        self._cache[name] = value
+        return value
+
+    def speed(self):
+        """
+        Per-point translation speed in km/h between each point and the
+        previous point of its track, NaN for the first point of each track.
+        Covers all points, index with first_pt and num_pts.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._segments('distance') / self._segments('dt')
+
+    def deepening_rate(self, field=None):
+        """
+        Per-point rate of change of the intensity field per 24 hours, between
+        each point and the previous point of its track. Positive values mean
+        the intensity increased. Covers all points, index with first_pt and
+        num_pts.
+
+        Parameters
+        ----------
+
+        field : string, optional
+            Name of the intensity field. Defaults to the tracked field.
+
+        """
+        if field is None:
+            field = self.intensity_field()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 24 * self._segments(field) / self._segments('dt')
+
+    #
+    # per-track reductions
+    #
+
+    def _reduce(self, ufunc, values, key):
+        # reduces per-point values over every track, for all tracks at once,
+        # and returns the result for the selected tracks
+        if key not in self._cache:
+            result = np.full(len(self.first_pt), np.nan)
+            nonempty = self.num_pts > 0
+            if np.any(nonempty):
+                # reduceat needs in-range indices, empty tracks are masked
+                starts = self.first_pt[nonempty]
+                result[nonempty] = ufunc.reduceat(values, starts)
+            self._cache[key] = result
+        return self._cache[key][self.selection]
+
+    def _nanreduce(self, ufunc, values, key):
+        # as _reduce, but ignoring the NaN of the first point of each track
+        fill = {np.add: 0., np.maximum: -np.inf, np.minimum: np.inf}[ufunc]
+        result = self._reduce(ufunc, np.where(np.isnan(values), fill, values),
+                              key)
+        return np.where(np.isinf(result), np.nan, result)
+
+    def _endpoint(self, values, last=False):
+        # value at the first or last point of the selected tracks
+        i = self.first_pt[self.selection]
+        if last == True:
+            i = i + self.num_pts[self.selection] - 1
+        return values[i]
+
+    def lifetime(self):
+        """Per-track lifetime in hours."""
+        return self._endpoint(self.time, last=True) - self._endpoint(self.time)
+
+    def genesis_lat(self):
+        """Per-track latitude of the first point."""
+        return self._endpoint(self.lat)
+
+    def genesis_lon(self):
+        """Per-track longitude of the first point."""
+        return self._endpoint(self.lon)
+
+    def displacement(self):
+        """Per-track great circle distance in km between first and last point."""
+        return great_circle(self._endpoint(self.lon), self._endpoint(self.lat),
+                            self._endpoint(self.lon, last=True),
+                            self._endpoint(self.lat, last=True))
+
+    def path_length(self):
+        """Per-track distance in km travelled along the track."""
+        return self._nanreduce(np.add, self._segments('distance'),
+                               'path_length')
+
+    def mean_speed(self):
+        """Per-track mean translation speed in km/h."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.path_length() / self.lifetime()
+
+    def max_speed(self):
+        """Per-track maximum translation speed in km/h."""
+        return self._nanreduce(np.maximum, self.speed(), 'max_speed')
+
+    def max_intensity(self, field=None):
+        """Per-track maximum of the intensity field."""
+        if field is None:
+            field = self.intensity_field()
+        return self._reduce(np.maximum, self.fields[field], 'max_' + field)
+
+    def min_intensity(self, field=None):
+        """Per-track minimum of the intensity field."""
+        if field is None:
+            field = self.intensity_field()
+        return self._reduce(np.minimum, self.fields[field], 'min_' + field)
+
+    def max_deepening_rate(self, field=None):
+        """Per-track maximum deepening rate per 24 hours."""
+        if field is None:
+            field = self.intensity_field()
+        return self._nanreduce(np.maximum, self.deepening_rate(field),
+                               'max_deepening_' + field)
+
+    def metrics(self):
+        """Return a dict of all per-track quantities of the selected tracks."""
+        metrics = {'track_id': self.track_id[self.selection],
+                   'num_pts': self.num_pts[self.selection],
+                   'lifetime': self.lifetime(),
+                   'genesis_lon': self.genesis_lon(),
+                   'genesis_lat': self.genesis_lat(),
+                   'displacement': self.displacement(),
+                   'path_length': self.path_length(),
+                   'mean_speed': self.mean_speed(),
+                   'max_speed': self.max_speed()}
+        if len(self.fields) > 0:
+            metrics['max_intensity'] = self.max_intensity()
+            metrics['max_deepening_rate'] = self.max_deepening_rate()
+        return metrics
+
+    #
+    # filters
+    #
+
+    def where(self, mask):
+        """
+        Return a view of the tracks for which mask, an array with one value
+        per selected track, is true.
+        """
+        return self._view(self.selection[np.asarray(mask, dtype=bool)])
+
+    def filter_lifetime(self, min_hours=48):
+        """Keep tracks lasting at least min_hours."""
+        return self.where(self.lifetime() >= min_hours)
+
+    def filter_displacement(self, min_km=1000):
+        """Keep tracks whose first and last points are at least min_km apart."""
+        return self.where(self.displacement() >= min_km)
+
+    def filter_genesis_lat(self, min_lat=-90, max_lat=90):
+        """Keep tracks starting between min_lat and max_lat."""
+        lat = self.genesis_lat()
+        return self.where((lat >= min_lat) & (lat <= max_lat))
+
+    def filter_intensity(self, threshold, field=None):
+        """Keep tracks whose intensity reaches at least threshold."""
+        return self.where(self.max_intensity(field) >= threshold)
+
+    #
+    # input and output
+    #
+
+    def points(self, name):
+        """
+        Return a per-point array for the selected tracks, with the tracks
+        one after the other. This is a view if all tracks are selected.
+        """
+        values = {'time': self.time, 'lon': self.lon, 'lat': self.lat}
+        values = values.get(name, self.fields.get(name))
+        if len(self.selection) == len(self.first_pt):
+            return values
+        starts = self.first_pt[self.selection]
+        counts = self.num_pts[self.selection]
+        # indices of all points of the selected tracks, without a loop
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return values[np.arange(counts.sum()) + offsets]
+
+    def to_netcdf(self, filename):
+        """
+        Write the selected tracks to a netCDF file in the TR2NC layout.
+
+        Parameters
+        ----------
+
+        filename : string
+            Path of output .nc file
+
+        """
+        counts = self.num_pts[self.selection]
+        data = Dataset(filename, 'w')
+        data.Conventions = "CF-1.7"
+        data.featureType = "trajectory"
+        data.createDimension('tracks', len(self.selection))
+        data.createDimension('record', int(counts.sum()))
+
+        var = data.createVariable('TRACK_ID', 'i4', ('tracks',))
+        var.cf_role = "trajectory_id"
+        var[:] = self.track_id[self.selection]
+        data.createVariable('FIRST_PT', 'i4', ('tracks',))[:] = \
+            np.cumsum(counts) - counts
+        var = data.createVariable('NUM_PTS', 'i4', ('tracks',))
+        var.sample_dimension = "record"
+        var[:] = counts
+        data.createVariable('index', 'i4', ('record',))[:] = \
+            np.arange(counts.sum())
+        var = data.createVariable('time', 'f8', ('record',))
+        var.units = self.time_units
+        var[:] = self.points('time')
+        var = data.createVariable('longitude', 'f4', ('record',))
+        var.units = "degrees_east"
+        var[:] = self.points('lon')
+        var = data.createVariable('latitude', 'f4', ('record',))
+        var.units = "degrees_north"
+        var[:] = self.points('lat')
+        for name in self.fields:
+            data.createVariable(name, 'f4', ('record',))[:] = self.points(name)
+        data.close()
+        return
+
+def _time_in_hours(var, points):
+    # reads a range of a TR2NC time variable in hours, with its units
+    # changed to match
+    units = getattr(var, 'units', 'hours')
+    values = np.asarray(var[points], dtype=np.float64)
+    if units.startswith('days'):
+        return values * 24, 'hours' + units[len('days'):]
+    return values, units
+
+def read_tracks(filename, tracks=None):
+    """
+    Read tracks from a TR2NC netCDF file into a TrackCollection.
+
+    Parameters
+    ----------
+
+    filename : string
+        Path to .nc file produced by TR2NC, e.g. ff_trs_neg.nc
+
+    tracks : slice, optional
+        Range of tracks to read. Only the points of these tracks are read.
+
+    """
+    data = Dataset(filename, 'r')
+    if tracks is None:
+        tracks = slice(None)
+    first_pt = np.asarray(data.variables['FIRST_PT'][tracks], dtype=np.int64)
+    num_pts = np.asarray(data.variables['NUM_PTS'][tracks], dtype=np.int64)
+
+    if len(first_pt) > 0:
+        points = slice(first_pt[0], first_pt[-1] + num_pts[-1])
+    else:
+        points = slice(0, 0)
+
+    time, units = _time_in_hours(data.variables['time'], points)
+    fields = {name: data.variables[name][points] for name in data.variables
+                if name not in _TR2NC_VARS}
+    collection = TrackCollection(data.variables['TRACK_ID'][tracks],
+                                 first_pt - points.start, num_pts, time,
+                                 data.variables['longitude'][points],
+                                 data.variables['latitude'][points],
+                                 fields, time_units=units)
+    data.close()
+    return collection
+
+def iter_tracks(filename, chunk_tracks=10000):
+    """
+    Read tracks from a TR2NC netCDF file in chunks, so that long multi-decade
+    files can be processed with bounded memory.
+
+    Parameters
+    ----------
+
+    filename : string
+        Path to .nc file produced by TR2NC
+
+    chunk_tracks : int, optional
+        Number of tracks per chunk
+
+    Yields
+    ------
+
+    collection : TrackCollection
+        Tracks of one chunk
+
+    """
+    data = Dataset(filename, 'r')
+    ntracks = len(data.dimensions['tracks'])
+    data.close()
+    for start in range(0, ntracks, chunk_tracks):
+        yield read_tracks(filename, slice(start, start + chunk_tracks))